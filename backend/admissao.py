@@ -0,0 +1,158 @@
+"""Controle de admissão dos endpoints de autenticação (/login e /register)
+
+O bcrypt é caro de propósito: uma rajada de credential stuffing ocupa toda a
+CPU e derruba a latência do resto da API. Antes do hash, cada request passa por:
+
+- token buckets por IP e por email (taxa sustentada + rajada), guardados num
+  LRU limitado (ADMISSAO_CHAVES_MAX) para a memória não crescer com IPs novos;
+- um limite global de operações bcrypt simultâneas (ADMISSAO_BCRYPT_MAX). Quem
+  não consegue vaga espera na fila, mas só enquanto a espera estimada couber no
+  orçamento de latência (ADMISSAO_ORCAMENTO_MS); passado isso, 429 na hora.
+
+Toda recusa é 429 com Retry-After. O estado é por processo. Atrás de um proxy,
+o IP do cliente vem do X-Forwarded-For (uvicorn --proxy-headers).
+"""
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Hashable, Optional
+
+from fastapi import HTTPException
+
+from security import BCRYPT_WORKERS
+
+ADMISSAO_ATIVA = os.getenv("ADMISSAO_ATIVA", "true").lower() in ("1", "true", "sim")
+# Tentativas por segundo (taxa sustentada) e rajada máxima, por IP e por email
+ADMISSAO_IP_TAXA = float(os.getenv("ADMISSAO_IP_TAXA", "2"))
+ADMISSAO_IP_RAJADA = float(os.getenv("ADMISSAO_IP_RAJADA", "20"))
+ADMISSAO_EMAIL_TAXA = float(os.getenv("ADMISSAO_EMAIL_TAXA", "0.1"))
+ADMISSAO_EMAIL_RAJADA = float(os.getenv("ADMISSAO_EMAIL_RAJADA", "5"))
+ADMISSAO_CHAVES_MAX = int(os.getenv("ADMISSAO_CHAVES_MAX", "100000"))
+ADMISSAO_BCRYPT_MAX = int(os.getenv("ADMISSAO_BCRYPT_MAX", str(BCRYPT_WORKERS)))
+ADMISSAO_ORCAMENTO_MS = float(os.getenv("ADMISSAO_ORCAMENTO_MS", "500"))
+
+MOTIVOS = ("ip", "email", "sobrecarga")
+
+
+class BaldesTokens:
+    """Um token bucket por chave, num LRU limitado
+
+    A chave expulsa é a usada há mais tempo, que em geral já teria o balde cheio
+    de novo: perder o estado dela não afrouxa o limite de quem está insistindo.
+    """
+
+    def __init__(self, taxa: float, rajada: float, capacidade: int):
+        self.taxa = taxa
+        self.rajada = rajada
+        self.capacidade = capacidade
+        self._baldes: "OrderedDict[Hashable, list]" = OrderedDict()
+        self.evictions = 0
+
+    def consumir(self, chave: Hashable) -> float:
+        """Gasta um token; retorna 0 se havia, senão os segundos até o próximo"""
+        agora = time.monotonic()
+        balde = self._baldes.get(chave)
+        if balde is None:
+            balde = self._baldes[chave] = [self.rajada, agora]
+            while len(self._baldes) > self.capacidade:
+                self._baldes.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._baldes.move_to_end(chave)
+            balde[0] = min(self.rajada, balde[0] + (agora - balde[1]) * self.taxa)
+            balde[1] = agora
+        if balde[0] >= 1:
+            balde[0] -= 1
+            return 0.0
+        return (1 - balde[0]) / self.taxa
+
+    def __len__(self) -> int:
+        return len(self._baldes)
+
+
+class ControleAdmissao:
+    def __init__(self, ativo: bool, bcrypt_max: int, orcamento: float):
+        self.ativo = ativo
+        self.bcrypt_max = bcrypt_max
+        self.orcamento = orcamento
+        self.por_ip = BaldesTokens(ADMISSAO_IP_TAXA, ADMISSAO_IP_RAJADA, ADMISSAO_CHAVES_MAX)
+        self.por_email = BaldesTokens(ADMISSAO_EMAIL_TAXA, ADMISSAO_EMAIL_RAJADA, ADMISSAO_CHAVES_MAX)
+        self._semaforo = asyncio.Semaphore(bcrypt_max)
+        self.em_execucao = 0
+        self.esperando = 0
+        # Média móvel da duração de um bcrypt, para estimar a espera na fila
+        self.duracao_media = 0.0
+        self.admitidas = 0
+        self.recusadas: Dict[str, int] = dict.fromkeys(MOTIVOS, 0)
+
+    def _recusar(self, motivo: str, espera: float) -> HTTPException:
+        self.recusadas[motivo] += 1
+        return HTTPException(
+            status_code=429, detail="Muitas tentativas, tente novamente em instantes",
+            headers={"Retry-After": str(max(1, math.ceil(espera)))}
+        )
+
+    def limitar(self, ip: Optional[str], email: str) -> None:
+        """Aplica os limites por IP e por email; levanta 429 se algum estourou"""
+        if not self.ativo:
+            return
+        if ip:
+            espera = self.por_ip.consumir(ip)
+            if espera:
+                raise self._recusar("ip", espera)
+        espera = self.por_email.consumir(email.lower())
+        if espera:
+            raise self._recusar("email", espera)
+
+    def espera_estimada(self) -> float:
+        """Segundos que um novo request esperaria por uma vaga de bcrypt"""
+        if self.em_execucao < self.bcrypt_max:
+            return 0.0
+        return (self.esperando + 1) / self.bcrypt_max * self.duracao_media
+
+    @asynccontextmanager
+    async def bcrypt(self):
+        """Vaga para uma operação bcrypt, ou 429 se a fila passou do orçamento de latência"""
+        if not self.ativo:
+            yield
+            return
+        espera = self.espera_estimada()
+        if espera > self.orcamento:
+            raise self._recusar("sobrecarga", espera)
+
+        self.esperando += 1
+        try:
+            await asyncio.wait_for(self._semaforo.acquire(), self.orcamento)
+        except asyncio.TimeoutError:
+            raise self._recusar("sobrecarga", self.espera_estimada())
+        finally:
+            self.esperando -= 1
+
+        self.em_execucao += 1
+        self.admitidas += 1
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            duracao = time.perf_counter() - inicio
+            self.duracao_media = duracao if not self.duracao_media else 0.9 * self.duracao_media + 0.1 * duracao
+            self.em_execucao -= 1
+            self._semaforo.release()
+
+    def estatisticas(self) -> dict:
+        return {
+            "ativo": self.ativo,
+            "admitidas": self.admitidas,
+            "recusadas": dict(self.recusadas),
+            "bcrypt_em_execucao": self.em_execucao,
+            "bcrypt_esperando": self.esperando,
+            "bcrypt_duracao_media_ms": round(self.duracao_media * 1000, 3),
+            "chaves": {"ip": len(self.por_ip), "email": len(self.por_email)},
+            "evictions": self.por_ip.evictions + self.por_email.evictions,
+        }
+
+
+controle = ControleAdmissao(ADMISSAO_ATIVA, ADMISSAO_BCRYPT_MAX, ADMISSAO_ORCAMENTO_MS / 1000)
@@ -0,0 +1,334 @@
+"""Agregados mantidos incrementalmente e rotinas de reconciliação
+
+Uso pela linha de comando:
+    python agregados.py reconciliar [--apenas-verificar]
+    python agregados.py backfill-campanhas [--recalcular-valor]
+    python agregados.py reconstruir-rollups [--campanha ID]
+"""
+import argparse
+import asyncio
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Mapping, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from sqlalchemy import case, func, literal, or_, select, union_all
+from sqlalchemy.dialects.postgresql import insert as insert_postgresql
+from sqlalchemy.dialects.sqlite import insert as insert_sqlite
+
+from models import users, campanhas, doacoes, contadores, doacoes_arquivo, doacoes_diarias, doacoes_cidades
+
+TOTAL_CAMPANHAS_ATIVAS = "total_campanhas_ativas"
+TOTAL_ARRECADADO = "total_arrecadado"
+TOTAL_DOACOES = "total_doacoes"
+TOTAL_USUARIOS = "total_usuarios"
+
+CONTADORES = (TOTAL_CAMPANHAS_ATIVAS, TOTAL_ARRECADADO, TOTAL_DOACOES, TOTAL_USUARIOS)
+
+# Linhas por contador; cada incremento escolhe uma ao acaso
+FATIAS = 8
+
+# Contadores que representam quantidades (os demais são valores em reais)
+_INTEIROS = (TOTAL_CAMPANHAS_ATIVAS, TOTAL_DOACOES, TOTAL_USUARIOS)
+
+
+async def incrementar(database, nome: str, delta: float = 1) -> None:
+    """Soma `delta` a um contador (deve rodar na transação da escrita que o altera)"""
+    query = contadores.update().where(
+        (contadores.c.nome == nome) & (contadores.c.fatia == random.randrange(FATIAS))
+    ).values(valor=contadores.c.valor + delta)
+    await database.execute(query)
+
+
+def valores_confirmacao(valor: float, data_doacao) -> dict:
+    """Atualização dos agregados de uma campanha ao confirmar uma doação
+
+    Tudo é calculado pelo próprio banco, dentro do UPDATE da campanha.
+    """
+    c = campanhas.c
+    return {
+        "valor_arrecadado": c.valor_arrecadado + valor,
+        "total_doacoes": c.total_doacoes + 1,
+        "doacao_minima": case(
+            (or_(c.doacao_minima.is_(None), c.doacao_minima > valor), valor),
+            else_=c.doacao_minima
+        ),
+        "doacao_maxima": case(
+            (or_(c.doacao_maxima.is_(None), c.doacao_maxima < valor), valor),
+            else_=c.doacao_maxima
+        ),
+        "ultima_doacao_em": case(
+            (or_(c.ultima_doacao_em.is_(None), c.ultima_doacao_em < data_doacao), data_doacao),
+            else_=c.ultima_doacao_em
+        ),
+    }
+
+
+# Fuso que define o "dia" dos rollups diários
+ROLLUP_FUSO = os.getenv("ROLLUP_FUSO", "America/Sao_Paulo")
+try:
+    _FUSO = ZoneInfo(ROLLUP_FUSO)
+except ZoneInfoNotFoundError:
+    # Sem base de fusos no sistema: horário de Brasília (sem horário de verão desde 2019)
+    _FUSO = timezone(timedelta(hours=-3))
+
+
+def dia_local(data: datetime):
+    """Dia da doação no fuso dos rollups (datas sem fuso são UTC)"""
+    if data.tzinfo is None:
+        data = data.replace(tzinfo=timezone.utc)
+    return data.astimezone(_FUSO).date()
+
+
+def _dia_sql(database, coluna):
+    """Mesmo cálculo de `dia_local`, feito pelo banco"""
+    if database.url.dialect == "postgresql":
+        return func.date(func.timezone(ROLLUP_FUSO, coluna))
+    # SQLite não tem fusos: desloca a data UTC gravada pelo offset atual do fuso
+    minutos = int(datetime.now(_FUSO).utcoffset().total_seconds() // 60)
+    return func.date(coluna, f"{minutos:+d} minutes")
+
+
+async def _somar_rollup(database, tabela, linhas: Dict[tuple, list]) -> None:
+    chaves = [coluna.name for coluna in tabela.primary_key]
+    insert = insert_postgresql if database.url.dialect == "postgresql" else insert_sqlite
+    query = insert(tabela).values([
+        # Ordem fixa das chaves: transações concorrentes travam as linhas na mesma ordem
+        {**dict(zip(chaves, chave)), "quantidade": quantidade, "total": total}
+        for chave, (quantidade, total) in sorted(linhas.items())
+    ])
+    query = query.on_conflict_do_update(index_elements=chaves, set_={
+        "quantidade": tabela.c.quantidade + query.excluded.quantidade,
+        "total": tabela.c.total + query.excluded.total,
+    })
+    await database.execute(query)
+
+
+async def registrar_rollups(database, linhas: Iterable[Mapping], status_anterior: Optional[str],
+                            status_novo: str) -> None:
+    """Move doações de `status_anterior` (None se são novas) para `status_novo` nos rollups
+
+    Cada linha precisa de campanha_id, data_doacao, uf, cidade e valor. Deve rodar
+    na transação da escrita que muda o status.
+    """
+    fatia = random.randrange(FATIAS)
+    diarias: Dict[tuple, list] = {}
+    cidades: Dict[tuple, list] = {}
+    for linha in linhas:
+        dia = dia_local(linha["data_doacao"])
+        movimentos = [(status_novo, 1)] if status_anterior is None else [(status_anterior, -1), (status_novo, 1)]
+        for status, sinal in movimentos:
+            for rollup, chave in (
+                (diarias, (linha["campanha_id"], dia, linha["uf"], status, fatia)),
+                (cidades, (linha["campanha_id"], linha["uf"], linha["cidade"], status, fatia)),
+            ):
+                soma = rollup.setdefault(chave, [0, 0.0])
+                soma[0] += sinal
+                soma[1] += sinal * linha["valor"]
+    if diarias:
+        await _somar_rollup(database, doacoes_diarias, diarias)
+        await _somar_rollup(database, doacoes_cidades, cidades)
+
+
+async def reconstruir_rollups(database, campanha_id: Optional[int] = None, lote: int = 500) -> int:
+    """Recalcula os rollups a partir de `doacoes` e `doacoes_arquivo`
+
+    Corrige qualquer divergência acumulada; com `campanha_id`, só a dessa campanha.
+    As campanhas são processadas em lotes de ids, cada lote na sua transação.
+    Retorna o número de doações contadas.
+    """
+    if campanha_id is not None:
+        return await _reconstruir_rollups_faixa(database, campanha_id, campanha_id)
+    
+    maior_id = await database.fetch_val(select(func.max(union_all(*[
+        select(func.max(coluna).label("id"))
+        for coluna in (campanhas.c.id, doacoes_arquivo.c.campanha_id,
+                       doacoes_diarias.c.campanha_id, doacoes_cidades.c.campanha_id)
+    ]).subquery().c.id))) or 0
+    contadas = 0
+    for inicio in range(0, maior_id, lote):
+        contadas += await _reconstruir_rollups_faixa(database, inicio + 1, inicio + lote)
+    return contadas
+
+
+async def _reconstruir_rollups_faixa(database, primeira: int, ultima: int) -> int:
+    colunas = ("campanha_id", "data_doacao", "uf", "cidade", "status", "valor")
+    partes = [
+        select(*[tabela.c[nome] for nome in colunas]).where(tabela.c.campanha_id.between(primeira, ultima))
+        for tabela in (doacoes, doacoes_arquivo)
+    ]
+    origem = union_all(*partes).subquery()
+    
+    async with database.transaction():
+        if database.url.dialect == "postgresql":
+            # Segura os incrementos concorrentes até o commit, como na reconciliação dos contadores
+            await database.execute("LOCK TABLE doacoes_diarias, doacoes_cidades IN SHARE ROW EXCLUSIVE MODE")
+        
+        for tabela, chaves in (
+            (doacoes_diarias, [origem.c.campanha_id, _dia_sql(database, origem.c.data_doacao).label("dia"),
+                               origem.c.uf, origem.c.status]),
+            (doacoes_cidades, [origem.c.campanha_id, origem.c.uf, origem.c.cidade, origem.c.status]),
+        ):
+            await database.execute(tabela.delete().where(tabela.c.campanha_id.between(primeira, ultima)))
+            await database.execute(tabela.insert().from_select(
+                [chave.name for chave in chaves] + ["fatia", "quantidade", "total"],
+                select(*chaves, literal(0), func.count(), func.sum(origem.c.valor)).group_by(*chaves)
+            ))
+        
+        return await database.fetch_val(select(func.count()).select_from(origem))
+
+
+def _normalizar(valores: Dict[str, float]) -> Dict[str, float]:
+    return {
+        nome: int(valores.get(nome) or 0) if nome in _INTEIROS else float(valores.get(nome) or 0)
+        for nome in CONTADORES
+    }
+
+
+async def ler_contadores(database) -> Dict[str, float]:
+    """Lê todos os contadores em uma única consulta (custo fixo, independe do volume de dados)"""
+    query = select(contadores.c.nome, func.sum(contadores.c.valor).label("valor")).group_by(contadores.c.nome)
+    linhas = await database.fetch_all(query)
+    return _normalizar({linha["nome"]: linha["valor"] for linha in linhas})
+
+
+async def calcular_contadores(database) -> Dict[str, float]:
+    """Recalcula os contadores a partir das tabelas base (varredura completa)"""
+    query = select(
+        select(func.count()).select_from(campanhas).where(campanhas.c.ativa == True)
+        .scalar_subquery().label(TOTAL_CAMPANHAS_ATIVAS),
+        select(func.sum(campanhas.c.valor_arrecadado)).where(campanhas.c.ativa == True)
+        .scalar_subquery().label(TOTAL_ARRECADADO),
+        select(func.count()).select_from(doacoes).where(doacoes.c.status == "confirmado")
+        .scalar_subquery().label(TOTAL_DOACOES),
+        select(func.count()).select_from(users)
+        .scalar_subquery().label(TOTAL_USUARIOS),
+    )
+    linha = await database.fetch_one(query)
+    return _normalizar(dict(linha))
+
+
+async def reconciliar(database, corrigir: bool = True) -> Dict[str, dict]:
+    """Reconstrói os contadores a partir das tabelas base e informa a divergência
+
+    Retorna, para cada contador, o valor armazenado, o valor real e a diferença.
+    """
+    async with database.transaction():
+        if corrigir and database.url.dialect == "postgresql":
+            # Bloqueia incrementos concorrentes até o commit, para não perder nenhum
+            await database.execute("LOCK TABLE contadores IN SHARE ROW EXCLUSIVE MODE")
+        
+        armazenados = await ler_contadores(database)
+        reais = await calcular_contadores(database)
+        
+        if corrigir:
+            await database.execute(contadores.delete())
+            await database.execute(contadores.insert().values([
+                {"nome": nome, "fatia": fatia, "valor": valor if fatia == 0 else 0}
+                for nome, valor in reais.items()
+                for fatia in range(FATIAS)
+            ]))
+    
+    return {
+        nome: {
+            "armazenado": armazenados[nome],
+            "real": reais[nome],
+            "divergencia": reais[nome] - armazenados[nome],
+        }
+        for nome in CONTADORES
+    }
+
+
+async def garantir_contadores(database) -> None:
+    """Inicializa os contadores a partir das tabelas base se ainda não existirem"""
+    query = select(func.count()).select_from(contadores)
+    if await database.fetch_val(query) != len(CONTADORES) * FATIAS:
+        await reconciliar(database)
+
+
+async def backfill_campanhas(database, recalcular_valor: bool = False, lote: int = 500) -> int:
+    """Preenche os agregados por campanha a partir das doações confirmadas
+
+    Processa as campanhas em lotes de ids para não segurar locks longos.
+    Com `recalcular_valor`, também reescreve valor_arrecadado como a soma das
+    doações confirmadas e soma a diferença das campanhas ativas ao contador
+    TOTAL_ARRECADADO, na mesma transação do lote. Retorna o número de campanhas
+    processadas.
+    """
+    confirmadas = (doacoes.c.campanha_id == campanhas.c.id) & (doacoes.c.status == "confirmado")
+    
+    def agregado(expr):
+        return select(expr).where(confirmadas).scalar_subquery()
+    
+    valores = {
+        "total_doacoes": agregado(func.count()),
+        "doacao_minima": agregado(func.min(doacoes.c.valor)),
+        "doacao_maxima": agregado(func.max(doacoes.c.valor)),
+        "ultima_doacao_em": agregado(func.max(doacoes.c.data_doacao)),
+    }
+    if recalcular_valor:
+        valores["valor_arrecadado"] = func.coalesce(agregado(func.sum(doacoes.c.valor)), 0.0)
+    
+    maior_id = await database.fetch_val(select(func.max(campanhas.c.id))) or 0
+    processadas = 0
+    for inicio in range(0, maior_id, lote):
+        faixa = (campanhas.c.id > inicio) & (campanhas.c.id <= inicio + lote)
+        async with database.transaction():
+            if recalcular_valor:
+                # Trava as campanhas do lote: nenhuma confirmação altera o valor
+                # entre esta leitura e o UPDATE, e o delta do contador fica exato
+                anteriores = await database.fetch_all(
+                    select(campanhas.c.valor_arrecadado)
+                    .where(faixa & (campanhas.c.ativa == True)).with_for_update()
+                )
+            query = campanhas.update().where(faixa).values(**valores).returning(
+                campanhas.c.valor_arrecadado, campanhas.c.ativa
+            )
+            atualizadas = await database.fetch_all(query)
+            processadas += len(atualizadas)
+            if recalcular_valor:
+                delta = (
+                    sum(linha["valor_arrecadado"] or 0 for linha in atualizadas if linha["ativa"])
+                    - sum(linha["valor_arrecadado"] or 0 for linha in anteriores)
+                )
+                if delta:
+                    await incrementar(database, TOTAL_ARRECADADO, delta)
+    
+    return processadas
+
+
+async def _main(args) -> None:
+    from db import database
+    
+    await database.connect()
+    try:
+        if args.comando == "reconciliar":
+            relatorio = await reconciliar(database, corrigir=not args.apenas_verificar)
+            for nome, linha in relatorio.items():
+                marca = "⚠️ " if linha["divergencia"] else "✅"
+                print(f"{marca} {nome}: armazenado={linha['armazenado']} real={linha['real']} divergência={linha['divergencia']}")
+        elif args.comando == "backfill-campanhas":
+            total = await backfill_campanhas(database, recalcular_valor=args.recalcular_valor)
+            print(f"✅ Agregados preenchidos para {total} campanhas")
+        elif args.comando == "reconstruir-rollups":
+            total = await reconstruir_rollups(database, args.campanha)
+            print(f"✅ Rollups reconstruídos a partir de {total} doações")
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manutenção dos agregados da plataforma")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    
+    p_reconciliar = sub.add_parser("reconciliar", help="Reconstrói os contadores de /stats/geral")
+    p_reconciliar.add_argument("--apenas-verificar", action="store_true", help="Só relata a divergência, sem corrigir")
+    
+    p_backfill = sub.add_parser("backfill-campanhas", help="Preenche os agregados por campanha")
+    p_backfill.add_argument("--recalcular-valor", action="store_true", help="Também recalcula valor_arrecadado")
+    
+    p_rollups = sub.add_parser("reconstruir-rollups", help="Recalcula os rollups diários e regionais")
+    p_rollups.add_argument("--campanha", type=int, help="Só a campanha com este id")
+    
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,771 @@
+"""Suíte de benchmark do ciclo de doações
+
+Sobe a aplicação no próprio processo (sem servidor HTTP), contra um banco local
+descartável: SQLite via aiosqlite por padrão, ou um PostgreSQL local com --database-url.
+Popula usuários, campanhas e doações em volume realista e roda os cenários,
+imprimindo throughput e p50/p95/p99 por endpoint em JSON para comparar commits.
+
+Exemplos:
+    python bench.py                                   # todos os cenários, SQLite
+    python bench.py --cenarios misto --duracao 30 --saida resultado.json
+    python bench.py --database-url postgresql://postgres@localhost/bench_juntos
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from cliente_asgi import ClienteASGI, Resposta
+
+BANCO_SQLITE_PADRAO = "bench_juntosmais.db"
+SENHA_PADRAO = "senha123"
+
+UFS = ["SP", "RJ", "MG", "BA", "PR", "RS", "PE", "CE", "SC", "GO"]
+CIDADES = ["São Paulo", "Rio de Janeiro", "Belo Horizonte", "Salvador", "Curitiba",
+           "Porto Alegre", "Recife", "Fortaleza", "Florianópolis", "Goiânia"]
+CATEGORIAS = ["educação", "saúde", "meio ambiente", "animais", "fome", "moradia", "cultura"]
+
+
+# --- Cliente HTTP ---
+
+class ClienteHTTP:
+    """Uma conexão HTTP/1.1 keep-alive, para medir o servidor de verdade (servidor.py)
+
+    Mínimo necessário para respostas com Content-Length (os endpoints JSON).
+    """
+
+    def __init__(self, host: str, porta: int):
+        self.host = host
+        self.porta = porta
+        self._leitor: Optional[asyncio.StreamReader] = None
+        self._escritor: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, metodo: str, caminho: str, corpo=None, headers: Optional[dict] = None, **_):
+        try:
+            return await self._request(metodo, caminho, corpo, headers)
+        except Exception:
+            # Resposta pela metade: a conexão não serve mais
+            await self.fechar()
+            raise
+
+    async def _request(self, metodo: str, caminho: str, corpo, headers: Optional[dict]):
+        if self._escritor is None:
+            self._leitor, self._escritor = await asyncio.open_connection(self.host, self.porta)
+        dados = json.dumps(corpo).encode() if corpo is not None else b""
+        linhas = [f"{metodo} {caminho} HTTP/1.1", f"Host: {self.host}", f"Content-Length: {len(dados)}"]
+        if corpo is not None:
+            linhas.append("Content-Type: application/json")
+        linhas += [f"{k}: {v}" for k, v in (headers or {}).items()]
+        self._escritor.write(("\r\n".join(linhas) + "\r\n\r\n").encode() + dados)
+
+        cabecalho = await self._leitor.readuntil(b"\r\n\r\n")
+        status_linha, *campos = cabecalho.decode("latin-1").split("\r\n")
+        cabecalhos = {}
+        for campo in campos:
+            if campo:
+                nome, _, valor = campo.partition(":")
+                cabecalhos[nome.strip().lower()] = valor.strip()
+        conteudo = await self._leitor.readexactly(int(cabecalhos.get("content-length", 0)))
+        if cabecalhos.get("connection") == "close":
+            await self.fechar()
+        return Resposta(int(status_linha.split()[1]), cabecalhos, conteudo, len(conteudo))
+
+    async def fechar(self) -> None:
+        if self._escritor is not None:
+            self._escritor.close()
+            self._escritor = None
+
+
+# --- Coleta de latências ---
+
+def percentil(valores: List[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = max(0, min(len(ordenados) - 1, int(round(p / 100 * len(ordenados) + 0.5)) - 1))
+    return ordenados[indice]
+
+
+class Medidor:
+    def __init__(self):
+        self.latencias: Dict[str, List[float]] = {}
+        self.erros: Dict[str, int] = {}
+
+    async def medir(self, rotulo: str, chamada, esperado=(200, 201, 304)):
+        inicio = time.perf_counter()
+        try:
+            resposta = await chamada
+        except Exception:
+            resposta = None
+        self.latencias.setdefault(rotulo, []).append(time.perf_counter() - inicio)
+        if resposta is None or resposta.status not in esperado:
+            self.erros[rotulo] = self.erros.get(rotulo, 0) + 1
+        return resposta
+
+    def relatorio(self, duracao: float) -> dict:
+        endpoints = {}
+        for rotulo, valores in sorted(self.latencias.items()):
+            endpoints[rotulo] = {
+                "n": len(valores),
+                "erros": self.erros.get(rotulo, 0),
+                "rps": round(len(valores) / duracao, 2) if duracao else 0.0,
+                "p50_ms": round(percentil(valores, 50) * 1000, 3),
+                "p95_ms": round(percentil(valores, 95) * 1000, 3),
+                "p99_ms": round(percentil(valores, 99) * 1000, 3),
+                "max_ms": round(max(valores) * 1000, 3),
+            }
+        total = sum(len(v) for v in self.latencias.values())
+        return {
+            "duracao_s": round(duracao, 3),
+            "total_requests": total,
+            "throughput_rps": round(total / duracao, 2) if duracao else 0.0,
+            "endpoints": endpoints,
+        }
+
+
+# --- Dados ---
+
+def payload_doacao(rng: random.Random, campanha_id: int, user_id: Optional[int] = None) -> dict:
+    i = rng.randrange(len(UFS))
+    return {
+        "campanha_id": campanha_id,
+        "user_id": user_id,
+        "valor": round(rng.choice([10, 20, 25, 50, 100, 200]) * rng.uniform(0.5, 2), 2),
+        "doador_nome": f"Doador {rng.randrange(10**6)}",
+        "doador_cpf": f"{rng.randrange(10**11):011d}",
+        "doador_email": f"doador{rng.randrange(10**6)}@exemplo.com",
+        "rua": "Rua das Flores",
+        "numero": str(rng.randrange(1, 2000)),
+        "complemento": None,
+        "bairro": "Centro",
+        "cidade": CIDADES[i],
+        "uf": UFS[i],
+        "cep": f"{rng.randrange(10**8):08d}",
+    }
+
+
+async def popular(database, rng: random.Random, n_usuarios: int, n_campanhas: int, n_doacoes: int) -> None:
+    """Insere o volume pedido em lotes de várias linhas"""
+    import agregados
+    from models import users, campanhas, doacoes
+    from security import hash_password
+
+    senha = await hash_password(SENHA_PADRAO)
+    agora = datetime.now(timezone.utc)
+
+    async def inserir(tabela, linhas, lote=500):
+        for i in range(0, len(linhas), lote):
+            await database.execute(tabela.insert().values(linhas[i:i + lote]))
+
+    await inserir(users, [
+        {"username": f"usuario{i}", "cpf": f"{i:011d}", "email": f"usuario{i}@exemplo.com", "password": senha}
+        for i in range(1, n_usuarios + 1)
+    ])
+    await inserir(campanhas, [
+        {
+            "nome": f"Campanha {i}", "tipo_categoria": rng.choice(CATEGORIAS),
+            "descricao": "Campanha gerada pelo benchmark", "localizacao": f"{rng.choice(CIDADES)}, {rng.choice(UFS)}",
+            "meta_valor": rng.choice([5000, 10000, 50000, 100000]), "valor_arrecadado": 0.0,
+            "total_doacoes": 0, "ativa": True, "rating": 4.8,
+            "data_inicio": agora - timedelta(days=rng.randrange(365), seconds=rng.randrange(86400)),
+        }
+        for i in range(1, n_campanhas + 1)
+    ])
+    linhas = []
+    for _ in range(n_doacoes):
+        # Distribuição concentrada: poucas campanhas recebem a maior parte das doações
+        campanha_id = min(n_campanhas, int(rng.paretovariate(1.2))) if n_campanhas else 1
+        linha = payload_doacao(rng, campanha_id, rng.choice([None, rng.randrange(1, n_usuarios + 1)]) if n_usuarios else None)
+        linha.update({
+            "status": rng.choices(["confirmado", "pendente", "cancelado"], [70, 20, 10])[0],
+            "metodo_pagamento": "PIX",
+            "data_doacao": agora - timedelta(seconds=rng.randrange(365 * 86400)),
+        })
+        linhas.append(linha)
+    await inserir(doacoes, linhas)
+
+    await agregados.backfill_campanhas(database, recalcular_valor=True)
+    await agregados.reconciliar(database)
+    await agregados.reconstruir_rollups(database)
+
+
+# --- Cenários ---
+
+async def rodar_por(duracao: float, concorrencia: int, passo: Callable) -> float:
+    """Roda `passo` em `concorrencia` tarefas até acabar o tempo; retorna a duração real"""
+    fim = time.perf_counter() + duracao
+    inicio = time.perf_counter()
+
+    async def trabalhador(n):
+        while time.perf_counter() < fim:
+            await passo(n)
+            # Acertos de cache respondem sem I/O; cede o loop para as outras tarefas
+            await asyncio.sleep(0)
+
+    await asyncio.gather(*[trabalhador(n) for n in range(concorrencia)])
+    return time.perf_counter() - inicio
+
+
+async def cenario_misto(cliente, ctx) -> dict:
+    """Navegação, doação + confirmação, estatísticas, login e cadastro misturados"""
+    medidor = Medidor()
+    rng = random.Random(ctx["seed"])
+    contador = iter(range(10**9))
+
+    async def navegar():
+        await medidor.medir("GET /campanhas", cliente.request("GET", "/campanhas"))
+
+    async def detalhe():
+        cid = rng.randrange(1, ctx["campanhas"] + 1)
+        await medidor.medir("GET /campanhas/{id}", cliente.request("GET", f"/campanhas/{cid}"))
+
+    async def doacoes_campanha():
+        cid = min(ctx["campanhas"], int(rng.paretovariate(1.2)))
+        await medidor.medir("GET /doacoes/campanha/{id}", cliente.request("GET", f"/doacoes/campanha/{cid}"))
+
+    async def doar_e_confirmar():
+        cid = min(ctx["campanhas"], int(rng.paretovariate(1.2)))
+        resposta = await medidor.medir("POST /doacoes/", cliente.request("POST", "/doacoes/", payload_doacao(rng, cid)))
+        if resposta and resposta.status == 201:
+            doacao_id = resposta.json()["id"]
+            await medidor.medir(
+                "PATCH /doacoes/{id}/confirmar", cliente.request("PATCH", f"/doacoes/{doacao_id}/confirmar")
+            )
+
+    async def stats_geral():
+        await medidor.medir("GET /stats/geral", cliente.request("GET", "/stats/geral"))
+
+    async def stats_campanha():
+        cid = rng.randrange(1, ctx["campanhas"] + 1)
+        await medidor.medir("GET /stats/campanha/{id}", cliente.request("GET", f"/stats/campanha/{cid}"))
+
+    async def stats_serie():
+        cid = rng.randrange(1, ctx["campanhas"] + 1)
+        await medidor.medir("GET /stats/campanha/{id}/serie", cliente.request("GET", f"/stats/campanha/{cid}/serie"))
+
+    async def stats_regioes():
+        cid = rng.randrange(1, ctx["campanhas"] + 1)
+        await medidor.medir("GET /stats/regioes", cliente.request("GET", f"/stats/regioes?campanha_id={cid}"))
+
+    async def login():
+        uid = rng.randrange(1, ctx["usuarios"] + 1)
+        await medidor.medir("POST /login", cliente.request(
+            "POST", "/login", {"email": f"usuario{uid}@exemplo.com", "password": SENHA_PADRAO}
+        ))
+
+    async def cadastro():
+        n = next(contador)
+        await medidor.medir("POST /register", cliente.request("POST", "/register", {
+            "username": f"misto{ctx['seed']}_{n}", "cpf": f"9{ctx['seed'] % 10}{n:09d}",
+            "email": f"misto{ctx['seed']}_{n}@exemplo.com", "password": SENHA_PADRAO,
+        }))
+
+    acoes = [navegar, detalhe, doacoes_campanha, doar_e_confirmar, stats_geral, stats_campanha,
+             stats_serie, stats_regioes, login, cadastro]
+    pesos = [30, 25, 10, 15, 5, 5, 2, 2, 5, 5]
+
+    async def passo(_):
+        await rng.choices(acoes, pesos)[0]()
+
+    duracao = await rodar_por(ctx["duracao"], ctx["concorrencia"], passo)
+    return medidor.relatorio(duracao)
+
+
+async def cenario_rajada_login(cliente, ctx) -> dict:
+    """Latência de GET /campanhas com e sem uma rajada de logins em paralelo"""
+    rng = random.Random(ctx["seed"])
+
+    async def leitura(medidor):
+        await medidor.medir("GET /campanhas", cliente.request("GET", "/campanhas?limit=20"))
+
+    async def login(medidor):
+        uid = rng.randrange(1, ctx["usuarios"] + 1)
+        await medidor.medir("POST /login", cliente.request(
+            "POST", "/login", {"email": f"usuario{uid}@exemplo.com", "password": SENHA_PADRAO}
+        ))
+
+    resultado = {}
+    for fase, logins in (("sem_rajada", 0), ("com_rajada", ctx["concorrencia"])):
+        medidor = Medidor()
+        leitores = max(1, ctx["concorrencia"] // 4)
+
+        async def passo(n):
+            await (leitura(medidor) if n < leitores else login(medidor))
+
+        duracao = await rodar_por(ctx["duracao"], leitores + logins, passo)
+        resultado[fase] = medidor.relatorio(duracao)
+    return resultado
+
+
+async def cenario_inundacao_auth(cliente, ctx) -> dict:
+    """Latência de leitura durante uma inundação de logins inválidos, com e sem controle de admissão
+
+    Os logins chegam em taxa fixa (--auth-taxa por segundo, sem esperar as
+    respostas), como num ataque real. Sem admissão a fila do bcrypt cresce sem
+    limite; `esvaziamento_s` é quanto tempo ela ainda leva para se esvaziar.
+    """
+    import admissao
+
+    rng = random.Random(ctx["seed"])
+    ips = [f"10.0.{i // 256}.{i % 256}" for i in range(1024)]
+
+    async def leitura(medidor):
+        campanha_id = rng.randrange(1, ctx["campanhas"] + 1)
+        await medidor.medir("GET /stats/campanha/{id}", cliente.request("GET", f"/stats/campanha/{campanha_id}"))
+
+    async def login_invalido(medidor):
+        uid = rng.randrange(1, ctx["usuarios"] + 1)
+        await medidor.medir("POST /login", cliente.request(
+            "POST", "/login", {"email": f"usuario{uid}@exemplo.com", "password": "senha-errada"},
+            ip=rng.choice(ips)
+        ), esperado=(401, 429))
+
+    async def inundar(medidor, fim, pendentes):
+        intervalo = 1 / ctx["auth_taxa"]
+        proximo = time.perf_counter()
+        while time.perf_counter() < fim:
+            pendentes.append(asyncio.create_task(login_invalido(medidor)))
+            proximo += intervalo
+            await asyncio.sleep(max(0.0, proximo - time.perf_counter()))
+
+    ativo = admissao.controle.ativo
+    resultado = {}
+    fases = (("sem_rajada", False, False), ("rajada_com_admissao", True, True), ("rajada_sem_admissao", True, False))
+    try:
+        for fase, com_rajada, com_admissao in fases:
+            admissao.controle.ativo = com_admissao
+            recusadas_antes = sum(admissao.controle.recusadas.values())
+            medidor = Medidor()
+            pendentes = []
+            inundacao = None
+            if com_rajada:
+                inundacao = asyncio.create_task(inundar(medidor, time.perf_counter() + ctx["duracao"], pendentes))
+            duracao = await rodar_por(ctx["duracao"], max(1, ctx["concorrencia"] // 4), lambda n: leitura(medidor))
+            resultado[fase] = medidor.relatorio(duracao)
+            if inundacao is not None:
+                await inundacao
+                inicio = time.perf_counter()
+                await asyncio.gather(*pendentes)
+                resultado[fase]["esvaziamento_s"] = round(time.perf_counter() - inicio, 2)
+            resultado[fase]["recusadas_429"] = sum(admissao.controle.recusadas.values()) - recusadas_antes
+    finally:
+        admissao.controle.ativo = ativo
+    return resultado
+
+
+async def cenario_sessao(cliente, ctx) -> dict:
+    """Custo de se identificar a cada request: novo login (bcrypt) vs. token de acesso"""
+    import tokens
+
+    rng = random.Random(ctx["seed"])
+    uids = rng.sample(range(1, ctx["usuarios"] + 1), min(50, ctx["usuarios"]))
+    sessoes = {}
+    for uid in uids:
+        resposta = await cliente.request(
+            "POST", "/login", {"email": f"usuario{uid}@exemplo.com", "password": SENHA_PADRAO}
+        )
+        sessoes[uid] = resposta.json()["token"]
+
+    async def relogin(medidor):
+        uid = rng.choice(uids)
+        await medidor.medir("POST /login + GET /users/me/{id}", _relogin(uid))
+
+    async def _relogin(uid):
+        await cliente.request("POST", "/login", {"email": f"usuario{uid}@exemplo.com", "password": SENHA_PADRAO})
+        return await cliente.request("GET", f"/users/me/{uid}")
+
+    async def com_token(medidor):
+        token = sessoes[rng.choice(uids)]
+        await medidor.medir("GET /users/me (Bearer)", cliente.request(
+            "GET", "/users/me", headers={"Authorization": f"Bearer {token}"}
+        ))
+
+    resultado = {}
+    for fase, passo in (("relogin", relogin), ("token", com_token)):
+        medidor = Medidor()
+        duracao = await rodar_por(ctx["duracao"], ctx["concorrencia"], lambda n: passo(medidor))
+        resultado[fase] = medidor.relatorio(duracao)
+
+    # Verificação isolada: HMAC + decodificação vs. acerto no cache de tokens
+    token = sessoes[uids[0]]
+    n = 20_000
+    inicio = time.perf_counter()
+    for _ in range(n):
+        tokens._verificados.limpar()
+        tokens.verificar(token)
+    sem_cache = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    for _ in range(n):
+        tokens.verificar(token)
+    com_cache = time.perf_counter() - inicio
+    resultado["verificacao_us"] = {"sem_cache": round(sem_cache / n * 1e6, 2), "com_cache": round(com_cache / n * 1e6, 2)}
+    return resultado
+
+
+async def cenario_servidor(cliente, ctx) -> dict:
+    """Requests por segundo via HTTP: servidor.py com um worker vs. com --workers
+
+    Sobe o servidor como subprocesso no mesmo banco e mede leituras por conexões
+    keep-alive. O gerador de carga roda num único processo e disputa CPU com os
+    workers: compare os modos entre si, na mesma máquina.
+    """
+    import socket
+
+    rng = random.Random(ctx["seed"])
+    resultado = {}
+    for workers in sorted({1, ctx["workers"]}):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            porta = sock.getsockname()[1]
+        ambiente = {**os.environ, "SERVIDOR_WORKERS": str(workers), "SERVIDOR_HOST": "127.0.0.1", "PORT": str(porta)}
+        processo = subprocess.Popen(
+            [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "servidor.py")],
+            env=ambiente, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        fase = f"workers_{workers}"
+        try:
+            prazo = time.perf_counter() + 60
+            while True:
+                try:
+                    saude = ClienteHTTP("127.0.0.1", porta)
+                    if (await saude.request("GET", "/health")).status == 200:
+                        await saude.fechar()
+                        break
+                except OSError:
+                    pass
+                if time.perf_counter() > prazo or processo.poll() is not None:
+                    raise RuntimeError(f"servidor.py ({workers} workers) não subiu")
+                await asyncio.sleep(0.2)
+
+            conexoes = [ClienteHTTP("127.0.0.1", porta) for _ in range(ctx["concorrencia"])]
+            medidor = Medidor()
+
+            async def passo(n):
+                campanha_id = rng.randrange(1, ctx["campanhas"] + 1)
+                rotulo, caminho = rng.choice((
+                    ("GET /campanhas", "/campanhas?limit=20"),
+                    ("GET /campanhas/{id}", f"/campanhas/{campanha_id}"),
+                    ("GET /stats/campanha/{id}", f"/stats/campanha/{campanha_id}"),
+                ))
+                await medidor.medir(rotulo, conexoes[n].request("GET", caminho))
+
+            duracao = await rodar_por(ctx["duracao"], ctx["concorrencia"], passo)
+            resultado[fase] = medidor.relatorio(duracao)
+            for conexao in conexoes:
+                await conexao.fechar()
+        finally:
+            # SIGTERM: mede o encerramento gracioso (drenagem + shutdown da aplicação)
+            inicio = time.perf_counter()
+            processo.terminate()
+            await asyncio.to_thread(processo.wait, 60)
+            resultado.setdefault(fase, {})["encerramento_s"] = round(time.perf_counter() - inicio, 2)
+    return resultado
+
+
+async def cenario_confirmacao_paralela(cliente, ctx) -> dict:
+    """Confirma N doações da mesma campanha em paralelo e confere o total"""
+    from db import database
+    from models import campanhas
+
+    rng = random.Random(ctx["seed"])
+    medidor = Medidor()
+    n = ctx["paralelas"]
+    campanha_id = 1
+    antes = await database.fetch_val(campanhas.select().with_only_columns(campanhas.c.valor_arrecadado)
+                                     .where(campanhas.c.id == campanha_id))
+
+    criadas = await asyncio.gather(*[
+        cliente.request("POST", "/doacoes/", payload_doacao(rng, campanha_id)) for _ in range(n)
+    ])
+    doacoes = [r.json() for r in criadas if r.status == 201]
+
+    inicio = time.perf_counter()
+    # Cada doação é confirmada duas vezes ao mesmo tempo: só uma pode valer
+    await asyncio.gather(*[
+        medidor.medir("PATCH /doacoes/{id}/confirmar", cliente.request("PATCH", f"/doacoes/{d['id']}/confirmar"),
+                      esperado=(200, 400))
+        for d in doacoes for _ in range(2)
+    ])
+    duracao = time.perf_counter() - inicio
+
+    depois = await database.fetch_val(campanhas.select().with_only_columns(campanhas.c.valor_arrecadado)
+                                      .where(campanhas.c.id == campanha_id))
+    esperado = antes + sum(d["valor"] for d in doacoes)
+    relatorio = medidor.relatorio(duracao)
+    relatorio["consistente"] = abs(depois - esperado) < 0.01
+    relatorio["valor_esperado"] = round(esperado, 2)
+    relatorio["valor_final"] = round(depois, 2)
+    return relatorio
+
+
+async def cenario_cadastro(cliente, ctx) -> dict:
+    """Cadastros por segundo"""
+    medidor = Medidor()
+    contador = iter(range(10**9))
+
+    async def passo(_):
+        n = next(contador)
+        await medidor.medir("POST /register", cliente.request("POST", "/register", {
+            "username": f"bench{ctx['seed']}_{n}", "cpf": f"8{ctx['seed'] % 10}{n:09d}",
+            "email": f"bench{ctx['seed']}_{n}@exemplo.com", "password": SENHA_PADRAO,
+        }))
+
+    duracao = await rodar_por(ctx["duracao"], ctx["concorrencia"], passo)
+    return medidor.relatorio(duracao)
+
+
+async def cenario_ingestao(cliente, ctx) -> dict:
+    """Doações inseridas por segundo: um insert por request vs. ingestão em lote"""
+    import ingestao
+    from db import database
+
+    rng = random.Random(ctx["seed"])
+    ingestor = ingestao.ingestor
+    ja_ativo = ingestor.ativo
+    if ja_ativo:
+        await ingestor.encerrar()
+
+    resultado = {}
+    for modo in ("individual", "lote"):
+        medidor = Medidor()
+
+        async def passo(_):
+            cid = min(ctx["campanhas"], int(rng.paretovariate(1.2)))
+            await medidor.medir("POST /doacoes/", cliente.request("POST", "/doacoes/", payload_doacao(rng, cid)))
+
+        if modo == "lote":
+            ingestor.iniciar(database)
+        try:
+            # Pico de tráfego: mais requests simultâneos que nos outros cenários
+            duracao = await rodar_por(ctx["duracao"], ctx["concorrencia"] * 4, passo)
+        finally:
+            if modo == "lote":
+                estatisticas = ingestor.estatisticas()
+                await ingestor.encerrar()
+        resultado[modo] = medidor.relatorio(duracao)
+        inseridas = sum(len(v) for v in medidor.latencias.values()) - sum(medidor.erros.values())
+        resultado[modo]["inserts_por_segundo"] = round(inseridas / duracao, 2)
+    resultado["lote"]["ingestor"] = estatisticas
+
+    if ja_ativo:
+        ingestor.iniciar(database)
+    return resultado
+
+
+async def cenario_exportacao(cliente, ctx) -> dict:
+    """Pico de memória (tracemalloc) exportando uma campanha grande, vs. carregar tudo"""
+    import tracemalloc
+    from db import database
+    from models import campanhas, doacoes
+    from serializacao import doacao_para_dict
+
+    rng = random.Random(ctx["seed"])
+    n = ctx["exportar_linhas"]
+    campanha_id = await database.execute(campanhas.insert().values(
+        nome="Campanha exportação", tipo_categoria="saúde", descricao="Benchmark de exportação",
+        localizacao="São Paulo, SP", meta_valor=10**9, valor_arrecadado=0.0, total_doacoes=0,
+        ativa=True, rating=4.8,
+    ))
+    agora = datetime.now(timezone.utc)
+    inicio = time.perf_counter()
+    for i in range(0, n, 500):
+        linhas = []
+        for _ in range(min(500, n - i)):
+            linha = payload_doacao(rng, campanha_id)
+            linha.update({"status": "confirmado", "metodo_pagamento": "PIX",
+                          "data_doacao": agora - timedelta(seconds=rng.randrange(365 * 86400))})
+            linhas.append(linha)
+        await database.execute(doacoes.insert().values(linhas))
+    resultado = {"linhas": n, "carga_s": round(time.perf_counter() - inicio, 2)}
+
+    async def medir(nome, funcao):
+        tracemalloc.start()
+        inicio = time.perf_counter()
+        tamanho = await funcao()
+        duracao = time.perf_counter() - inicio
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        resultado[nome] = {
+            "pico_memoria_mb": round(pico / 2**20, 2),
+            "duracao_s": round(duracao, 2),
+            "linhas_por_segundo": round(n / duracao),
+            "bytes": tamanho,
+        }
+
+    async def exportar_csv():
+        resposta = await cliente.request("GET", f"/doacoes/campanha/{campanha_id}/export", guardar_corpo=False)
+        return resposta.tamanho
+
+    async def carregar_tudo():
+        # Caminho antigo: fetch_all da campanha inteira e um dict por linha
+        linhas = await database.fetch_all(doacoes.select().where(doacoes.c.campanha_id == campanha_id))
+        return len(json.dumps([doacao_para_dict(linha) for linha in linhas], default=str))
+
+    await medir("export_csv", exportar_csv)
+    await medir("fetch_all", carregar_tudo)
+    return resultado
+
+
+async def cenario_serializacao(cliente, ctx) -> dict:
+    """Microbenchmark: serializar 10k doações pelo modelo pydantic vs. caminho rápido"""
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+    from schemas import DoacaoResponse
+    import serializacao
+
+    rng = random.Random(ctx["seed"])
+    linhas = []
+    for i in range(10_000):
+        linha = payload_doacao(rng, 1)
+        linha.update({"id": i, "data_doacao": datetime.now(timezone.utc), "metodo_pagamento": "PIX",
+                      "status": "confirmado", "pix_code": None, "pix_qr_code": None})
+        linhas.append(linha)
+
+    adaptador = TypeAdapter(List[DoacaoResponse])
+
+    def via_modelo():
+        return json.dumps(jsonable_encoder(adaptador.validate_python(linhas))).encode()
+
+    def caminho_rapido():
+        return serializacao.dumps([serializacao.doacao_para_dict(linha) for linha in linhas])
+
+    resultado = {"linhas": len(linhas), "orjson": serializacao.orjson is not None}
+    for nome, funcao in (("via_modelo", via_modelo), ("caminho_rapido", caminho_rapido)):
+        funcao()
+        tempos = []
+        for _ in range(5):
+            inicio = time.perf_counter()
+            funcao()
+            tempos.append(time.perf_counter() - inicio)
+        resultado[f"{nome}_ms"] = round(min(tempos) * 1000, 2)
+    return resultado
+
+
+CENARIOS = {
+    "misto": cenario_misto,
+    "rajada_login": cenario_rajada_login,
+    "inundacao_auth": cenario_inundacao_auth,
+    "sessao": cenario_sessao,
+    "servidor": cenario_servidor,
+    "confirmacao_paralela": cenario_confirmacao_paralela,
+    "cadastro": cenario_cadastro,
+    "ingestao": cenario_ingestao,
+    "exportacao": cenario_exportacao,
+    "serializacao": cenario_serializacao,
+}
+
+
+# --- Execução ---
+
+def _commit_atual() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+async def executar(args) -> dict:
+    import main
+
+    cliente = ClienteASGI(main.app, servidor="bench")
+    for handler in main.app.router.on_startup:
+        await handler()
+    try:
+        rng = random.Random(args.seed)
+        inicio = time.perf_counter()
+        await popular(main.database, rng, args.usuarios, args.campanhas, args.doacoes)
+        tempo_carga = time.perf_counter() - inicio
+
+        ctx = {
+            "seed": args.seed, "duracao": args.duracao, "concorrencia": args.concorrencia,
+            "usuarios": args.usuarios, "campanhas": args.campanhas, "paralelas": args.paralelas,
+            "exportar_linhas": args.exportar_linhas, "auth_taxa": args.auth_taxa,
+            "workers": args.workers,
+        }
+        resultados = {}
+        for nome in args.cenarios:
+            print(f"▶️  {nome}", file=sys.stderr)
+            resultados[nome] = await CENARIOS[nome](cliente, ctx)
+    finally:
+        for handler in main.app.router.on_shutdown:
+            await handler()
+
+    return {
+        "meta": {
+            "commit": _commit_atual(),
+            "data": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "banco": main.database.url.dialect,
+            "replicas": len(main.roteador.replicas),
+            "carga_s": round(tempo_carga, 3),
+            "config": {k: v for k, v in vars(args).items() if k not in ("database_url", "database_read_urls", "saida")},
+        },
+        "cenarios": resultados,
+    }
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark do ciclo de doações")
+    parser.add_argument("--database-url", help=f"Banco descartável (padrão: SQLite em ./{BANCO_SQLITE_PADRAO})")
+    parser.add_argument("--database-read-urls",
+                        help="Réplicas de leitura, separadas por vírgula (ex.: uma segunda instância local)")
+    parser.add_argument("--cenarios", default=",".join(CENARIOS),
+                        type=lambda v: [c for c in v.split(",") if c], help="Lista separada por vírgulas")
+    parser.add_argument("--usuarios", type=int, default=1_000)
+    parser.add_argument("--campanhas", type=int, default=200)
+    parser.add_argument("--doacoes", type=int, default=20_000)
+    parser.add_argument("--duracao", type=float, default=10.0, help="Segundos por cenário")
+    parser.add_argument("--concorrencia", type=int, default=16)
+    parser.add_argument("--paralelas", type=int, default=200, help="Doações do cenário confirmacao_paralela")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Workers do modo multi-worker no cenário servidor (padrão: CPUs, no mínimo 2)")
+    parser.add_argument("--auth-taxa", type=float, default=50,
+                        help="Logins inválidos por segundo no cenário inundacao_auth")
+    parser.add_argument("--exportar-linhas", type=int, default=1_000_000,
+                        help="Doações da campanha do cenário exportacao")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--saida", help="Arquivo JSON de saída (padrão: stdout)")
+    args = parser.parse_args()
+
+    if args.workers is None:
+        from servidor import cpus_disponiveis
+        args.workers = max(2, cpus_disponiveis())
+
+    desconhecidos = set(args.cenarios) - set(CENARIOS)
+    if desconhecidos:
+        parser.error(f"cenários desconhecidos: {', '.join(sorted(desconhecidos))}")
+
+    # O log de consultas lentas só atrapalha a leitura do resultado aqui
+    os.environ.setdefault("DB_SLOW_QUERY_MS", "0")
+    # Todos os requests saem do mesmo IP: só o cenário inundacao_auth liga o controle de admissão
+    os.environ.setdefault("ADMISSAO_ATIVA", "false")
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        if os.path.exists(BANCO_SQLITE_PADRAO):
+            os.remove(BANCO_SQLITE_PADRAO)
+        os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{BANCO_SQLITE_PADRAO}"
+    if args.database_read_urls:
+        os.environ["DATABASE_READ_URLS"] = args.database_read_urls
+
+    # Os prints da aplicação vão para stderr, para o JSON sair limpo no stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        relatorio = asyncio.run(executar(args))
+    resultado = json.dumps(relatorio, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            arquivo.write(resultado + "\n")
+    else:
+        print(resultado)
+
+
+if __name__ == "__main__":
+    main_cli()
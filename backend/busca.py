@@ -0,0 +1,131 @@
+"""Busca textual nas campanhas, com ranking, facetas e paginação keyset
+
+PostgreSQL: coluna `campanhas.busca` mantida por trigger (tsvector em português,
+com pesos nome > categoria/localização > descrição) com índice GIN, mais um índice de
+trigramas em `nome` (pg_trgm) para tolerar erros de digitação.
+SQLite: tabela FTS5 `campanhas_busca` (external content) mantida por triggers.
+As estruturas são criadas pela migração 5 (migrations.py).
+
+Nos dois casos cada termo é buscado por prefixo ("educ" encontra "educação").
+"""
+import re
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, column, func, literal_column, or_, select, table
+
+from models import campanhas
+from pagination import desempacotar_cursor, empacotar_cursor
+
+# Termos considerados por busca e valores listados por faceta
+MAX_TERMOS = 8
+MAX_FACETAS = 20
+
+_CONFIG_TS = literal_column("'portuguese'::regconfig")
+_busca_pg = literal_column("campanhas.busca")
+_fts = table("campanhas_busca", column("rowid"))
+_fts_tabela = literal_column("campanhas_busca")
+
+# None até a primeira busca no PostgreSQL (o índice de trigramas é opcional)
+_tem_trigramas: Optional[bool] = None
+
+
+# --- Consulta ---
+
+def termos(texto: str) -> List[str]:
+    """Palavras da busca, sem operadores nem pontuação"""
+    return re.findall(r"\w+", texto.lower())[:MAX_TERMOS]
+
+
+async def _trigramas(database) -> bool:
+    global _tem_trigramas
+    if _tem_trigramas is None:
+        _tem_trigramas = bool(await database.fetch_val(
+            "SELECT count(*) FROM pg_indexes WHERE indexname = 'ix_campanhas_nome_trgm'"
+        ))
+    return _tem_trigramas
+
+
+async def _correspondencia(database, texto: str, palavras: List[str]):
+    """(from, condição de match, expressão de relevância) do dialeto em uso"""
+    if database.url.dialect == "postgresql":
+        consulta = func.to_tsquery(_CONFIG_TS, " & ".join(f"{p}:*" for p in palavras))
+        condicao = _busca_pg.op("@@")(consulta)
+        relevancia = func.ts_rank_cd(_busca_pg, consulta)
+        if await _trigramas(database):
+            condicao = or_(condicao, campanhas.c.nome.op("%")(texto))
+            relevancia = relevancia + func.similarity(campanhas.c.nome, texto)
+        return campanhas, condicao, relevancia
+
+    consulta = " ".join(f'"{p}"*' for p in palavras)
+    origem = _fts.join(campanhas, campanhas.c.id == _fts.c.rowid)
+    # bm25 é menor quanto mais relevante; pesos na ordem das colunas do FTS
+    relevancia = -func.bm25(_fts_tabela, 10.0, 5.0, 5.0, 1.0)
+    return origem, _fts_tabela.op("MATCH")(consulta), relevancia
+
+
+async def buscar(
+    database,
+    texto: str,
+    categoria: Optional[str] = None,
+    localizacao: Optional[str] = None,
+    ativas: Optional[bool] = True,
+    limite: int = 20,
+    cursor: Optional[str] = None,
+) -> Tuple[list, Optional[str], Optional[dict]]:
+    """Campanhas que casam com `texto`, da mais para a menos relevante
+
+    Retorna (linhas, cursor da próxima página, facetas). As facetas só são
+    calculadas na primeira página; cada uma ignora o próprio filtro, para que o
+    cliente possa trocar de categoria/localização sem perder as opções.
+    """
+    palavras = termos(texto)
+    if not palavras:
+        raise HTTPException(status_code=400, detail="Informe ao menos uma palavra para buscar")
+    origem, condicao, relevancia = await _correspondencia(database, texto, palavras)
+
+    filtros = {}
+    if categoria:
+        filtros["categoria"] = campanhas.c.tipo_categoria == categoria
+    if localizacao:
+        filtros["localizacao"] = campanhas.c.localizacao == localizacao
+    base = [condicao]
+    if ativas is not None:
+        base.append(campanhas.c.ativa == ativas)
+
+    subconsulta = select(campanhas, relevancia.label("relevancia")).select_from(origem).where(
+        *base, *filtros.values()
+    ).subquery()
+    query = select(subconsulta)
+    if cursor:
+        try:
+            ultima_relevancia, ultimo_id = desempacotar_cursor(cursor)
+            ultima_relevancia, ultimo_id = float(ultima_relevancia), int(ultimo_id)
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+        query = query.where(or_(
+            subconsulta.c.relevancia < ultima_relevancia,
+            and_(subconsulta.c.relevancia == ultima_relevancia, subconsulta.c.id < ultimo_id),
+        ))
+    query = query.order_by(subconsulta.c.relevancia.desc(), subconsulta.c.id.desc()).limit(limite)
+    linhas = await database.fetch_all(query)
+
+    proximo = None
+    if len(linhas) == limite:
+        proximo = empacotar_cursor([linhas[-1]["relevancia"], linhas[-1]["id"]])
+
+    facetas = None
+    if not cursor:
+        facetas = {}
+        for nome, coluna in (("categoria", campanhas.c.tipo_categoria), ("localizacao", campanhas.c.localizacao)):
+            outros = [f for chave, f in filtros.items() if chave != nome]
+            contagem = func.count().label("quantidade")
+            query_faceta = select(coluna.label("valor"), contagem).select_from(origem).where(
+                *base, *outros
+            ).group_by(coluna).order_by(contagem.desc(), coluna).limit(MAX_FACETAS)
+            facetas[nome] = [
+                {"valor": linha["valor"], "quantidade": linha["quantidade"]}
+                for linha in await database.fetch_all(query_faceta)
+            ]
+
+    return linhas, proximo, facetas
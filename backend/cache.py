@@ -0,0 +1,102 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from fastapi import Request, Response
+
+# Tempo de vida (segundos) e capacidade dos caches de leitura de campanhas
+CACHE_CAMPANHAS_TTL = float(os.getenv("CACHE_CAMPANHAS_TTL", "5"))
+CACHE_CAMPANHAS_TAMANHO = int(os.getenv("CACHE_CAMPANHAS_TAMANHO", "1024"))
+
+
+class CacheTTL:
+    """Cache LRU em memória, com tempo de vida por entrada e contadores de uso
+
+    Cada invalidação incrementa `versao`; quem leu do banco antes de uma
+    invalidação passa a versão lida para `set`, que descarta o valor obsoleto.
+    """
+
+    def __init__(self, capacidade: int, ttl: float):
+        self.capacidade = capacidade
+        self.ttl = ttl
+        self.versao = 0
+        self._itens: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expiracoes = 0
+
+    def get(self, chave: Hashable) -> Optional[Any]:
+        item = self._itens.get(chave)
+        if item is None:
+            self.misses += 1
+            return None
+        expira_em, valor = item
+        if expira_em < time.monotonic():
+            del self._itens[chave]
+            self.expiracoes += 1
+            self.misses += 1
+            return None
+        self._itens.move_to_end(chave)
+        self.hits += 1
+        return valor
+
+    def set(self, chave: Hashable, valor: Any, versao: Optional[int] = None) -> None:
+        if versao is not None and versao != self.versao:
+            return
+        self._itens[chave] = (time.monotonic() + self.ttl, valor)
+        self._itens.move_to_end(chave)
+        while len(self._itens) > self.capacidade:
+            self._itens.popitem(last=False)
+            self.evictions += 1
+
+    def invalidar(self, chave: Hashable) -> None:
+        self.versao += 1
+        self._itens.pop(chave, None)
+
+    def limpar(self) -> None:
+        self.versao += 1
+        self._itens.clear()
+
+    def estatisticas(self) -> dict:
+        return {
+            "itens": len(self._itens),
+            "capacidade": self.capacidade,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expiracoes": self.expiracoes,
+        }
+
+
+class RespostaCacheada:
+    """Corpo JSON já serializado, com ETag e cabeçalhos extras"""
+
+    __slots__ = ("corpo", "etag", "headers")
+
+    def __init__(self, corpo: bytes, headers: Optional[dict] = None):
+        self.corpo = corpo
+        self.etag = '"' + hashlib.blake2b(corpo, digest_size=16).hexdigest() + '"'
+        self.headers = headers or {}
+
+    def responder(self, request: Request) -> Response:
+        """200 com o corpo pronto, ou 304 se o cliente já tem esta versão"""
+        headers = {**self.headers, "ETag": self.etag}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and self.etag in [t.strip() for t in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        return Response(content=self.corpo, media_type="application/json", headers=headers)
+
+
+# Detalhe por id e listagens (chave: filtros + cursor)
+cache_campanhas = CacheTTL(CACHE_CAMPANHAS_TAMANHO, CACHE_CAMPANHAS_TTL)
+cache_listas_campanhas = CacheTTL(CACHE_CAMPANHAS_TAMANHO, CACHE_CAMPANHAS_TTL)
+
+
+def invalidar_campanha(campanha_id: int) -> None:
+    """Remove a campanha do cache de detalhe e descarta todas as listagens"""
+    cache_campanhas.invalidar(campanha_id)
+    cache_listas_campanhas.limpar()
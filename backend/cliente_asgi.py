@@ -0,0 +1,67 @@
+"""Cliente HTTP em processo: chama a aplicação ASGI diretamente, sem rede
+
+Usado pelos testes (tests/conftest.py) e pelo benchmark (bench.py).
+"""
+import asyncio
+import json
+from typing import NamedTuple, Optional
+
+
+class Resposta(NamedTuple):
+    status: int
+    headers: dict
+    corpo: bytes
+    tamanho: int
+
+    def json(self):
+        return json.loads(self.corpo)
+
+
+class ClienteASGI:
+    def __init__(self, app, servidor: str = "asgi"):
+        self.app = app
+        self.servidor = servidor
+
+    async def request(self, metodo: str, caminho: str, corpo=None, headers: Optional[dict] = None,
+                      guardar_corpo: bool = True, ip: str = "127.0.0.1") -> Resposta:
+        """Executa um request e devolve a resposta completa
+
+        Com `guardar_corpo=False` o corpo é descartado conforme chega e só o tamanho
+        é contado (para medir a memória de respostas em streaming). Os nomes dos
+        cabeçalhos da resposta ficam como a aplicação os enviou (minúsculos).
+        """
+        cabecalhos = [(nome.lower().encode(), valor.encode()) for nome, valor in (headers or {}).items()]
+        dados = b""
+        if corpo is not None:
+            dados = json.dumps(corpo).encode()
+            cabecalhos.append((b"content-type", b"application/json"))
+        caminho, _, query = caminho.partition("?")
+        escopo = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": metodo,
+            "scheme": "http", "path": caminho, "raw_path": caminho.encode(), "root_path": "",
+            "query_string": query.encode(), "headers": cabecalhos,
+            "client": (ip, 50000), "server": (self.servidor, 80),
+        }
+        enviado = False
+        resposta = {"status": None, "headers": {}, "corpo": b"", "tamanho": 0}
+
+        async def receive():
+            nonlocal enviado
+            if not enviado:
+                enviado = True
+                return {"type": "http.request", "body": dados, "more_body": False}
+            # Conexão aberta até a resposta terminar
+            await asyncio.Event().wait()
+
+        async def send(mensagem):
+            if mensagem["type"] == "http.response.start":
+                resposta["status"] = mensagem["status"]
+                resposta["headers"] = {nome.decode(): valor.decode() for nome, valor in mensagem.get("headers", [])}
+            elif mensagem["type"] == "http.response.body":
+                pedaco = mensagem.get("body", b"")
+                resposta["tamanho"] += len(pedaco)
+                if guardar_corpo:
+                    resposta["corpo"] += pedaco
+
+        await self.app(escopo, receive, send)
+        return Resposta(resposta["status"], resposta["headers"], resposta["corpo"], resposta["tamanho"])
@@ -1,20 +1,361 @@
-from databases import Database
-from sqlalchemy import MetaData, create_engine
+from databases import Database as _Database
+from databases.core import Connection
+from sqlalchemy import MetaData
 from sqlalchemy.ext.declarative import declarative_base
+from asyncpg.exceptions import (
+    CannotConnectNowError, InterfaceError, PostgresConnectionError, UniqueViolationError
+)
+from contextvars import ContextVar
+from typing import Iterable, List, Optional
+import asyncio
+import logging
 import os
+import sqlite3
+import time
+
+from metrics import registrar_consulta
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-database = Database(DATABASE_URL)
+# Configuração do pool assíncrono (só se aplica ao PostgreSQL/asyncpg)
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "2"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_CONNECT_TIMEOUT = float(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
 
-Base = declarative_base()
+# Réplicas de leitura (opcional), separadas por vírgula
+DATABASE_READ_URLS = [url.strip() for url in os.getenv("DATABASE_READ_URLS", "").split(",") if url.strip()]
+# Atraso máximo (s) de replicação para a réplica continuar recebendo leituras
+DB_REPLICA_ATRASO_MAX = float(os.getenv("DB_REPLICA_ATRASO_MAX", "5"))
+# Intervalo (s) entre as verificações de saúde das réplicas
+DB_REPLICA_INTERVALO = float(os.getenv("DB_REPLICA_INTERVALO", "5"))
+
+logger = logging.getLogger("uvicorn.error")
+
+# Marca a task (o request) que já escreveu no primário: dali em diante ela lê do primário
+_escreveu = ContextVar("escreveu_no_primario", default=False)
+
+# Falhas que indicam réplica fora do ar (e não erro na consulta)
+_ERROS_CONEXAO = (OSError, asyncio.TimeoutError, InterfaceError, PostgresConnectionError, CannotConnectNowError)
+
+
+class _ConexaoMedida(Connection):
+    """Conexão que mede quanto tempo a task esperou para obter uma conexão do pool"""
+
+    async def __aenter__(self) -> Connection:
+        inicio = time.perf_counter()
+        conexao = await super().__aenter__()
+        if self._connection_counter == 1:
+            self._database.registrar_espera(time.perf_counter() - inicio)
+        return conexao
+
+
+class Database(_Database):
+    """`databases.Database` com estatísticas de uso do pool e tempo de cada consulta"""
+
+    def __init__(self, url, **options):
+        super().__init__(url, **options)
+        self.aquisicoes = 0
+        self.espera_total = 0.0
+        self.espera_maxima = 0.0
+
+    def connection(self) -> Connection:
+        if self._global_connection is not None:
+            return self._global_connection
+
+        if not self._connection:
+            self._connection = _ConexaoMedida(self, self._backend)
+
+        return self._connection
+
+    async def fetch_all(self, query, values=None):
+        inicio = time.perf_counter()
+        try:
+            return await super().fetch_all(query, values)
+        finally:
+            registrar_consulta("fetch_all", query, time.perf_counter() - inicio)
+
+    async def fetch_one(self, query, values=None):
+        inicio = time.perf_counter()
+        try:
+            return await super().fetch_one(query, values)
+        finally:
+            registrar_consulta("fetch_one", query, time.perf_counter() - inicio)
+
+    async def fetch_val(self, query, values=None, column=0):
+        inicio = time.perf_counter()
+        try:
+            return await super().fetch_val(query, values, column)
+        finally:
+            registrar_consulta("fetch_val", query, time.perf_counter() - inicio)
+
+    def transaction(self, *args, **kwargs):
+        _escreveu.set(True)
+        return super().transaction(*args, **kwargs)
+
+    async def execute(self, query, values=None):
+        _escreveu.set(True)
+        inicio = time.perf_counter()
+        try:
+            return await super().execute(query, values)
+        finally:
+            registrar_consulta("execute", query, time.perf_counter() - inicio)
+
+    async def execute_many(self, query, values):
+        _escreveu.set(True)
+        inicio = time.perf_counter()
+        try:
+            return await super().execute_many(query, values)
+        finally:
+            registrar_consulta("execute_many", query, time.perf_counter() - inicio)
+
+    def registrar_espera(self, segundos: float) -> None:
+        self.aquisicoes += 1
+        self.espera_total += segundos
+        self.espera_maxima = max(self.espera_maxima, segundos)
+
+    @property
+    def _pool(self):
+        # Pool do asyncpg (None em outros backends ou antes de conectar)
+        return getattr(self._backend, "_pool", None) if self.url.dialect == "postgresql" else None
+
+    async def aquecer(self) -> None:
+        """Abre e valida as conexões mínimas do pool antes do primeiro request"""
+        pool = self._pool
+        if pool is None:
+            await self.fetch_one("SELECT 1")
+            return
+
+        async def ping():
+            async with pool.acquire() as conexao:
+                await conexao.fetchval("SELECT 1")
+
+        await asyncio.gather(*[ping() for _ in range(pool.get_min_size())])
+
+    def estatisticas(self) -> dict:
+        """Conexões em uso/ociosas e tempo de espera por conexão"""
+        pool = self._pool
+        estatisticas = {
+            "aquisicoes": self.aquisicoes,
+            "espera_media_ms": round(self.espera_total / self.aquisicoes * 1000, 3) if self.aquisicoes else 0.0,
+            "espera_maxima_ms": round(self.espera_maxima * 1000, 3),
+        }
+        if pool is not None:
+            tamanho = pool.get_size()
+            ociosas = pool.get_idle_size()
+            estatisticas.update({
+                "min": pool.get_min_size(),
+                "max": pool.get_max_size(),
+                "tamanho": tamanho,
+                "em_uso": tamanho - ociosas,
+                "ociosas": ociosas,
+            })
+        return estatisticas
+
+
+def _opcoes_pool(url: str) -> dict:
+    if url and url.startswith(("postgresql", "postgres")):
+        return {
+            "min_size": DB_POOL_MIN,
+            "max_size": DB_POOL_MAX,
+            "timeout": DB_CONNECT_TIMEOUT,
+            "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+        }
+    return {}
+
+
+database = Database(DATABASE_URL, **_opcoes_pool(DATABASE_URL))
+
+
+# Atraso de replicação em segundos; zero quando a réplica já aplicou tudo que recebeu
+# (senão um primário sem escritas pareceria uma réplica atrasada)
+_SQL_ATRASO_REPLICA = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
 
-engine = create_engine(
-    DATABASE_URL,
-    pool_pre_ping=True,
-    pool_size=10,
-    max_overflow=20,
-    echo=False 
+
+class Replica(Database):
+    """Réplica de leitura; se a conexão falha, marca-se indisponível e a leitura vai para o primário"""
+
+    def __init__(self, url, primario: Database, **options):
+        super().__init__(url, **options)
+        self.primario = primario
+        self.saudavel = False
+        self.atraso: Optional[float] = None
+        self.leituras = 0
+        self.falhas = 0
+
+    @property
+    def nome(self) -> str:
+        # Sem usuário e senha, para logs e métricas
+        if not self.url.hostname:
+            return self.url.database
+        return f"{self.url.hostname}:{self.url.port or ''}/{self.url.database}"
+
+    def _indisponivel(self, motivo) -> None:
+        if self.saudavel:
+            logger.warning("Réplica %s fora da rotação: %s", self.nome, motivo)
+        self.saudavel = False
+        self.atraso = None
+
+    async def _ler(self, metodo: str, *args):
+        self.leituras += 1
+        try:
+            return await getattr(super(), metodo)(*args)
+        except _ERROS_CONEXAO as e:
+            self.falhas += 1
+            self._indisponivel(e)
+            return await getattr(self.primario, metodo)(*args)
+
+    def transaction(self, *args, **kwargs):
+        # Transação só de leitura (cursor do iterate): não prende o request ao primário
+        return _Database.transaction(self, *args, **kwargs)
+
+    async def fetch_all(self, query, values=None):
+        return await self._ler("fetch_all", query, values)
+
+    async def fetch_one(self, query, values=None):
+        return await self._ler("fetch_one", query, values)
+
+    async def fetch_val(self, query, values=None, column=0):
+        return await self._ler("fetch_val", query, values, column)
+
+    async def verificar(self) -> None:
+        """Conecta se preciso e mede o atraso; atualiza se a réplica está na rotação"""
+        async def medir() -> float:
+            if not self.is_connected:
+                await self.connect()
+            if self.url.dialect != "postgresql":
+                await Database.fetch_val(self, "SELECT 1")
+                return 0.0
+            return float(await Database.fetch_val(self, _SQL_ATRASO_REPLICA))
+
+        try:
+            atraso = await asyncio.wait_for(medir(), DB_CONNECT_TIMEOUT)
+        except Exception as e:
+            self._indisponivel(e)
+            return
+
+        self.atraso = atraso
+        if atraso > DB_REPLICA_ATRASO_MAX:
+            self._indisponivel(f"atraso de {atraso:.1f}s")
+        elif not self.saudavel:
+            logger.info("Réplica %s na rotação (atraso %.1fs)", self.nome, atraso)
+            self.saudavel = True
+
+    def estatisticas(self) -> dict:
+        return {
+            "nome": self.nome,
+            "saudavel": self.saudavel,
+            "atraso_s": self.atraso,
+            "leituras": self.leituras,
+            "falhas": self.falhas,
+            "pool": super().estatisticas(),
+        }
+
+
+class RoteadorLeitura:
+    """Distribui as consultas só de leitura entre as réplicas saudáveis, em rodízio
+
+    Sem réplicas configuradas, ou quando nenhuma está saudável, tudo vai para o
+    primário. O request que já escreveu (execute ou transação no primário) lê do
+    primário até o fim, para enxergar a própria escrita.
+    """
+
+    def __init__(self, primario: Database, replicas: List[Replica], intervalo: float):
+        self.primario = primario
+        self.replicas = replicas
+        self.intervalo = intervalo
+        self.leituras_primario = 0
+        self._proxima = 0
+        self._tarefa: Optional[asyncio.Task] = None
+
+    def leitura(self) -> Database:
+        if self.replicas and not _escreveu.get():
+            for _ in range(len(self.replicas)):
+                replica = self.replicas[self._proxima % len(self.replicas)]
+                self._proxima += 1
+                if replica.saudavel:
+                    return replica
+        self.leituras_primario += 1
+        return self.primario
+
+    async def fetch_one(self, query, values=None):
+        """Leitura de um registro; se a réplica não o encontra (ainda não replicado), tenta o primário"""
+        banco = self.leitura()
+        linha = await banco.fetch_one(query, values)
+        if linha is None and banco is not self.primario:
+            linha = await self.primario.fetch_one(query, values)
+        return linha
+
+    async def conectar(self) -> None:
+        """Conecta às réplicas (as que falharem entram na rotação depois) e inicia a verificação periódica"""
+        if not self.replicas:
+            return
+        await asyncio.gather(*[replica.verificar() for replica in self.replicas])
+        self._tarefa = asyncio.create_task(self._verificar_periodicamente())
+
+    async def desconectar(self) -> None:
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+            try:
+                await self._tarefa
+            except asyncio.CancelledError:
+                pass
+            self._tarefa = None
+        for replica in self.replicas:
+            if replica.is_connected:
+                await replica.disconnect()
+
+    async def _verificar_periodicamente(self) -> None:
+        while True:
+            await asyncio.sleep(self.intervalo)
+            await asyncio.gather(*[replica.verificar() for replica in self.replicas])
+
+    def estatisticas(self) -> dict:
+        return {
+            "leituras_primario": self.leituras_primario,
+            "replicas": [replica.estatisticas() for replica in self.replicas],
+        }
+
+
+roteador = RoteadorLeitura(
+    database,
+    [Replica(url, database, **_opcoes_pool(url)) for url in DATABASE_READ_URLS],
+    DB_REPLICA_INTERVALO,
 )
 
-metadata = Base.metadata
\ No newline at end of file
+
+def leitura() -> Database:
+    """Banco para uma consulta só de leitura (réplica em rodízio ou primário)"""
+    return roteador.leitura()
+
+Base = declarative_base()
+
+metadata = Base.metadata
+
+
+def coluna_duplicada(exc: Exception, colunas: Iterable[str]) -> Optional[str]:
+    """Retorna qual das `colunas` causou uma violação de unicidade, ou None se não for o caso
+
+    Olha só o nome da constraint (PostgreSQL) ou as colunas citadas pelo SQLite,
+    nunca os valores: o `detail` do PostgreSQL repete o que o usuário enviou.
+    """
+    colunas = list(colunas)
+    if isinstance(exc, UniqueViolationError):
+        # Ex.: constraint "users_email_key"
+        constraint = f"_{exc.constraint_name or ''}_"
+        citadas = {coluna for coluna in colunas if f"_{coluna}_" in constraint}
+    elif isinstance(exc, sqlite3.IntegrityError) and str(exc).startswith("UNIQUE constraint failed:"):
+        # Ex.: "UNIQUE constraint failed: users.email"
+        citadas = {nome.strip().rpartition(".")[2] for nome in str(exc).partition(":")[2].split(",")}
+    else:
+        return None
+
+    for coluna in colunas:
+        if coluna in citadas:
+            return coluna
+    return None
@@ -0,0 +1,139 @@
+"""Progresso das campanhas ao vivo via Server-Sent Events
+
+Um único broadcaster por processo: cada espectador tem uma fila pequena e cada
+atualização é serializada uma vez e entregue a todas as filas da campanha, sem
+consulta ao banco por espectador. Com vários workers/réplicas cada processo só
+vê as confirmações que ele mesmo atendeu; o espectador recebe um snapshot ao
+conectar e o cliente pode reconectar periodicamente para se realinhar.
+"""
+import asyncio
+import os
+from typing import AsyncIterator, Dict, Optional, Set
+
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from serializacao import dumps
+
+# Eventos pendentes por espectador; numa fila cheia o mais antigo é descartado
+EVENTOS_FILA = int(os.getenv("EVENTOS_FILA", "16"))
+# Intervalo (s) dos comentários de keep-alive, para proxies não fecharem a conexão
+EVENTOS_HEARTBEAT = float(os.getenv("EVENTOS_HEARTBEAT", "15"))
+# Limite de conexões SSE abertas neste processo
+EVENTOS_MAX_INSCRITOS = int(os.getenv("EVENTOS_MAX_INSCRITOS", "10000"))
+
+HEARTBEAT = b": keep-alive\n\n"
+
+
+def formatar(evento: str, dados: dict) -> bytes:
+    """Um evento SSE completo, já em bytes"""
+    return b"event: " + evento.encode() + b"\ndata: " + dumps(dados) + b"\n\n"
+
+
+class Broadcaster:
+    def __init__(self, tamanho_fila: int):
+        self.tamanho_fila = tamanho_fila
+        self._inscritos: Dict[int, Set[asyncio.Queue]] = {}
+        self.total_inscritos = 0
+        self.publicados = 0
+        self.entregues = 0
+        self.descartados = 0
+
+    def inscrever(self, campanha_id: int) -> asyncio.Queue:
+        fila: asyncio.Queue = asyncio.Queue(self.tamanho_fila)
+        self._inscritos.setdefault(campanha_id, set()).add(fila)
+        self.total_inscritos += 1
+        return fila
+
+    def cancelar(self, campanha_id: int, fila: asyncio.Queue) -> None:
+        filas = self._inscritos.get(campanha_id)
+        if filas is None or fila not in filas:
+            return
+        filas.discard(fila)
+        self.total_inscritos -= 1
+        if not filas:
+            del self._inscritos[campanha_id]
+
+    def publicar(self, campanha_id: int, evento: str, dados: dict) -> None:
+        """Entrega o evento a todos os espectadores da campanha (sem bloquear)"""
+        filas = self._inscritos.get(campanha_id)
+        self.publicados += 1
+        if not filas:
+            return
+        mensagem = formatar(evento, dados)
+        for fila in filas:
+            if fila.full():
+                # Espectador lento: o estado mais novo substitui o mais antigo
+                fila.get_nowait()
+                self.descartados += 1
+            fila.put_nowait(mensagem)
+            self.entregues += 1
+
+    def estatisticas(self) -> dict:
+        return {
+            "inscritos": self.total_inscritos,
+            "campanhas": len(self._inscritos),
+            "publicados": self.publicados,
+            "entregues": self.entregues,
+            "descartados": self.descartados,
+        }
+
+
+broadcaster = Broadcaster(EVENTOS_FILA)
+
+
+def lotado() -> bool:
+    return broadcaster.total_inscritos >= EVENTOS_MAX_INSCRITOS
+
+
+def progresso(campanha_id: int, valor_arrecadado: float, meta_valor: float,
+              total_doacoes: Optional[int] = None) -> dict:
+    """Payload do evento `progresso`"""
+    return {
+        "campanha_id": campanha_id,
+        "valor_arrecadado": float(valor_arrecadado),
+        "percentual_atingido": (valor_arrecadado / meta_valor) * 100 if meta_valor > 0 else 0,
+        "total_doacoes": total_doacoes,
+    }
+
+
+def publicar_progresso(campanha_id: int, valor_arrecadado: float, meta_valor: float,
+                       total_doacoes: Optional[int] = None) -> None:
+    """Publica o novo progresso de uma campanha"""
+    broadcaster.publicar(campanha_id, "progresso", progresso(campanha_id, valor_arrecadado, meta_valor, total_doacoes))
+
+
+def inscrever(campanha_id: int) -> asyncio.Queue:
+    """Fila de eventos de um novo espectador da campanha"""
+    return broadcaster.inscrever(campanha_id)
+
+
+def cancelar(campanha_id: int, fila: asyncio.Queue) -> None:
+    broadcaster.cancelar(campanha_id, fila)
+
+
+def transmitir(campanha_id: int, fila: asyncio.Queue, snapshot: dict) -> StreamingResponse:
+    """Resposta text/event-stream: snapshot atual e depois cada atualização
+
+    A `fila` tem de ser inscrita antes de o snapshot ser lido; as confirmações
+    publicadas nesse meio-tempo já estão nela e saem logo depois do snapshot.
+    """
+    async def eventos() -> AsyncIterator[bytes]:
+        try:
+            yield formatar("progresso", snapshot)
+            while True:
+                try:
+                    yield await asyncio.wait_for(fila.get(), EVENTOS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield HEARTBEAT
+        finally:
+            # Executado também quando o cliente desconecta e o gerador é cancelado
+            broadcaster.cancelar(campanha_id, fila)
+
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Se o cliente cair antes de o gerador começar, o finally acima não roda
+        background=BackgroundTask(cancelar, campanha_id, fila),
+    )
@@ -0,0 +1,168 @@
+"""Exportação das doações de uma campanha em CSV ou Parquet, em streaming
+
+As linhas são lidas em blocos de EXPORTACAO_LOTE por paginação keyset (uma
+consulta curta por bloco, sem transação longa) e cada bloco é convertido e
+enviado antes de o próximo ser lido: a memória fica limitada a um bloco,
+qualquer que seja o tamanho da campanha. O Parquet é gerado com `pyarrow`.
+
+A exportação inclui as doações já arquivadas (`doacoes_arquivo`). Cada bloco lê
+as próximas EXPORTACAO_LOTE linhas de cada tabela a partir do mesmo cursor,
+cada consulta pelo seu índice (campanha_id, data_doacao, id), e intercala as
+duas listas, que já vêm ordenadas, até completar o lote; o que sobra é relido
+no bloco seguinte. Como o cursor é a posição (data, id) comum às duas tabelas,
+uma doação arquivada no meio da exportação não é perdida nem repetida.
+"""
+import asyncio
+import csv
+import heapq
+import io
+import os
+from datetime import datetime
+from itertools import islice
+from typing import AsyncIterator, Optional
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+
+from models import doacoes, doacoes_arquivo
+from pagination import codificar_cursor, paginar
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # instalação sem a pyarrow: só há CSV
+    pa = None
+
+EXPORTACAO_LOTE = int(os.getenv("EXPORTACAO_LOTE", "5000"))
+
+# O payload PIX completo fica de fora: o txid identifica o pagamento
+CAMPOS = (
+    "id", "data_doacao", "status", "valor", "metodo_pagamento", "pix_txid",
+    "user_id", "doador_nome", "doador_cpf", "doador_email",
+    "rua", "numero", "complemento", "bairro", "cidade", "uf", "cep",
+)
+
+TIPOS = {"csv": "text/csv; charset=utf-8", "parquet": "application/vnd.apache.parquet"}
+
+
+def _proximas(tabela, campanha_id: int, status: Optional[str], de: Optional[datetime],
+              ate: Optional[datetime], cursor: Optional[str], lote: int):
+    """As próximas `lote` doações de uma das tabelas, a partir do cursor"""
+    query = select(*[tabela.c[campo] for campo in CAMPOS]).where(tabela.c.campanha_id == campanha_id)
+    if status:
+        query = query.where(tabela.c.status == status)
+    if de:
+        query = query.where(tabela.c.data_doacao >= de)
+    if ate:
+        query = query.where(tabela.c.data_doacao < ate)
+    return paginar(query, tabela.c.data_doacao, tabela.c.id, cursor).limit(lote)
+
+
+def _posicao(linha) -> tuple:
+    return linha["data_doacao"], linha["id"]
+
+
+async def _blocos(database, campanha_id: int, status: Optional[str],
+                  de: Optional[datetime], ate: Optional[datetime], lote: int) -> AsyncIterator[list]:
+    cursor = None
+    while True:
+        ativas, arquivadas = [
+            await database.fetch_all(_proximas(tabela, campanha_id, status, de, ate, cursor, lote))
+            for tabela in (doacoes, doacoes_arquivo)
+        ]
+        linhas = list(islice(heapq.merge(ativas, arquivadas, key=_posicao, reverse=True), lote))
+        # Só o bloco intercalado fica em memória enquanto é convertido e enviado
+        del ativas, arquivadas
+        if linhas:
+            yield linhas
+        if len(linhas) < lote:
+            return
+        cursor = codificar_cursor(linhas[-1]["data_doacao"], linhas[-1]["id"])
+
+
+_POSICAO_DATA = CAMPOS.index("data_doacao")
+
+
+def _linha_csv(linha) -> list:
+    valores = [linha[campo] for campo in CAMPOS]
+    if valores[_POSICAO_DATA] is not None:
+        valores[_POSICAO_DATA] = valores[_POSICAO_DATA].isoformat()
+    return valores
+
+
+async def _csv(blocos) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    # BOM para o Excel abrir os acentos corretamente
+    buffer.write("\ufeff")
+    escritor.writerow(CAMPOS)
+    async for linhas in blocos:
+        escritor.writerows(_linha_csv(linha) for linha in linhas)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _Saida(io.RawIOBase):
+    """Destino do ParquetWriter que entrega os bytes escritos a cada bloco
+
+    A posição nunca volta, porque o rodapé do Parquet guarda offsets absolutos.
+    """
+
+    def __init__(self):
+        self._partes = []
+        self._posicao = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, dados) -> int:
+        self._partes.append(bytes(dados))
+        self._posicao += len(dados)
+        return len(dados)
+
+    def tell(self) -> int:
+        return self._posicao
+
+    def esvaziar(self) -> bytes:
+        dados = b"".join(self._partes)
+        self._partes = []
+        return dados
+
+
+def _esquema_parquet():
+    tipos = {
+        "id": pa.int64(), "user_id": pa.int64(), "valor": pa.float64(),
+        "data_doacao": pa.timestamp("us", tz="UTC"),
+    }
+    return pa.schema([(campo, tipos.get(campo, pa.string())) for campo in CAMPOS])
+
+
+async def _parquet(blocos) -> AsyncIterator[bytes]:
+    esquema = _esquema_parquet()
+    saida = _Saida()
+    escritor = pq.ParquetWriter(saida, esquema, compression="zstd")
+    try:
+        async for linhas in blocos:
+            lote = pa.RecordBatch.from_pylist([{campo: linha[campo] for campo in CAMPOS} for linha in linhas], esquema)
+            # Compressão e codificação fora do event loop; cada bloco vira um row group
+            await asyncio.to_thread(escritor.write_batch, lote)
+            yield saida.esvaziar()
+    finally:
+        escritor.close()
+    yield saida.esvaziar()
+
+
+def exportar(database, campanha_id: int, formato: str = "csv", status: Optional[str] = None,
+             de: Optional[datetime] = None, ate: Optional[datetime] = None,
+             lote: int = EXPORTACAO_LOTE) -> StreamingResponse:
+    """StreamingResponse com as doações da campanha (mais recentes primeiro)"""
+    blocos = _blocos(database, campanha_id, status, de, ate, lote)
+    corpo = _parquet(blocos) if formato == "parquet" else _csv(blocos)
+    return StreamingResponse(
+        corpo,
+        media_type=TIPOS[formato],
+        headers={"Content-Disposition": f'attachment; filename="doacoes_campanha_{campanha_id}.{formato}"'},
+    )
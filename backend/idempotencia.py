@@ -0,0 +1,283 @@
+"""Chaves de idempotência (cabeçalho Idempotency-Key) com replay da resposta
+
+O primeiro request com uma chave a reserva com um INSERT na tabela
+`idempotencia` (chave primária escopo + chave), executa o handler e grava ali
+status, corpo e cabeçalhos; repetições com a mesma chave recebem a resposta
+gravada, em qualquer worker ou réplica do servidor. Requests simultâneos com a
+mesma chave esperam o primeiro terminar: no mesmo processo por um future, nos
+outros consultando a reserva por até IDEMPOTENCIA_ESPERA segundos (depois, 409).
+Só resultados definitivos são guardados (2xx e os erros de regra 400/404/422):
+erros temporários (429, 5xx) apagam a reserva e liberam a chave para uma nova
+tentativa.
+
+A chave vale por operação (escopo) e fica atrelada ao conteúdo do request: a
+mesma chave com outro corpo é rejeitada com 422. As chaves valem por
+IDEMPOTENCIA_TTL; a manutenção periódica apaga as vencidas. Uma reserva sem
+resposta há mais de IDEMPOTENCIA_RESERVA_TTL (processo que caiu no meio do
+request) é descartada, e a chave volta a executar o handler.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from fastapi import HTTPException, Response
+from sqlalchemy import select, tuple_
+from sqlalchemy.dialects.postgresql import insert as insert_postgresql
+from sqlalchemy.dialects.sqlite import insert as insert_sqlite
+
+from db import database
+from models import idempotencia as tabela
+from serializacao import dumps
+
+logger = logging.getLogger("uvicorn.error")
+
+HEADER_REPETIDA = "Idempotent-Replayed"
+
+IDEMPOTENCIA_TTL = float(os.getenv("IDEMPOTENCIA_TTL", "86400"))
+# Tempo máximo de execução do primeiro request antes de a reserva ser considerada abandonada
+IDEMPOTENCIA_RESERVA_TTL = float(os.getenv("IDEMPOTENCIA_RESERVA_TTL", "300"))
+# Quanto um request repetido espera pelo original em execução em outro processo
+IDEMPOTENCIA_ESPERA = float(os.getenv("IDEMPOTENCIA_ESPERA", "10"))
+IDEMPOTENCIA_INTERVALO = 0.05
+TAMANHO_MAXIMO_CHAVE = 255
+
+# Erros de regra: repetir o request com o mesmo conteúdo daria o mesmo resultado
+STATUS_ERRO_DEFINITIVO = (400, 404, 422)
+
+# Recalculados pela Response a cada envio
+_CABECALHOS_GERADOS = ("content-length", "content-type")
+
+
+def _definitivo(status: int) -> bool:
+    return 200 <= status < 300 or status in STATUS_ERRO_DEFINITIVO
+
+
+class _ResultadoTemporario(Exception):
+    """Resultado que não deve ser guardado; carrega o que responder ao request original"""
+
+    def __init__(self, resposta):
+        self.resposta = resposta
+
+
+class RespostaGuardada:
+    __slots__ = ("status", "corpo", "headers", "impressao")
+
+    def __init__(self, status: int, corpo: bytes, headers: Optional[Dict[str, str]], impressao: str):
+        self.status = status
+        self.corpo = corpo
+        self.headers = headers or {}
+        self.impressao = impressao
+
+    @classmethod
+    def da_linha(cls, linha) -> "RespostaGuardada":
+        headers = json.loads(linha["headers"]) if linha["headers"] else None
+        return cls(linha["status"], bytes(linha["corpo"]), headers, linha["impressao"])
+
+    def responder(self, repetida: bool) -> Response:
+        headers = {**self.headers, HEADER_REPETIDA: "true"} if repetida else self.headers
+        return Response(content=self.corpo, status_code=self.status, media_type="application/json", headers=headers)
+
+
+def _impressao(conteudo: Any) -> str:
+    return hashlib.blake2b(dumps(conteudo), digest_size=16).hexdigest()
+
+
+def _da_chave(escopo: str, chave: str):
+    return (tabela.c.escopo == escopo) & (tabela.c.chave == chave)
+
+
+class Idempotencia:
+    def __init__(self, database, ttl: float, reserva_ttl: float, espera: float):
+        self.database = database
+        self.ttl = ttl
+        self.reserva_ttl = reserva_ttl
+        self.espera = espera
+        # Requests deste processo em execução, para os repetidos esperarem sem consultar o banco
+        self._em_andamento: Dict[Hashable, asyncio.Future] = {}
+        self.executadas = 0
+        self.repetidas = 0
+        self.agrupadas = 0
+        self.conflitos = 0
+
+    def _conflito(self) -> HTTPException:
+        self.conflitos += 1
+        return HTTPException(status_code=422, detail="Idempotency-Key já usada com outro conteúdo de request")
+
+    def _repetir(self, guardada: RespostaGuardada, impressao: str) -> Response:
+        if guardada.impressao != impressao:
+            raise self._conflito()
+        self.repetidas += 1
+        return guardada.responder(repetida=True)
+
+    async def _inserir(self, escopo: str, chave: str, impressao: str) -> bool:
+        insert = insert_postgresql if self.database.url.dialect == "postgresql" else insert_sqlite
+        query = insert(tabela).values(
+            escopo=escopo, chave=chave, impressao=impressao, criada_em=datetime.now(timezone.utc)
+        ).on_conflict_do_nothing(index_elements=["escopo", "chave"]).returning(tabela.c.escopo)
+        return await self.database.fetch_one(query) is not None
+
+    async def _reservar(self, escopo: str, chave: str, impressao: str) -> bool:
+        """Reserva a chave para este request; False se outro request já a tem"""
+        if await self._inserir(escopo, chave, impressao):
+            return True
+        # Chave vencida ou reserva abandonada: descartada e reservada de novo
+        agora = datetime.now(timezone.utc)
+        vencida = (tabela.c.criada_em < agora - timedelta(seconds=self.ttl)) | (
+            tabela.c.status.is_(None) & (tabela.c.criada_em < agora - timedelta(seconds=self.reserva_ttl))
+        )
+        descartadas = await self.database.fetch_all(
+            tabela.delete().where(_da_chave(escopo, chave) & vencida).returning(tabela.c.escopo)
+        )
+        return bool(descartadas) and await self._inserir(escopo, chave, impressao)
+
+    async def _liberar(self, escopo: str, chave: str) -> None:
+        try:
+            await self.database.execute(tabela.delete().where(_da_chave(escopo, chave) & tabela.c.status.is_(None)))
+        except Exception:
+            # A reserva fica até IDEMPOTENCIA_RESERVA_TTL, quando é descartada
+            logger.exception("Falha ao liberar a Idempotency-Key %s/%s", escopo, chave)
+
+    async def _guardar(self, escopo: str, chave: str, guardada: RespostaGuardada) -> None:
+        await self.database.execute(tabela.update().where(_da_chave(escopo, chave)).values(
+            status=guardada.status,
+            corpo=guardada.corpo,
+            headers=dumps(guardada.headers).decode() if guardada.headers else None,
+        ))
+
+    async def executar(
+        self,
+        escopo: str,
+        chave: Optional[str],
+        conteudo: Any,
+        handler: Callable[[], Awaitable[Any]],
+        status_sucesso: int = 200,
+    ) -> Response:
+        """Executa `handler` uma vez por (escopo, chave) e repete o resultado depois
+
+        `conteudo` identifica o request (corpo e parâmetros de caminho). Sem
+        chave, apenas executa o handler.
+        """
+        if chave is None:
+            return await handler()
+        if not chave or len(chave) > TAMANHO_MAXIMO_CHAVE:
+            raise HTTPException(status_code=400, detail="Idempotency-Key inválida")
+
+        identificador = (escopo, chave)
+        impressao = _impressao(conteudo)
+        prazo = time.monotonic() + self.espera
+        agrupada = False
+
+        while True:
+            em_andamento = self._em_andamento.get(identificador)
+            if em_andamento is not None:
+                # Mesma chave em execução neste processo: espera o resultado em vez de repetir a escrita
+                agrupada = True
+                guardada = await asyncio.shield(em_andamento)
+                if guardada is not None:
+                    self.agrupadas += 1
+                    return self._repetir(guardada, impressao)
+                # O original falhou e liberou a chave
+                continue
+
+            futuro = asyncio.get_running_loop().create_future()
+            self._em_andamento[identificador] = futuro
+            try:
+                reservada = await self._reservar(escopo, chave, impressao)
+            except BaseException:
+                self._em_andamento.pop(identificador, None)
+                futuro.set_result(None)
+                raise
+            if reservada:
+                return await self._executar(identificador, futuro, impressao, handler, status_sucesso)
+            self._em_andamento.pop(identificador, None)
+            futuro.set_result(None)
+
+            linha = await self.database.fetch_one(tabela.select().where(_da_chave(escopo, chave)))
+            if linha is None:
+                # Liberada entre o INSERT e a leitura
+                continue
+            if linha["impressao"] != impressao:
+                raise self._conflito()
+            if linha["status"] is not None:
+                if agrupada:
+                    self.agrupadas += 1
+                return self._repetir(RespostaGuardada.da_linha(linha), impressao)
+
+            # Reservada por outro processo e ainda sem resposta
+            agrupada = True
+            if time.monotonic() >= prazo:
+                raise HTTPException(
+                    status_code=409, detail="O request original com esta Idempotency-Key ainda está em processamento",
+                    headers={"Retry-After": "1"}
+                )
+            await asyncio.sleep(IDEMPOTENCIA_INTERVALO)
+
+    async def _executar(self, identificador, futuro: asyncio.Future, impressao: str,
+                        handler: Callable[[], Awaitable[Any]], status_sucesso: int) -> Response:
+        escopo, chave = identificador
+        guardada = None
+        try:
+            try:
+                resultado = await handler()
+            except HTTPException as e:
+                if not _definitivo(e.status_code):
+                    raise
+                # Erros de regra (404, 400...) também são repetidos para a mesma chave
+                guardada = RespostaGuardada(e.status_code, dumps({"detail": e.detail}), e.headers, impressao)
+            else:
+                if isinstance(resultado, Response):
+                    if not _definitivo(resultado.status_code):
+                        raise _ResultadoTemporario(resultado)
+                    headers = {
+                        nome: valor for nome, valor in resultado.headers.items()
+                        if nome not in _CABECALHOS_GERADOS
+                    }
+                    guardada = RespostaGuardada(resultado.status_code, bytes(resultado.body), headers, impressao)
+                else:
+                    guardada = RespostaGuardada(status_sucesso, dumps(resultado), None, impressao)
+            await self._guardar(escopo, chave, guardada)
+        except BaseException as e:
+            if guardada is None:
+                # Falha inesperada ou temporária (429, 5xx): nada é guardado e o cliente pode tentar de novo
+                await self._liberar(escopo, chave)
+            guardada = None
+            if isinstance(e, _ResultadoTemporario):
+                return e.resposta
+            raise
+        finally:
+            self._em_andamento.pop(identificador, None)
+            futuro.set_result(guardada)
+
+        self.executadas += 1
+        return guardada.responder(repetida=False)
+
+    def estatisticas(self) -> dict:
+        return {
+            "em_andamento": len(self._em_andamento),
+            "executadas": self.executadas,
+            "repetidas": self.repetidas,
+            "agrupadas": self.agrupadas,
+            "conflitos": self.conflitos,
+        }
+
+
+async def limpar_vencidas(database, ttl: float = IDEMPOTENCIA_TTL, lote: int = 1000) -> int:
+    """Apaga as chaves com mais de `ttl` segundos, em lotes; retorna quantas apagou"""
+    limite = datetime.now(timezone.utc) - timedelta(seconds=ttl)
+    total = 0
+    while True:
+        vencidas = select(tabela.c.escopo, tabela.c.chave).where(tabela.c.criada_em < limite).limit(lote)
+        apagadas = await database.fetch_all(
+            tabela.delete().where(tuple_(tabela.c.escopo, tabela.c.chave).in_(vencidas)).returning(tabela.c.escopo)
+        )
+        total += len(apagadas)
+        if len(apagadas) < lote:
+            return total
+
+
+idempotencia = Idempotencia(database, IDEMPOTENCIA_TTL, IDEMPOTENCIA_RESERVA_TTL, IDEMPOTENCIA_ESPERA)
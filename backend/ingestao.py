@@ -0,0 +1,202 @@
+"""Ingestão de doações em lote para picos de tráfego (opcional, INGESTAO_EM_LOTE)
+
+Cada POST /doacoes/ entra numa fila e espera a sua linha. Um worker junta os
+pedidos em um único `INSERT ... VALUES (...), (...) RETURNING *`, disparado
+quando o lote enche (INGESTAO_LOTE_MAX) ou quando o mais antigo espera
+INGESTAO_ESPERA_MS. As linhas devolvidas são casadas com os pedidos pelo
+`pix_txid`, único por doação (índice único `ux_doacoes_pix_txid`: uma colisão
+falha o insert em vez de entregar a um request a linha de outro doador). Com a
+fila cheia o request é recusado com 503.
+
+A checagem de campanha ativa usa um cache curto (INGESTAO_CACHE_CAMPANHA_TTL):
+em outros processos, uma campanha recém-desativada ainda pode receber doações
+por até esse tempo.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+import agregados
+from cache import CacheTTL
+from models import campanhas, doacoes
+
+logger = logging.getLogger("uvicorn.error")
+
+INGESTAO_EM_LOTE = os.getenv("INGESTAO_EM_LOTE", "false").lower() in ("1", "true", "sim")
+INGESTAO_LOTE_MAX = int(os.getenv("INGESTAO_LOTE_MAX", "200"))
+INGESTAO_ESPERA_MS = float(os.getenv("INGESTAO_ESPERA_MS", "5"))
+INGESTAO_FILA_MAX = int(os.getenv("INGESTAO_FILA_MAX", "5000"))
+INGESTAO_CACHE_CAMPANHA_TTL = float(os.getenv("INGESTAO_CACHE_CAMPANHA_TTL", "2"))
+
+_campanhas = CacheTTL(10_000, INGESTAO_CACHE_CAMPANHA_TTL)
+_buscando: Dict[int, asyncio.Future] = {}
+
+
+async def _buscar_campanha(database, campanha_id: int):
+    query = campanhas.select().with_only_columns(
+        campanhas.c.id, campanhas.c.nome, campanhas.c.ativa
+    ).where(campanhas.c.id == campanha_id)
+    # False marca "não existe" para também poupar o banco nesse caso
+    return await database.fetch_one(query) or False
+
+
+async def obter_campanha(database, campanha_id: int):
+    """id, nome e ativa da campanha (None se não existe), com cache curto
+
+    Requests simultâneos com o cache vazio esperam uma única consulta.
+    """
+    campanha = _campanhas.get(campanha_id)
+    if campanha is not None:
+        return campanha or None
+
+    em_andamento = _buscando.get(campanha_id)
+    if em_andamento is not None:
+        campanha = await asyncio.shield(em_andamento)
+        if campanha is None:
+            # A consulta original falhou: tenta por conta própria
+            campanha = await _buscar_campanha(database, campanha_id)
+        return campanha or None
+
+    futuro = asyncio.get_running_loop().create_future()
+    _buscando[campanha_id] = futuro
+    campanha = None
+    try:
+        versao = _campanhas.versao
+        campanha = await _buscar_campanha(database, campanha_id)
+        _campanhas.set(campanha_id, campanha, versao)
+    finally:
+        del _buscando[campanha_id]
+        # None avisa quem espera que a consulta falhou
+        futuro.set_result(campanha)
+    return campanha or None
+
+
+def invalidar_campanha(campanha_id: int) -> None:
+    _campanhas.invalidar(campanha_id)
+
+
+class IngestorDoacoes:
+    def __init__(self, lote_max: int, espera: float, fila_max: int):
+        self.lote_max = lote_max
+        self.espera = espera
+        self.fila_max = fila_max
+        self._fila: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._database = None
+        self.lotes = 0
+        self.linhas = 0
+        self.recusadas = 0
+        self.falhas_lote = 0
+
+    @property
+    def ativo(self) -> bool:
+        return self._worker is not None
+
+    def iniciar(self, database) -> None:
+        self._database = database
+        self._fila = asyncio.Queue(self.fila_max)
+        self._worker = asyncio.create_task(self._executar())
+
+    async def encerrar(self) -> None:
+        """Grava o que ainda está na fila e para o worker"""
+        if self._worker is None:
+            return
+        await self._fila.join()
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    async def inserir(self, valores: dict):
+        """Enfileira a doação e devolve a linha inserida (com id e defaults do banco)"""
+        futuro = asyncio.get_running_loop().create_future()
+        try:
+            self._fila.put_nowait((valores, futuro))
+        except asyncio.QueueFull:
+            self.recusadas += 1
+            raise HTTPException(
+                status_code=503, detail="Muitas doações em processamento, tente novamente",
+                headers={"Retry-After": "1"}
+            )
+        return await futuro
+
+    async def _proximo_lote(self) -> List[Tuple[dict, asyncio.Future]]:
+        lote = [await self._fila.get()]
+        prazo = time.monotonic() + self.espera
+        while len(lote) < self.lote_max:
+            restante = prazo - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self._fila.get_nowait())
+            except asyncio.QueueEmpty:
+                try:
+                    lote.append(await asyncio.wait_for(self._fila.get(), restante))
+                except asyncio.TimeoutError:
+                    break
+        return lote
+
+    async def _executar(self) -> None:
+        while True:
+            lote = await self._proximo_lote()
+            try:
+                await self._gravar(lote)
+            except Exception as e:
+                logger.exception("Falha inesperada na ingestão em lote")
+                for _, futuro in lote:
+                    if not futuro.done():
+                        futuro.set_exception(e)
+            finally:
+                for _ in lote:
+                    self._fila.task_done()
+
+    async def _gravar(self, lote: List[Tuple[dict, asyncio.Future]]) -> None:
+        database = self._database
+        query = doacoes.insert().values([valores for valores, _ in lote]).returning(*doacoes.c)
+        try:
+            async with database.transaction():
+                linhas = await database.fetch_all(query)
+                await agregados.registrar_rollups(database, [valores for valores, _ in lote], None, "pendente")
+        except Exception:
+            # Uma linha ruim (ex.: campanha apagada) não derruba o lote: grava uma a uma
+            self.falhas_lote += 1
+            for valores, futuro in lote:
+                try:
+                    async with database.transaction():
+                        linha = await database.fetch_one(doacoes.insert().values(valores).returning(*doacoes.c))
+                        await agregados.registrar_rollups(database, [valores], None, "pendente")
+                except Exception as e:
+                    if not futuro.done():
+                        futuro.set_exception(e)
+                else:
+                    if not futuro.done():
+                        futuro.set_result(linha)
+            return
+
+        self.lotes += 1
+        self.linhas += len(linhas)
+        # A ordem do RETURNING não é garantida: casa cada linha pelo txid
+        por_txid = {linha["pix_txid"]: linha for linha in linhas}
+        for valores, futuro in lote:
+            if not futuro.done():
+                futuro.set_result(por_txid[valores["pix_txid"]])
+
+    def estatisticas(self) -> dict:
+        return {
+            "ativo": self.ativo,
+            "fila": self._fila.qsize() if self._fila else 0,
+            "lotes": self.lotes,
+            "linhas": self.linhas,
+            "linhas_por_lote": round(self.linhas / self.lotes, 2) if self.lotes else 0.0,
+            "recusadas": self.recusadas,
+            "falhas_lote": self.falhas_lote,
+        }
+
+
+ingestor = IngestorDoacoes(INGESTAO_LOTE_MAX, INGESTAO_ESPERA_MS / 1000, INGESTAO_FILA_MAX)
@@ -1,21 +1,50 @@
-from fastapi import FastAPI, HTTPException, Depends
+import time
+_inicio_import = time.perf_counter()
+
+import logging
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from db import database, Base, engine
-from models import users, campanhas, doacoes
+from fastapi.responses import PlainTextResponse, Response
+from sqlalchemy import func, select
+from db import database, coluna_duplicada, leitura, roteador
+from security import hash_password, verify_password, iniciar_pool, encerrar_pool
+from pagination import (
+    HEADER_PROXIMO_CURSOR, LIMITE_PADRAO, LIMITE_MAXIMO,
+    paginar, proximo_cursor, resposta_ndjson
+)
+from models import users, campanhas, doacoes, doacoes_arquivo, doacoes_diarias, doacoes_cidades
+import agregados
+import busca
+from migrations import garantir_esquema
+import metrics
+from cache import (
+    RespostaCacheada, cache_campanhas, cache_listas_campanhas, invalidar_campanha
+)
+import eventos
+import pix
+import ingestao
+import manutencao
+import exportacao
+import admissao
+import tokens
+from idempotencia import HEADER_REPETIDA, idempotencia
+from serializacao import JSONRapido, dumps, campanha_para_dict, doacao_para_dict
 from schemas import (
-    UserLogin, UserCreate,
+    UserLogin, UserCreate, TokenRefresh,
     CampanhaCreate, CampanhaUpdate, CampanhaResponse,
     DoacaoCreate, DoacaoResponse, DoacaoConfirmacao
 )
 from typing import List, Optional
-from datetime import datetime
+from datetime import date, datetime, timezone
+
+# Logger do uvicorn, para que as mensagens apareçam junto com as do servidor
+logger = logging.getLogger("uvicorn.error")
 
 app = FastAPI(
     title="API de Doações para ONGs",
     description="API completa para gerenciar usuários, campanhas e doações.",
     version="2.0.0"
 )
-Base.metadata.create_all(engine)
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,61 +52,130 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "PATCH"],
     allow_headers=["*"],
+    expose_headers=[HEADER_PROXIMO_CURSOR, "ETag", HEADER_REPETIDA],
 )
+app.add_middleware(metrics.MiddlewareMetricas)
 
-def hash_password(password: str) -> str:
-    """Gera hash bcrypt da senha (trunca em 72 bytes se necessário)"""
-    import bcrypt
-    # Limitar a 72 bytes (limite do bcrypt)
-    password_bytes = password.encode('utf-8')[:72]
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password_bytes, salt)
-    return hashed.decode('utf-8')
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verifica se a senha corresponde ao hash"""
-    import bcrypt
-    # Limitar a 72 bytes (limite do bcrypt)
-    password_bytes = plain_password.encode('utf-8')[:72]
-    hashed_bytes = hashed_password.encode('utf-8')
-    return bcrypt.checkpw(password_bytes, hashed_bytes)
+def _metricas_pool_e_cache():
+    """Estado do pool de conexões e dos caches, para o /metrics"""
+    pool = database.estatisticas()
+    for chave in ("em_uso", "ociosas", "tamanho", "max"):
+        if chave in pool:
+            yield f"db_pool_{chave}", "gauge", f"Conexões do pool ({chave})", [({}, pool[chave])]
+    yield "db_pool_acquisitions_total", "counter", "Conexões obtidas do pool", [({}, pool["aquisicoes"])]
+    yield "db_pool_wait_seconds_total", "counter", "Tempo total esperando conexão do pool", [({}, database.espera_total)]
+    
+    caches = {"campanhas": cache_campanhas, "listas_campanhas": cache_listas_campanhas}
+    for evento in ("hits", "misses", "evictions", "expiracoes"):
+        yield f"cache_{evento}_total", "counter", f"Cache: {evento}", [
+            ({"cache": nome}, cache.estatisticas()[evento]) for nome, cache in caches.items()
+        ]
+    
+    sse = eventos.broadcaster.estatisticas()
+    yield "sse_subscribers", "gauge", "Conexões SSE abertas", [({}, sse["inscritos"])]
+    yield "sse_events_delivered_total", "counter", "Eventos SSE entregues", [({}, sse["entregues"])]
+    yield "sse_events_dropped_total", "counter", "Eventos SSE descartados (espectador lento)", [({}, sse["descartados"])]
+    
+    lotes = ingestao.ingestor.estatisticas()
+    yield "ingest_queue_size", "gauge", "Doações esperando o próximo lote", [({}, lotes["fila"])]
+    yield "ingest_batches_total", "counter", "Lotes de doações gravados", [({}, lotes["lotes"])]
+    yield "ingest_rows_total", "counter", "Doações gravadas em lote", [({}, lotes["linhas"])]
+    yield "ingest_rejected_total", "counter", "Doações recusadas com a fila cheia", [({}, lotes["recusadas"])]
+    
+    varredura = manutencao.estatisticas()
+    yield "donations_expired_total", "counter", "Doações pendentes expiradas pela manutenção", [({}, varredura["expiradas"])]
+    yield "donations_archived_total", "counter", "Doações movidas para o arquivo", [({}, varredura["arquivadas"])]
+    
+    yield "db_primary_reads_total", "counter", "Leituras roteadas para o primário", [({}, roteador.leituras_primario)]
+    if roteador.replicas:
+        replicas = [replica.estatisticas() for replica in roteador.replicas]
+        yield "db_replica_up", "gauge", "Réplica na rotação de leitura", [
+            ({"replica": r["nome"]}, int(r["saudavel"])) for r in replicas
+        ]
+        yield "db_replica_lag_seconds", "gauge", "Atraso de replicação medido", [
+            ({"replica": r["nome"]}, r["atraso_s"]) for r in replicas if r["atraso_s"] is not None
+        ]
+        yield "db_replica_reads_total", "counter", "Leituras roteadas para a réplica", [
+            ({"replica": r["nome"]}, r["leituras"]) for r in replicas
+        ]
+        yield "db_replica_failovers_total", "counter", "Leituras desviadas ao primário por falha da réplica", [
+            ({"replica": r["nome"]}, r["falhas"]) for r in replicas
+        ]
+    
+    auth = admissao.controle.estatisticas()
+    yield "auth_admitted_total", "counter", "Operações bcrypt admitidas", [({}, auth["admitidas"])]
+    yield "auth_shed_total", "counter", "Requests de autenticação recusados com 429", [
+        ({"motivo": motivo}, total) for motivo, total in auth["recusadas"].items()
+    ]
+    yield "auth_bcrypt_in_flight", "gauge", "Operações bcrypt em execução", [({}, auth["bcrypt_em_execucao"])]
+    yield "auth_bcrypt_waiting", "gauge", "Requests esperando vaga de bcrypt", [({}, auth["bcrypt_esperando"])]
+    yield "auth_limiter_keys", "gauge", "Chaves nos token buckets", [
+        ({"tipo": tipo}, total) for tipo, total in auth["chaves"].items()
+    ]
+    
+    chaves = idempotencia.estatisticas()
+    yield "idempotency_requests_total", "counter", "Requests com Idempotency-Key por resultado", [
+        ({"resultado": resultado}, chaves[resultado])
+        for resultado in ("executadas", "repetidas", "agrupadas", "conflitos")
+    ]
+
+metrics.registrar_coletor(_metricas_pool_e_cache)
 
 @app.on_event("startup")
 async def startup():
-    """Conecta ao banco na inicialização"""
+    """Conecta ao banco na inicialização, registrando a duração de cada fase"""
+    tempos = {"import": _tempo_import}
+    
+    inicio = time.perf_counter()
+    iniciar_pool()
     await database.connect()
-    print("✅ Conectado ao PostgreSQL")
+    await database.aquecer()
+    await roteador.conectar()
+    tempos["conexao_pool"] = time.perf_counter() - inicio
+    
+    inicio = time.perf_counter()
+    versao = await garantir_esquema(database)
+    tempos["esquema"] = time.perf_counter() - inicio
+    
+    if ingestao.INGESTAO_EM_LOTE:
+        ingestao.ingestor.iniciar(database)
+    manutencao.iniciar(database)
+    
+    app.state.tempos_inicializacao = {fase: round(t * 1000, 1) for fase, t in tempos.items()}
+    logger.info(
+        "Inicialização (ms): %s total=%.1f esquema_versao=%s",
+        " ".join(f"{fase}={ms}" for fase, ms in app.state.tempos_inicializacao.items()),
+        sum(tempos.values()) * 1000, versao
+    )
 
 @app.on_event("shutdown")
 async def shutdown():
     """Desconecta do banco ao encerrar"""
+    await manutencao.encerrar()
+    await ingestao.ingestor.encerrar()
+    await roteador.desconectar()
     await database.disconnect()
-    print("❌ Desconectado do PostgreSQL")
+    encerrar_pool()
+    logger.info("Desconectado do banco")
+
 
+MENSAGENS_DUPLICIDADE_USUARIO = {
+    "username": "Nome de usuário já existente",
+    "email": "Email já cadastrado",
+    "cpf": "CPF já cadastrado",
+}
 
 @app.post("/register", status_code=201)
-async def register(user: UserCreate):
-    """Registra um novo usuário com senha hasheada"""
+async def register(user: UserCreate, request: Request):
+    """Registra um novo usuário com senha hasheada
     
-    query_username = users.select().where(users.c.username == user.username)
-    existing_username = await database.fetch_one(query_username)
-    
-    if existing_username:
-        raise HTTPException(status_code=400, detail="Nome de usuário já existente")
-    
-    query_email = users.select().where(users.c.email == user.email)
-    existing_email = await database.fetch_one(query_email)
-    
-    if existing_email:
-        raise HTTPException(status_code=400, detail="Email já cadastrado")
-    
-    query_cpf = users.select().where(users.c.cpf == user.cpf)
-    existing_cpf = await database.fetch_one(query_cpf)
-    
-    if existing_cpf:
-        raise HTTPException(status_code=400, detail="CPF já cadastrado")
-    
-    hashed_password = hash_password(user.password)
+    A unicidade de username, email e CPF é garantida pelas constraints da tabela:
+    um único INSERT, sem consultas prévias e sem corrida entre cadastros simultâneos.
+    Sujeito ao controle de admissão (429 com Retry-After sob excesso de tentativas).
+    """
+    admissao.controle.limitar(request.client.host if request.client else None, user.email)
+    async with admissao.controle.bcrypt():
+        hashed_password = await hash_password(user.password)
     
     query_insert = users.insert().values(
         username=user.username,
@@ -86,18 +184,33 @@ async def register(user: UserCreate):
         password=hashed_password
     )
     
-    user_id = await database.execute(query_insert)
+    try:
+        async with database.transaction():
+            user_id = await database.execute(query_insert)
+            await agregados.incrementar(database, agregados.TOTAL_USUARIOS)
+    except Exception as e:
+        coluna = coluna_duplicada(e, MENSAGENS_DUPLICIDADE_USUARIO)
+        if coluna is None:
+            raise
+        raise HTTPException(status_code=400, detail=MENSAGENS_DUPLICIDADE_USUARIO[coluna])
     
     return {
         "id": user_id,
         "username": user.username,
         "email": user.email,
-        "message": "Cadastro realizado com sucesso"
+        "message": "Cadastro realizado com sucesso",
+        **tokens.emitir({"id": user_id, "username": user.username, "email": user.email, "cpf": user.cpf})
     }
 
 @app.post("/login")
-async def login(user: UserLogin):
-    """Autentica usuário e retorna informações básicas"""
+async def login(user: UserLogin, request: Request):
+    """Autentica usuário e retorna informações básicas e os tokens de sessão
+    
+    `token` (curto) vai no cabeçalho `Authorization: Bearer` dos próximos
+    requests; `refresh_token` renova o par em POST /token/refresh, sem senha.
+    Sujeito ao controle de admissão (429 com Retry-After sob excesso de tentativas).
+    """
+    admissao.controle.limitar(request.client.host if request.client else None, user.email)
     
     query = users.select().where(users.c.email == user.email)
     db_user = await database.fetch_one(query)
@@ -105,7 +218,9 @@ async def login(user: UserLogin):
     if not db_user:
         raise HTTPException(status_code=401, detail="Email ou senha inválidos")
     
-    if not verify_password(user.password, db_user.password):
+    async with admissao.controle.bcrypt():
+        senha_correta = await verify_password(user.password, db_user.password)
+    if not senha_correta:
         raise HTTPException(status_code=401, detail="Email ou senha inválidos")
     
     return {
@@ -115,14 +230,44 @@ async def login(user: UserLogin):
             "username": db_user.username,
             "email": db_user.email,
             "cpf": db_user.cpf
-        }
+        },
+        **tokens.emitir(db_user)
     }
 
+@app.post("/token/refresh")
+async def renovar_token(corpo: TokenRefresh):
+    """Troca um refresh token válido por um novo par de tokens (sem bcrypt)"""
+    claims = tokens.verificar(corpo.refresh_token, tokens.REFRESH)
+    
+    # O usuário pode ter mudado ou sido removido desde o login
+    query = users.select().where(users.c.id == int(claims["sub"]))
+    db_user = await roteador.fetch_one(query)
+    if not db_user:
+        raise HTTPException(status_code=401, detail="Token inválido")
+    
+    return tokens.emitir(db_user)
+
+@app.get("/users/me")
+async def get_current_user(authorization: Optional[str] = Header(None)):
+    """Perfil do usuário do token de acesso, direto das claims (sem banco)"""
+    claims = tokens.do_cabecalho(authorization)
+    if claims is None:
+        raise HTTPException(status_code=401, detail="Token ausente", headers={"WWW-Authenticate": "Bearer"})
+    return tokens.usuario(claims)
+
 @app.get("/users/me/{user_id}")
-async def get_user_profile(user_id: int):
-    """Obtém perfil do usuário"""
+async def get_user_profile(user_id: int, authorization: Optional[str] = Header(None)):
+    """Obtém perfil do usuário (das claims do token, quando ele é do próprio usuário)"""
+    try:
+        claims = tokens.do_cabecalho(authorization)
+    except HTTPException:
+        # Token vencido não impede a consulta pelo id
+        claims = None
+    if claims is not None and claims["sub"] == str(user_id):
+        return tokens.usuario(claims)
+    
     query = users.select().where(users.c.id == user_id)
-    user = await database.fetch_one(query)
+    user = await roteador.fetch_one(query)
     
     if not user:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
@@ -148,56 +293,140 @@ async def criar_campanha(campanha: CampanhaCreate):
         email=campanha.email,
         data_fim=campanha.data_fim,
         valor_arrecadado=0.0,
+        total_doacoes=0,
         ativa=True,
         rating=4.8
     )
     
-    campanha_id = await database.execute(query)
+    async with database.transaction():
+        campanha_id = await database.execute(query)
+        await agregados.incrementar(database, agregados.TOTAL_CAMPANHAS_ATIVAS)
+    
+    cache_listas_campanhas.limpar()
     
     query_select = campanhas.select().where(campanhas.c.id == campanha_id)
     db_campanha = await database.fetch_one(query_select)
     
-    percentual = (db_campanha.valor_arrecadado / db_campanha.meta_valor) * 100
-    
-    return {**dict(db_campanha), "percentual_atingido": percentual}
+    return JSONRapido(campanha_para_dict(db_campanha), status_code=201)
 
 @app.get("/campanhas", response_model=List[CampanhaResponse])
-async def listar_campanhas(ativas: Optional[bool] = True, limit: int = 100):
-    """Lista todas as campanhas (ativas por padrão)"""
-    query = campanhas.select().limit(limit).order_by(campanhas.c.data_inicio.desc())
+async def listar_campanhas(
+    request: Request,
+    ativas: Optional[bool] = True,
+    limit: Optional[int] = Query(None, ge=1, le=LIMITE_MAXIMO),
+    cursor: Optional[str] = None,
+    formato: Optional[str] = Query(None, pattern="^(json|ndjson)$"),
+):
+    """Lista as campanhas (ativas por padrão), paginadas por cursor
+    
+    O cursor da próxima página vem no cabeçalho X-Next-Cursor. Com formato=ndjson
+    as campanhas são transmitidas conforme saem do banco e `limit` é opcional.
+    Páginas JSON ficam em cache por alguns segundos e respondem com ETag.
+    """
+    query = paginar(campanhas.select(), campanhas.c.data_inicio, campanhas.c.id, cursor)
     
     if ativas is not None:
         query = query.where(campanhas.c.ativa == ativas)
     
-    results = await database.fetch_all(query)
-    
-    campanhas_list = []
-    for camp in results:
-        percentual = (camp.valor_arrecadado / camp.meta_valor) * 100 if camp.meta_valor > 0 else 0
-        campanhas_list.append({
-            **dict(camp), 
-            "percentual_atingido": percentual,
-            "rating": camp.rating if camp.rating is not None else 4.8
-        })
+    if formato == "ndjson":
+        if limit:
+            query = query.limit(limit)
+        return resposta_ndjson(leitura(), query, campanha_para_dict)
+    
+    limit = limit or LIMITE_PADRAO
+    chave = (ativas, limit, cursor)
+    em_cache = cache_listas_campanhas.get(chave)
+    if em_cache is None:
+        versao = cache_listas_campanhas.versao
+        # Do primário, como o detalhe: a página em cache vale para todos os leitores até o TTL
+        results = await database.fetch_all(query.limit(limit))
+        
+        cursor_seguinte = proximo_cursor(results, "data_inicio", limit)
+        em_cache = RespostaCacheada(
+            dumps([campanha_para_dict(camp) for camp in results]),
+            {HEADER_PROXIMO_CURSOR: cursor_seguinte} if cursor_seguinte else None
+        )
+        cache_listas_campanhas.set(chave, em_cache, versao)
+    
+    return em_cache.responder(request)
+
+@app.get("/campanhas/busca")
+async def buscar_campanhas(
+    q: str = Query(..., min_length=1, max_length=200),
+    categoria: Optional[str] = None,
+    localizacao: Optional[str] = None,
+    ativas: Optional[bool] = True,
+    limit: int = Query(20, ge=1, le=LIMITE_MAXIMO),
+    cursor: Optional[str] = None,
+):
+    """Busca campanhas por nome, descrição, categoria e localização
+    
+    Resultados da maior para a menor relevância; o cursor da próxima página vem
+    no cabeçalho X-Next-Cursor. A primeira página traz também as facetas
+    (quantidade por categoria e por localização).
+    """
+    linhas, cursor_seguinte, facetas = await busca.buscar(
+        leitura(), q, categoria, localizacao, ativas, limit, cursor
+    )
     
-    return campanhas_list
+    conteudo = {"resultados": [
+        {**campanha_para_dict(linha), "relevancia": linha["relevancia"]} for linha in linhas
+    ]}
+    if facetas is not None:
+        conteudo["facetas"] = facetas
+    return JSONRapido(conteudo, headers={HEADER_PROXIMO_CURSOR: cursor_seguinte} if cursor_seguinte else None)
 
 @app.get("/campanhas/{campanha_id}", response_model=CampanhaResponse)
-async def obter_campanha(campanha_id: int):
-    """Obtém detalhes de uma campanha específica"""
-    query = campanhas.select().where(campanhas.c.id == campanha_id)
-    campanha = await database.fetch_one(query)
+async def obter_campanha(campanha_id: int, request: Request):
+    """Obtém detalhes de uma campanha específica (em cache, com ETag)"""
+    em_cache = cache_campanhas.get(campanha_id)
+    if em_cache is None:
+        versao = cache_campanhas.versao
+        query = campanhas.select().where(campanhas.c.id == campanha_id)
+        # Do primário: o cache vale para todos os leitores até o TTL, e uma réplica
+        # atrasada o encheria de novo com a versão anterior à escrita que o invalidou
+        campanha = await database.fetch_one(query)
+        
+        if not campanha:
+            raise HTTPException(status_code=404, detail="Campanha não encontrada")
+        
+        em_cache = RespostaCacheada(
+            dumps(campanha_para_dict(campanha))
+        )
+        cache_campanhas.set(campanha_id, em_cache, versao)
+    
+    return em_cache.responder(request)
+
+@app.get("/campanhas/{campanha_id}/eventos")
+async def eventos_campanha(campanha_id: int):
+    """Progresso da campanha ao vivo (Server-Sent Events)
+    
+    Envia o estado atual ao conectar e um evento `progresso` a cada doação
+    confirmada, no lugar de polling em GET /campanhas/{id}.
+    """
+    if eventos.lotado():
+        raise HTTPException(status_code=503, detail="Muitas conexões abertas, tente novamente")
+    
+    # Inscreve antes de ler o snapshot: uma confirmação feita entre a leitura e a
+    # inscrição se perderia. O snapshot vem do primário, porque a réplica pode
+    # ainda não ter uma confirmação já publicada antes da inscrição.
+    fila = eventos.inscrever(campanha_id)
+    try:
+        query = campanhas.select().with_only_columns(
+            campanhas.c.valor_arrecadado, campanhas.c.meta_valor, campanhas.c.total_doacoes
+        ).where(campanhas.c.id == campanha_id)
+        campanha = await database.fetch_one(query)
+    except BaseException:
+        eventos.cancelar(campanha_id, fila)
+        raise
     
     if not campanha:
+        eventos.cancelar(campanha_id, fila)
         raise HTTPException(status_code=404, detail="Campanha não encontrada")
     
-    percentual = (campanha.valor_arrecadado / campanha.meta_valor) * 100 if campanha.meta_valor > 0 else 0
-    
-    return {
-        **dict(campanha), 
-        "percentual_atingido": percentual,
-        "rating": campanha.rating if campanha.rating is not None else 4.8
-    }
+    return eventos.transmitir(campanha_id, fila, eventos.progresso(
+        campanha_id, campanha.valor_arrecadado, campanha.meta_valor, campanha.total_doacoes
+    ))
 
 # @app.patch("/campanhas/{campanha_id}", response_model=CampanhaResponse)
 # async def atualizar_campanha(campanha_id: int, campanha_update: CampanhaUpdate):
@@ -228,31 +457,45 @@ async def obter_campanha(campanha_id: int):
 @app.delete("/campanhas/{campanha_id}")
 async def deletar_campanha(campanha_id: int):
     """Desativa uma campanha"""
-    query = campanhas.select().where(campanhas.c.id == campanha_id)
-    existing = await database.fetch_one(query)
-    
-    if not existing:
-        raise HTTPException(status_code=404, detail="Campanha não encontrada")
-
-    query_update = campanhas.update().where(campanhas.c.id == campanha_id).values(ativa=False)
-    await database.execute(query_update)
+    async with database.transaction():
+        query_update = campanhas.update().where(
+            (campanhas.c.id == campanha_id) & (campanhas.c.ativa == True)
+        ).values(ativa=False).returning(campanhas.c.valor_arrecadado)
+        desativada = await database.fetch_one(query_update)
+        
+        if desativada:
+            await agregados.incrementar(database, agregados.TOTAL_CAMPANHAS_ATIVAS, -1)
+            await agregados.incrementar(database, agregados.TOTAL_ARRECADADO, -desativada.valor_arrecadado)
+    
+    if desativada:
+        invalidar_campanha(campanha_id)
+        ingestao.invalidar_campanha(campanha_id)
+    
+    if not desativada:
+        query = campanhas.select().where(campanhas.c.id == campanha_id)
+        existing = await database.fetch_one(query)
+        
+        if not existing:
+            raise HTTPException(status_code=404, detail="Campanha não encontrada")
     
     return {"message": "Campanha desativada com sucesso"}
 
 
 @app.post("/doacoes/", response_model=DoacaoResponse, status_code=201)
-async def criar_doacao(doacao: DoacaoCreate):
-    """Cria uma nova doação (status pendente)"""
-    query = campanhas.select().where(campanhas.c.id == doacao.campanha_id)
-    campanha = await database.fetch_one(query)
-    
-    if not campanha:
-        raise HTTPException(status_code=404, detail="Campanha não encontrada")
-    
-    if not campanha.ativa:
-        raise HTTPException(status_code=400, detail="Campanha não está ativa")
-    
-    query_insert = doacoes.insert().values(
+async def criar_doacao(doacao: DoacaoCreate, idempotency_key: Optional[str] = Header(None)):
+    """Cria uma nova doação (status pendente)
+    
+    Com o cabeçalho Idempotency-Key, repetições do mesmo request devolvem a
+    doação já criada em vez de inserir outra.
+    """
+    return await idempotencia.executar(
+        "criar_doacao", idempotency_key, doacao.model_dump(mode="json"),
+        lambda: _criar_doacao(doacao)
+    )
+
+def _valores_doacao(doacao: DoacaoCreate, campanha) -> dict:
+    txid = pix.novo_txid()
+    return dict(
         campanha_id=doacao.campanha_id,
         user_id=doacao.user_id,
         valor=doacao.valor,
@@ -267,42 +510,100 @@ async def criar_doacao(doacao: DoacaoCreate):
         doador_cpf=doacao.doador_cpf,
         doador_email=doacao.doador_email,
         status="pendente",
-        metodo_pagamento="PIX"
+        metodo_pagamento="PIX",
+        # Definida aqui (e não pelo banco) para os rollups saberem o dia da doação
+        data_doacao=datetime.now(timezone.utc),
+        pix_txid=txid,
+        # Partes fixas do payload vêm prontas por campanha; aqui só entram valor e txid
+        pix_code=pix.gerar_payload(campanha.id, campanha.nome, doacao.valor, txid)
     )
-    
-    doacao_id = await database.execute(query_insert)
-    
-    query_select = doacoes.select().where(doacoes.c.id == doacao_id)
-    db_doacao = await database.fetch_one(query_select)
-    
-    return dict(db_doacao)
 
-@app.patch("/doacoes/{doacao_id}/confirmar", response_model=DoacaoConfirmacao)
-async def confirmar_doacao(doacao_id: int):
-    """Confirma uma doação e atualiza o valor arrecadado da campanha"""
-    query = doacoes.select().where(doacoes.c.id == doacao_id)
-    doacao = await database.fetch_one(query)
+async def _criar_doacao(doacao: DoacaoCreate):
+    if ingestao.ingestor.ativo:
+        # Modo de pico: campanha vem de um cache curto e o insert entra num lote
+        campanha = await ingestao.obter_campanha(database, doacao.campanha_id)
+    else:
+        query = campanhas.select().where(campanhas.c.id == doacao.campanha_id)
+        campanha = await database.fetch_one(query)
     
-    if not doacao:
-        raise HTTPException(status_code=404, detail="Doação não encontrada")
+    if not campanha:
+        raise HTTPException(status_code=404, detail="Campanha não encontrada")
     
-    if doacao.status == "confirmado":
-        raise HTTPException(status_code=400, detail="Doação já confirmada")
+    if not campanha.ativa:
+        raise HTTPException(status_code=400, detail="Campanha não está ativa")
     
-    query_update = doacoes.update().where(doacoes.c.id == doacao_id).values(status="confirmado")
-    await database.execute(query_update)
+    if ingestao.ingestor.ativo:
+        db_doacao = await ingestao.ingestor.inserir(_valores_doacao(doacao, campanha))
+        return JSONRapido(doacao_para_dict(db_doacao), status_code=201)
     
-    query_campanha = campanhas.select().where(campanhas.c.id == doacao.campanha_id)
-    campanha = await database.fetch_one(query_campanha)
+    valores = _valores_doacao(doacao, campanha)
     
-    novo_valor = campanha.valor_arrecadado + doacao.valor
+    async with database.transaction():
+        doacao_id = await database.execute(doacoes.insert().values(**valores))
+        await agregados.registrar_rollups(database, [valores], None, "pendente")
     
-    query_update_campanha = campanhas.update().where(
-        campanhas.c.id == doacao.campanha_id
-    ).values(valor_arrecadado=novo_valor)
+    query_select = doacoes.select().where(doacoes.c.id == doacao_id)
+    db_doacao = await database.fetch_one(query_select)
     
-    await database.execute(query_update_campanha)
+    return JSONRapido(doacao_para_dict(db_doacao), status_code=201)
+
+@app.patch("/doacoes/{doacao_id}/confirmar", response_model=DoacaoConfirmacao)
+async def confirmar_doacao(doacao_id: int, idempotency_key: Optional[str] = Header(None)):
+    """Confirma uma doação e atualiza o valor arrecadado da campanha
+    
+    Com o cabeçalho Idempotency-Key, repetições recebem a mesma resposta da
+    primeira confirmação.
+    """
+    return await idempotencia.executar(
+        "confirmar_doacao", idempotency_key, {"doacao_id": doacao_id},
+        lambda: _confirmar_doacao(doacao_id)
+    )
+
+async def _confirmar_doacao(doacao_id: int):
+    async with database.transaction():
+        # Transição condicional pendente -> confirmado: só uma confirmação concorrente vence
+        query_update = doacoes.update().where(
+            (doacoes.c.id == doacao_id) & (doacoes.c.status == "pendente")
+        ).values(status="confirmado", status_alterado_em=func.now()).returning(
+            doacoes.c.campanha_id, doacoes.c.valor, doacoes.c.data_doacao, doacoes.c.uf, doacoes.c.cidade
+        )
+        doacao = await database.fetch_one(query_update)
+        
+        if doacao:
+            # Incremento feito no próprio banco, sem ler-modificar-escrever em Python
+            query_update_campanha = campanhas.update().where(
+                campanhas.c.id == doacao.campanha_id
+            ).values(
+                **agregados.valores_confirmacao(doacao.valor, doacao.data_doacao)
+            ).returning(
+                campanhas.c.valor_arrecadado, campanhas.c.meta_valor, campanhas.c.total_doacoes, campanhas.c.ativa
+            )
+            campanha = await database.fetch_one(query_update_campanha)
+            
+            await agregados.registrar_rollups(database, [doacao], "pendente", "confirmado")
+            await agregados.incrementar(database, agregados.TOTAL_DOACOES)
+            if campanha.ativa:
+                await agregados.incrementar(database, agregados.TOTAL_ARRECADADO, doacao.valor)
+    
+    if doacao:
+        invalidar_campanha(doacao.campanha_id)
+        eventos.publicar_progresso(
+            doacao.campanha_id, campanha.valor_arrecadado, campanha.meta_valor, campanha.total_doacoes
+        )
     
+    if not doacao:
+        query = doacoes.select().where(doacoes.c.id == doacao_id)
+        existente = await database.fetch_one(query)
+        
+        if not existente:
+            raise HTTPException(status_code=404, detail="Doação não encontrada")
+        
+        if existente.status == "confirmado":
+            raise HTTPException(status_code=400, detail="Doação já confirmada")
+        
+        raise HTTPException(status_code=400, detail="Apenas doações pendentes podem ser confirmadas")
+    
+    novo_valor = campanha.valor_arrecadado
     percentual = (novo_valor / campanha.meta_valor) * 100 if campanha.meta_valor > 0 else 0
     
     return {
@@ -314,65 +615,177 @@ async def confirmar_doacao(doacao_id: int):
 @app.patch("/doacoes/{doacao_id}/cancelar")
 async def cancelar_doacao(doacao_id: int):
     """Cancela uma doação pendente"""
-    query = doacoes.select().where(doacoes.c.id == doacao_id)
-    doacao = await database.fetch_one(query)
+    async with database.transaction():
+        # Linha travada até o commit: uma confirmação simultânea espera e encontra a doação cancelada
+        query = doacoes.select().where(doacoes.c.id == doacao_id).with_for_update()
+        doacao = await database.fetch_one(query)
+        
+        if not doacao:
+            raise HTTPException(status_code=404, detail="Doação não encontrada")
+        
+        if doacao.status == "confirmado":
+            raise HTTPException(status_code=400, detail="Não é possível cancelar doação já confirmada")
+        
+        if doacao.status != "cancelado":
+            query_update = doacoes.update().where(doacoes.c.id == doacao_id).values(
+                status="cancelado", status_alterado_em=func.now()
+            )
+            await database.execute(query_update)
+            await agregados.registrar_rollups(database, [doacao], doacao.status, "cancelado")
     
-    if not doacao:
-        raise HTTPException(status_code=404, detail="Doação não encontrada")
+    return {"message": "Doação cancelada com sucesso"}
+
+@app.get("/doacoes/campanha/{campanha_id}", response_model=List[DoacaoResponse])
+async def listar_doacoes_campanha(
+    campanha_id: int,
+    status: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=LIMITE_MAXIMO),
+    cursor: Optional[str] = None,
+    formato: Optional[str] = Query(None, pattern="^(json|ndjson)$"),
+):
+    """Lista as doações de uma campanha, paginadas por cursor
+    
+    O cursor da próxima página vem no cabeçalho X-Next-Cursor. Com formato=ndjson
+    as doações são transmitidas conforme saem do banco, com memória constante.
+    """
+    query = paginar(
+        doacoes.select().where(doacoes.c.campanha_id == campanha_id),
+        doacoes.c.data_doacao, doacoes.c.id, cursor
+    )
     
-    if doacao.status == "confirmado":
-        raise HTTPException(status_code=400, detail="Não é possível cancelar doação já confirmada")
+    if status:
+        query = query.where(doacoes.c.status == status)
     
-    query_update = doacoes.update().where(doacoes.c.id == doacao_id).values(status="cancelado")
-    await database.execute(query_update)
+    if formato == "ndjson":
+        if limit:
+            query = query.limit(limit)
+        return resposta_ndjson(leitura(), query, doacao_para_dict)
     
-    return {"message": "Doação cancelada com sucesso"}
+    limit = limit or LIMITE_PADRAO
+    results = await leitura().fetch_all(query.limit(limit))
+    
+    cursor_seguinte = proximo_cursor(results, "data_doacao", limit)
+    headers = {HEADER_PROXIMO_CURSOR: cursor_seguinte} if cursor_seguinte else None
+    
+    return JSONRapido([doacao_para_dict(d) for d in results], headers=headers)
 
-@app.get("/doacoes/campanha/{campanha_id}", response_model=List[DoacaoResponse])
-async def listar_doacoes_campanha(campanha_id: int, status: Optional[str] = None):
-    """Lista todas as doações de uma campanha"""
-    query = doacoes.select().where(doacoes.c.campanha_id == campanha_id).order_by(doacoes.c.data_doacao.desc())
+@app.get("/doacoes/campanha/{campanha_id}/export")
+async def exportar_doacoes_campanha(
+    campanha_id: int,
+    formato: str = Query("csv", pattern="^(csv|parquet)$"),
+    status: Optional[str] = None,
+    de: Optional[datetime] = None,
+    ate: Optional[datetime] = None,
+):
+    """Exporta as doações de uma campanha (CSV ou Parquet) para a contabilidade
+    
+    O arquivo é transmitido conforme as doações são lidas do banco, em blocos,
+    com memória constante. `de` (inclusivo) e `ate` (exclusivo) filtram por
+    data da doação.
+    """
+    if formato == "parquet" and exportacao.pa is None:
+        raise HTTPException(status_code=501, detail="Exportação Parquet indisponível (biblioteca pyarrow não instalada)")
+    
+    query = campanhas.select().with_only_columns(campanhas.c.id).where(campanhas.c.id == campanha_id)
+    if not await roteador.fetch_one(query):
+        raise HTTPException(status_code=404, detail="Campanha não encontrada")
+    
+    return exportacao.exportar(leitura(), campanha_id, formato, status, de, ate)
+
+@app.get("/doacoes/user/{user_id}")
+async def listar_doacoes_usuario(
+    user_id: int,
+    status: Optional[str] = None,
+    limit: int = Query(LIMITE_PADRAO, ge=1, le=LIMITE_MAXIMO),
+    cursor: Optional[str] = None,
+):
+    """Histórico de doações de um usuário, paginado por cursor
+    
+    A primeira página traz também o resumo das doações confirmadas (total doado,
+    campanhas apoiadas e última doação), calculado em uma única consulta
+    agregada. O cursor da próxima página vem no cabeçalho X-Next-Cursor.
+    """
+    query = paginar(
+        doacoes.select().where(doacoes.c.user_id == user_id),
+        doacoes.c.data_doacao, doacoes.c.id, cursor
+    )
     
     if status:
         query = query.where(doacoes.c.status == status)
     
-    results = await database.fetch_all(query)
-    return [dict(d) for d in results]
+    banco = leitura()
+    results = await banco.fetch_all(query.limit(limit))
+    conteudo = {"doacoes": [doacao_para_dict(d) for d in results]}
+    
+    if not cursor:
+        query_resumo = select(
+            func.coalesce(func.sum(doacoes.c.valor), 0).label("total_doado"),
+            func.count().label("total_doacoes"),
+            func.count(func.distinct(doacoes.c.campanha_id)).label("campanhas_apoiadas"),
+            func.max(doacoes.c.data_doacao).label("ultima_doacao_em"),
+        ).where((doacoes.c.user_id == user_id) & (doacoes.c.status == "confirmado"))
+        resumo = await banco.fetch_one(query_resumo)
+        conteudo["resumo"] = {
+            "total_doado": float(resumo["total_doado"]),
+            "total_doacoes": resumo["total_doacoes"],
+            "campanhas_apoiadas": resumo["campanhas_apoiadas"],
+            "ultima_doacao_em": resumo["ultima_doacao_em"],
+        }
+    
+    cursor_seguinte = proximo_cursor(results, "data_doacao", limit)
+    headers = {HEADER_PROXIMO_CURSOR: cursor_seguinte} if cursor_seguinte else None
+    
+    return JSONRapido(conteudo, headers=headers)
 
-# @app.get("/doacoes/user/{user_id}", response_model=List[DoacaoResponse])
-# async def listar_doacoes_usuario(user_id: int):
-#     """Lista todas as doações de um usuário"""
-#     query = doacoes.select().where(doacoes.c.user_id == user_id).order_by(doacoes.c.data_doacao.desc())
-#     results = await database.fetch_all(query)
-#     return [dict(d) for d in results]
+@app.get("/doacoes/{doacao_id}/qrcode")
+async def qrcode_doacao(doacao_id: int, formato: str = Query("png", pattern="^(png|svg)$")):
+    """Imagem do QR Code PIX da doação, gerada sob demanda e mantida em cache"""
+    if pix.qrcode is None:
+        raise HTTPException(status_code=501, detail="Geração de QR Code indisponível (biblioteca qrcode não instalada)")
+    
+    query = doacoes.select().with_only_columns(doacoes.c.pix_code).where(doacoes.c.id == doacao_id)
+    doacao = await roteador.fetch_one(query)
+    
+    if not doacao:
+        raise HTTPException(status_code=404, detail="Doação não encontrada")
+    
+    if not doacao.pix_code:
+        raise HTTPException(status_code=404, detail="Doação sem código PIX")
+    
+    imagem = await pix.imagem_qrcode(doacao.pix_code, formato)
+    # O payload de uma doação nunca muda
+    return Response(
+        content=imagem, media_type=pix.TIPOS_IMAGEM[formato],
+        headers={"Cache-Control": "public, max-age=86400, immutable"}
+    )
 
 @app.get("/doacoes/{doacao_id}", response_model=DoacaoResponse)
 async def obter_doacao(doacao_id: int):
     """Obtém detalhes de uma doação específica"""
     query = doacoes.select().where(doacoes.c.id == doacao_id)
-    doacao = await database.fetch_one(query)
+    doacao = await roteador.fetch_one(query)
+    
+    if not doacao:
+        # Canceladas/expiradas antigas ficam no arquivo
+        query = doacoes_arquivo.select().where(doacoes_arquivo.c.id == doacao_id)
+        doacao = await roteador.fetch_one(query)
     
     if not doacao:
         raise HTTPException(status_code=404, detail="Doação não encontrada")
     
-    return dict(doacao)
+    return JSONRapido(doacao_para_dict(doacao))
 
 @app.get("/stats/campanha/{campanha_id}")
 async def estatisticas_campanha(campanha_id: int):
-    """Retorna estatísticas de uma campanha"""
+    """Retorna estatísticas de uma campanha (agregados mantidos na própria linha)"""
     query_camp = campanhas.select().where(campanhas.c.id == campanha_id)
-    campanha = await database.fetch_one(query_camp)
+    campanha = await roteador.fetch_one(query_camp)
     
     if not campanha:
         raise HTTPException(status_code=404, detail="Campanha não encontrada")
     
-    query_count = f"SELECT COUNT(*) as total FROM doacoes WHERE campanha_id = {campanha_id} AND status = 'confirmado'"
-    total_doacoes = await database.fetch_one(query_count)
-    
-    query_avg = f"SELECT AVG(valor) as media FROM doacoes WHERE campanha_id = {campanha_id} AND status = 'confirmado'"
-    doacao_media = await database.fetch_one(query_avg)
-    
     percentual = (campanha.valor_arrecadado / campanha.meta_valor) * 100
+    media = campanha.valor_arrecadado / campanha.total_doacoes if campanha.total_doacoes else 0
     
     return {
         "campanha_id": campanha_id,
@@ -380,33 +793,131 @@ async def estatisticas_campanha(campanha_id: int):
         "meta_valor": campanha.meta_valor,
         "valor_arrecadado": campanha.valor_arrecadado,
         "percentual_atingido": round(percentual, 2),
-        "total_doacoes": total_doacoes['total'] if total_doacoes else 0,
-        "doacao_media": round(doacao_media['media'], 2) if doacao_media and doacao_media['media'] else 0,
+        "total_doacoes": campanha.total_doacoes,
+        "doacao_media": round(media, 2),
+        "doacao_minima": campanha.doacao_minima,
+        "doacao_maxima": campanha.doacao_maxima,
+        "ultima_doacao_em": campanha.ultima_doacao_em,
         "falta_arrecadar": campanha.meta_valor - campanha.valor_arrecadado
     }
 
+STATUS_ROLLUP = "^(pendente|confirmado|cancelado|expirado)$"
+
+@app.get("/stats/campanha/{campanha_id}/serie")
+async def serie_campanha(
+    campanha_id: int,
+    status: str = Query("confirmado", pattern=STATUS_ROLLUP),
+    de: Optional[date] = None,
+    ate: Optional[date] = None,
+    uf: Optional[str] = Query(None, min_length=2, max_length=2),
+):
+    """Doações por dia de uma campanha (quantidade e total), a partir dos rollups
+    
+    O custo não depende do número de doações: uma linha por dia, UF e status.
+    `de` e `ate` são inclusivos; dias sem doações não aparecem.
+    """
+    query = campanhas.select().with_only_columns(campanhas.c.id).where(campanhas.c.id == campanha_id)
+    if not await roteador.fetch_one(query):
+        raise HTTPException(status_code=404, detail="Campanha não encontrada")
+    
+    d = doacoes_diarias.c
+    query = select(
+        d.dia, func.sum(d.quantidade).label("quantidade"), func.sum(d.total).label("total")
+    ).where((d.campanha_id == campanha_id) & (d.status == status)).group_by(d.dia).order_by(d.dia)
+    if de:
+        query = query.where(d.dia >= de)
+    if ate:
+        query = query.where(d.dia <= ate)
+    if uf:
+        query = query.where(d.uf == uf.upper())
+    
+    linhas = await leitura().fetch_all(query)
+    return JSONRapido({
+        "campanha_id": campanha_id,
+        "status": status,
+        "serie": [
+            {"dia": linha["dia"], "quantidade": linha["quantidade"], "total": round(linha["total"], 2)}
+            for linha in linhas if linha["quantidade"]
+        ],
+    })
+
+@app.get("/stats/regioes")
+async def estatisticas_regioes(
+    campanha_id: Optional[int] = None,
+    por: str = Query("uf", pattern="^(uf|cidade)$"),
+    status: str = Query("confirmado", pattern=STATUS_ROLLUP),
+    de: Optional[date] = None,
+    ate: Optional[date] = None,
+):
+    """Doações por UF ou por cidade, de uma campanha ou da plataforma, a partir dos rollups
+    
+    Ordenadas do maior para o menor total. O filtro por data (`de`/`ate`,
+    inclusivos) só existe por UF, que é o recorte do rollup diário.
+    """
+    if por == "cidade" and (de or ate):
+        raise HTTPException(status_code=400, detail="Filtro por data disponível apenas com por=uf")
+    
+    tabela = doacoes_cidades if por == "cidade" else doacoes_diarias
+    chaves = [tabela.c.uf, tabela.c.cidade] if por == "cidade" else [tabela.c.uf]
+    query = select(
+        *chaves, func.sum(tabela.c.quantidade).label("quantidade"), func.sum(tabela.c.total).label("total")
+    ).where(tabela.c.status == status).group_by(*chaves).order_by(func.sum(tabela.c.total).desc())
+    if campanha_id is not None:
+        query = query.where(tabela.c.campanha_id == campanha_id)
+    if de:
+        query = query.where(tabela.c.dia >= de)
+    if ate:
+        query = query.where(tabela.c.dia <= ate)
+    
+    linhas = await leitura().fetch_all(query)
+    return JSONRapido({
+        "por": por,
+        "status": status,
+        "regioes": [
+            {**{chave.name: linha[chave.name] for chave in chaves},
+             "quantidade": linha["quantidade"], "total": round(linha["total"], 2)}
+            for linha in linhas if linha["quantidade"]
+        ],
+    })
+
 @app.get("/stats/geral")
 async def estatisticas_gerais():
-    """Retorna estatísticas gerais da plataforma"""
-    query_camp = "SELECT COUNT(*) as total FROM campanhas WHERE ativa = true"
-    total_campanhas = await database.fetch_one(query_camp)
-    
-    query_total = "SELECT SUM(valor_arrecadado) as total FROM campanhas WHERE ativa = true"
-    total_arrecadado = await database.fetch_one(query_total)
-    
-    query_doacoes = "SELECT COUNT(*) as total FROM doacoes WHERE status = 'confirmado'"
-    total_doacoes = await database.fetch_one(query_doacoes)
-    
-    query_users = "SELECT COUNT(*) as total FROM users"
-    total_usuarios = await database.fetch_one(query_users)
-    
+    """Retorna estatísticas gerais da plataforma (contadores mantidos incrementalmente)"""
+    return await agregados.ler_contadores(leitura())
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def exportar_metricas():
+    """Métricas no formato texto do Prometheus"""
+    return PlainTextResponse(metrics.exportar(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats/pool")
+async def estatisticas_pool():
+    """Retorna o uso do pool de conexões (em uso, ociosas e espera por conexão) e das réplicas"""
+    estatisticas = database.estatisticas()
+    if roteador.replicas:
+        estatisticas["leitura"] = roteador.estatisticas()
+    return estatisticas
+
+@app.get("/stats/cache")
+async def estatisticas_cache():
+    """Retorna hits, misses e evictions dos caches de campanhas"""
     return {
-        "total_campanhas_ativas": total_campanhas['total'] if total_campanhas else 0,
-        "total_arrecadado": total_arrecadado['total'] if total_arrecadado and total_arrecadado['total'] else 0,
-        "total_doacoes": total_doacoes['total'] if total_doacoes else 0,
-        "total_usuarios": total_usuarios['total'] if total_usuarios else 0
+        "campanhas": cache_campanhas.estatisticas(),
+        "listas_campanhas": cache_listas_campanhas.estatisticas(),
+        "pix": pix.estatisticas(),
+        "tokens": tokens.estatisticas(),
     }
 
+@app.get("/stats/eventos")
+async def estatisticas_eventos():
+    """Retorna conexões SSE abertas e eventos entregues/descartados"""
+    return eventos.broadcaster.estatisticas()
+
+@app.get("/stats/admissao")
+async def estatisticas_admissao():
+    """Retorna requests admitidos e recusados pelo controle de admissão do login/cadastro"""
+    return admissao.controle.estatisticas()
+
 @app.get("/")
 def root():
     return {
@@ -417,7 +928,8 @@ def root():
             "auth": {
                 "register": "POST /register",
                 "login": "POST /login",
-                "profile": "GET /users/me/{user_id}"
+                "refresh": "POST /token/refresh",
+                "profile": "GET /users/me"
             },
             "campanhas": {
                 "listar": "GET /campanhas/",
@@ -435,6 +947,8 @@ def root():
             },
             "stats": {
                 "campanha": "GET /stats/campanha/{id}",
+                "serie": "GET /stats/campanha/{id}/serie",
+                "regioes": "GET /stats/regioes",
                 "geral": "GET /stats/geral"
             }
         }
@@ -452,3 +966,5 @@ async def health_check():
         }
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"Erro no banco de dados: {str(e)}")
+
+_tempo_import = time.perf_counter() - _inicio_import
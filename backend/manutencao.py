@@ -0,0 +1,191 @@
+"""Manutenção periódica das doações e das chaves de idempotência
+
+- expira as doações `pendente` mais antigas que DOACOES_PENDENTE_TTL_HORAS
+  (PIX abandonado), que passam a `expirado`;
+- move as doações que estão `cancelado`/`expirado` há mais de
+  DOACOES_ARQUIVAR_APOS_DIAS (contados de `status_alterado_em`) para
+  `doacoes_arquivo`, mantendo `doacoes` só com linhas vivas;
+- apaga as Idempotency-Key vencidas (IDEMPOTENCIA_TTL).
+
+Tudo em lotes de MANUTENCAO_LOTE linhas, cada lote na sua própria transação
+curta. No PostgreSQL as linhas são travadas com SKIP LOCKED (uma confirmação
+em andamento nunca espera a varredura) e um advisory lock por lote faz com que
+só um processo varra por vez.
+
+Uso pela linha de comando:
+    python manutencao.py expirar
+    python manutencao.py arquivar
+    python manutencao.py ciclo        # tudo, inclusive a limpeza das chaves de idempotência
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import func, select
+
+import agregados
+import idempotencia
+from models import doacoes, doacoes_arquivo
+
+logger = logging.getLogger("uvicorn.error")
+
+DOACOES_PENDENTE_TTL_HORAS = float(os.getenv("DOACOES_PENDENTE_TTL_HORAS", "24"))
+DOACOES_ARQUIVAR_APOS_DIAS = float(os.getenv("DOACOES_ARQUIVAR_APOS_DIAS", "7"))
+MANUTENCAO_LOTE = int(os.getenv("MANUTENCAO_LOTE", "1000"))
+# Intervalo (s) entre ciclos da varredura em segundo plano; 0 desliga
+MANUTENCAO_INTERVALO = float(os.getenv("MANUTENCAO_INTERVALO", "300"))
+
+STATUS_ARQUIVAVEIS = ("cancelado", "expirado")
+
+# Chave arbitrária do advisory lock da varredura
+_LOCK_MANUTENCAO = 4_242_002
+
+expiradas = 0
+arquivadas = 0
+ultimo_ciclo_segundos = 0.0
+
+
+async def _travar(database) -> bool:
+    """Advisory lock da transação corrente; False se outro processo está varrendo"""
+    if database.url.dialect != "postgresql":
+        return True
+    return await database.fetch_val(f"SELECT pg_try_advisory_xact_lock({_LOCK_MANUTENCAO})")
+
+
+def _ids_lote(condicao, lote: int):
+    return select(doacoes.c.id).where(condicao).order_by(doacoes.c.id).limit(lote).with_for_update(skip_locked=True)
+
+
+async def expirar_pendentes(database, ttl_horas: float = DOACOES_PENDENTE_TTL_HORAS,
+                            lote: int = MANUTENCAO_LOTE) -> int:
+    """Marca como `expirado` as pendentes antigas; retorna quantas expirou"""
+    global expiradas
+    limite = datetime.now(timezone.utc) - timedelta(hours=ttl_horas)
+    condicao = (doacoes.c.status == "pendente") & (doacoes.c.data_doacao < limite)
+    total = 0
+    while True:
+        async with database.transaction():
+            if not await _travar(database):
+                break
+            ids = [linha["id"] for linha in await database.fetch_all(_ids_lote(condicao, lote))]
+            if ids:
+                # Condição repetida: uma confirmação pode ter vencido entre a seleção e o update
+                expiradas_lote = await database.fetch_all(
+                    doacoes.update().where(doacoes.c.id.in_(ids) & (doacoes.c.status == "pendente"))
+                    .values(status="expirado", status_alterado_em=func.now()).returning(
+                        doacoes.c.campanha_id, doacoes.c.valor, doacoes.c.data_doacao, doacoes.c.uf, doacoes.c.cidade
+                    )
+                )
+                await agregados.registrar_rollups(database, expiradas_lote, "pendente", "expirado")
+                total += len(expiradas_lote)
+                expiradas += len(expiradas_lote)
+        if len(ids) < lote:
+            break
+    return total
+
+
+async def arquivar(database, apos_dias: float = DOACOES_ARQUIVAR_APOS_DIAS,
+                   lote: int = MANUTENCAO_LOTE) -> int:
+    """Move para `doacoes_arquivo` as canceladas/expiradas há mais de `apos_dias`; retorna quantas moveu"""
+    global arquivadas
+    limite = datetime.now(timezone.utc) - timedelta(days=apos_dias)
+    condicao = doacoes.c.status.in_(STATUS_ARQUIVAVEIS) & (doacoes.c.status_alterado_em < limite)
+    colunas = [coluna.name for coluna in doacoes.columns]
+    total = 0
+    while True:
+        async with database.transaction():
+            if not await _travar(database):
+                break
+            ids = [linha["id"] for linha in await database.fetch_all(_ids_lote(condicao, lote))]
+            if ids:
+                await database.execute(doacoes_arquivo.insert().from_select(
+                    colunas, select(*[doacoes.c[nome] for nome in colunas]).where(doacoes.c.id.in_(ids))
+                ))
+                await database.execute(doacoes.delete().where(doacoes.c.id.in_(ids)))
+        total += len(ids)
+        arquivadas += len(ids)
+        if len(ids) < lote:
+            break
+    return total
+
+
+async def ciclo(database) -> dict:
+    global ultimo_ciclo_segundos
+    inicio = time.perf_counter()
+    resultado = {
+        "expiradas": await expirar_pendentes(database),
+        "arquivadas": await arquivar(database),
+        "chaves_idempotencia": await idempotencia.limpar_vencidas(database, lote=MANUTENCAO_LOTE),
+    }
+    ultimo_ciclo_segundos = time.perf_counter() - inicio
+    return resultado
+
+
+async def _varrer_periodicamente(database, intervalo: float) -> None:
+    while True:
+        await asyncio.sleep(intervalo)
+        try:
+            resultado = await ciclo(database)
+            if any(resultado.values()):
+                logger.info(
+                    "Manutenção: %d doações expiradas, %d arquivadas, %d chaves de idempotência apagadas (%.1f ms)",
+                    resultado["expiradas"], resultado["arquivadas"], resultado["chaves_idempotencia"],
+                    ultimo_ciclo_segundos * 1000
+                )
+        except Exception:
+            logger.exception("Falha na manutenção das doações")
+
+
+_tarefa: Optional[asyncio.Task] = None
+
+
+def iniciar(database, intervalo: float = MANUTENCAO_INTERVALO) -> None:
+    """Agenda a varredura em segundo plano (uma por processo; o lock evita trabalho duplicado)"""
+    global _tarefa
+    if intervalo > 0 and _tarefa is None:
+        _tarefa = asyncio.create_task(_varrer_periodicamente(database, intervalo))
+
+
+async def encerrar() -> None:
+    global _tarefa
+    if _tarefa is None:
+        return
+    _tarefa.cancel()
+    try:
+        await _tarefa
+    except asyncio.CancelledError:
+        pass
+    _tarefa = None
+
+
+def estatisticas() -> dict:
+    return {
+        "expiradas": expiradas,
+        "arquivadas": arquivadas,
+        "ultimo_ciclo_ms": round(ultimo_ciclo_segundos * 1000, 3),
+    }
+
+
+async def _main(args) -> None:
+    from db import database
+
+    await database.connect()
+    try:
+        if args.comando in ("expirar", "ciclo"):
+            print(f"✅ {await expirar_pendentes(database)} doações pendentes expiradas")
+        if args.comando in ("arquivar", "ciclo"):
+            print(f"✅ {await arquivar(database)} doações arquivadas")
+        if args.comando == "ciclo":
+            print(f"✅ {await idempotencia.limpar_vencidas(database, lote=MANUTENCAO_LOTE)} chaves de idempotência apagadas")
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Expiração e arquivamento de doações")
+    parser.add_argument("comando", choices=["expirar", "arquivar", "ciclo"])
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,180 @@
+"""Métricas em memória exportadas no formato texto do Prometheus
+
+- latência dos requests por rota (template) e status;
+- tempo e número de consultas ao banco, no total e atribuídos ao request corrente;
+- log das consultas mais lentas que DB_SLOW_QUERY_MS.
+"""
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Consultas acima deste tempo (ms) são registradas no log; 0 desliga
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class Histograma:
+    __slots__ = ("contagens", "soma", "total")
+
+    def __init__(self):
+        self.contagens = [0] * (len(BUCKETS) + 1)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor: float) -> None:
+        self.contagens[bisect_left(BUCKETS, valor)] += 1
+        self.soma += valor
+        self.total += 1
+
+
+class _Consultas:
+    """Acumulador das consultas feitas durante um request"""
+    __slots__ = ("quantidade", "segundos", "scope")
+
+    def __init__(self, scope):
+        self.quantidade = 0
+        self.segundos = 0.0
+        self.scope = scope
+
+    @property
+    def rota(self) -> str:
+        # Template da rota (ex.: /campanhas/{campanha_id}), preenchido pelo roteador
+        return getattr(self.scope.get("route"), "path", None) or "sem_rota"
+
+
+_request_atual: ContextVar[Optional[_Consultas]] = ContextVar("request_atual", default=None)
+
+_latencia_http: Dict[Tuple[str, str, str], Histograma] = {}
+_tempo_banco_http: Dict[Tuple[str, str], Histograma] = {}
+_consultas_http: Dict[Tuple[str, str], int] = {}
+_latencia_banco: Dict[str, Histograma] = {}
+_consultas_lentas = 0
+
+# Funções que devolvem métricas extras: (nome, tipo, ajuda, [(labels, valor), ...])
+_coletores: List[Callable[[], Iterable[tuple]]] = []
+
+
+def _observar(tabela: dict, chave, valor: float) -> None:
+    histograma = tabela.get(chave)
+    if histograma is None:
+        histograma = tabela[chave] = Histograma()
+    histograma.observar(valor)
+
+
+def registrar_consulta(operacao: str, query, segundos: float) -> None:
+    """Registra uma consulta ao banco e a atribui ao request corrente"""
+    global _consultas_lentas
+    _observar(_latencia_banco, operacao, segundos)
+
+    atual = _request_atual.get()
+    if atual is not None:
+        atual.quantidade += 1
+        atual.segundos += segundos
+
+    if DB_SLOW_QUERY_MS and segundos * 1000 >= DB_SLOW_QUERY_MS:
+        _consultas_lentas += 1
+        sql = " ".join(str(query).split())[:500]
+        logger.warning(
+            "Consulta lenta (%.1f ms) em %s: %s",
+            segundos * 1000, atual.rota if atual else "-", sql
+        )
+
+
+def registrar_coletor(coletor: Callable[[], Iterable[tuple]]) -> None:
+    _coletores.append(coletor)
+
+
+class MiddlewareMetricas:
+    """Middleware ASGI que mede cada request por rota (template) e status"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        consultas = _Consultas(scope)
+        token = _request_atual.set(consultas)
+        status = 500
+        inicio = time.perf_counter()
+
+        async def send_medido(mensagem):
+            nonlocal status
+            if mensagem["type"] == "http.response.start":
+                status = mensagem["status"]
+            await send(mensagem)
+
+        try:
+            await self.app(scope, receive, send_medido)
+        finally:
+            duracao = time.perf_counter() - inicio
+            _request_atual.reset(token)
+            rota = consultas.rota
+            metodo = scope["method"]
+            _observar(_latencia_http, (metodo, rota, str(status)), duracao)
+            _observar(_tempo_banco_http, (metodo, rota), consultas.segundos)
+            _consultas_http[(metodo, rota)] = _consultas_http.get((metodo, rota), 0) + consultas.quantidade
+
+
+def _labels(nomes: Tuple[str, ...], valores: Tuple) -> str:
+    def escapar(valor) -> str:
+        return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{nome}="{escapar(valor)}"' for nome, valor in zip(nomes, valores))
+
+
+def _histograma_texto(linhas: list, nome: str, ajuda: str, labels: Tuple[str, ...], tabela: dict) -> None:
+    linhas.append(f"# HELP {nome} {ajuda}")
+    linhas.append(f"# TYPE {nome} histogram")
+    for chave, histograma in tabela.items():
+        chave = chave if isinstance(chave, tuple) else (chave,)
+        base = _labels(labels, chave)
+        separador = "," if base else ""
+        acumulado = 0
+        for limite, contagem in zip(BUCKETS + (float("inf"),), histograma.contagens):
+            acumulado += contagem
+            le = "+Inf" if limite == float("inf") else repr(limite)
+            linhas.append(f'{nome}_bucket{{{base}{separador}le="{le}"}} {acumulado}')
+        linhas.append(f"{nome}_sum{{{base}}} {histograma.soma}")
+        linhas.append(f"{nome}_count{{{base}}} {histograma.total}")
+
+
+def exportar() -> str:
+    """Todas as métricas no formato texto do Prometheus"""
+    linhas: List[str] = []
+    _histograma_texto(
+        linhas, "http_request_duration_seconds", "Latência dos requests por rota e status",
+        ("method", "route", "status"), _latencia_http
+    )
+    _histograma_texto(
+        linhas, "http_request_db_seconds", "Tempo em consultas ao banco por request",
+        ("method", "route"), _tempo_banco_http
+    )
+    linhas.append("# HELP http_request_db_queries_total Consultas ao banco feitas pelos requests")
+    linhas.append("# TYPE http_request_db_queries_total counter")
+    for chave, total in _consultas_http.items():
+        linhas.append(f"http_request_db_queries_total{{{_labels(('method', 'route'), chave)}}} {total}")
+    _histograma_texto(
+        linhas, "db_query_duration_seconds", "Duração das consultas ao banco por operação",
+        ("operation",), _latencia_banco
+    )
+    linhas.append("# HELP db_slow_queries_total Consultas acima de DB_SLOW_QUERY_MS")
+    linhas.append("# TYPE db_slow_queries_total counter")
+    linhas.append(f"db_slow_queries_total {_consultas_lentas}")
+
+    for coletor in _coletores:
+        for nome, tipo, ajuda, amostras in coletor():
+            linhas.append(f"# HELP {nome} {ajuda}")
+            linhas.append(f"# TYPE {nome} {tipo}")
+            for labels, valor in amostras:
+                base = _labels(tuple(labels), tuple(labels.values())) if labels else ""
+                linhas.append(f"{nome}{{{base}}} {valor}" if base else f"{nome} {valor}")
+
+    return "\n".join(linhas) + "\n"
@@ -0,0 +1,548 @@
+"""Migrações versionadas do esquema
+
+Cada migração roda uma única vez e fica registrada em `schema_versao`, em duas
+etapas:
+
+- esquema: DDL rápido (tabelas e colunas novas), numa transação curta;
+- carga: o que é demorado (índices e preenchimento de dados), fora de
+  transação. No PostgreSQL os índices são criados com CONCURRENTLY, sem
+  bloquear as escritas, e os backfills processam lotes que fazem commit um a um.
+
+A versão só é registrada ao fim da carga; as duas etapas são idempotentes, então
+uma migração interrompida é simplesmente refeita. No PostgreSQL um advisory lock
+de sessão garante que só um processo migra por vez.
+
+O DDL e as cargas de cada migração ficam congelados aqui (tabelas próprias, SQL
+literal, sem chamar o código da aplicação): as tabelas de `models` e as funções
+de `agregados` refletem o esquema atual e mudam com ele.
+
+Uso pela linha de comando:
+    python migrations.py            # aplica as migrações pendentes
+    python migrations.py --status   # só mostra a versão do banco
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from sqlalchemy import (
+    Boolean, Column, Date, DateTime, Float, ForeignKey, Integer, LargeBinary, MetaData, String, Table, Text,
+    func, literal, select, union_all
+)
+from sqlalchemy.schema import CreateTable
+
+logger = logging.getLogger("uvicorn.error")
+
+# Se falso, o startup só verifica a versão e falha se houver migração pendente
+DB_MIGRAR_NA_INICIALIZACAO = os.getenv("DB_MIGRAR_NA_INICIALIZACAO", "true").lower() in ("1", "true", "sim")
+
+# Chave arbitrária do advisory lock das migrações
+_LOCK_MIGRACOES = 4_242_001
+
+schema_versao = Table(
+    "schema_versao",
+    MetaData(),
+    Column("versao", Integer, primary_key=True, autoincrement=False),
+    Column("descricao", String(200), nullable=False),
+    Column("aplicada_em", DateTime(timezone=True), server_default=func.now()),
+)
+
+
+async def _criar_tabela(database, tabela: Table) -> None:
+    await database.execute(CreateTable(tabela, if_not_exists=True))
+
+
+async def _criar_indice(database, nome: str, definicao: str, unico: bool = False) -> None:
+    """CREATE [UNIQUE] INDEX fora de transação; no PostgreSQL com CONCURRENTLY"""
+    tipo = "UNIQUE INDEX" if unico else "INDEX"
+    if database.url.dialect != "postgresql":
+        await database.execute(f"CREATE {tipo} IF NOT EXISTS {nome} ON {definicao}")
+        return
+    # Um CONCURRENTLY interrompido deixa o índice inválido, e o IF NOT EXISTS o manteria
+    invalido = await database.fetch_val(
+        "SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :nome",
+        {"nome": nome}
+    )
+    if invalido:
+        await database.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nome}")
+    await database.execute(f"CREATE {tipo} CONCURRENTLY IF NOT EXISTS {nome} ON {definicao}")
+
+
+async def _colunas(database, tabela: str) -> set:
+    if database.url.dialect == "postgresql":
+        linhas = await database.fetch_all(
+            "SELECT column_name AS nome FROM information_schema.columns WHERE table_name = :tabela",
+            {"tabela": tabela}
+        )
+    else:
+        linhas = await database.fetch_all(f"SELECT name AS nome FROM pragma_table_info('{tabela}')")
+    return {linha["nome"] for linha in linhas}
+
+
+async def _adicionar_colunas(database, tabela: str, colunas: List[Tuple[str, str]]) -> None:
+    existentes = await _colunas(database, tabela)
+    for nome, definicao in colunas:
+        if nome not in existentes:
+            await database.execute(f"ALTER TABLE {tabela} ADD COLUMN {nome} {definicao}")
+
+
+# --- Tabelas como eram quando cada migração foi publicada ---
+
+_congeladas = MetaData()
+
+_users_v1 = Table(
+    "users",
+    _congeladas,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("username", String(50), unique=True, nullable=False),
+    Column("cpf", String(14), unique=True, nullable=False),
+    Column("email", String(100), unique=True, nullable=False),
+    Column("password", String(255), nullable=False),
+)
+
+_campanhas_v1 = Table(
+    "campanhas",
+    _congeladas,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("nome", String(200), nullable=False),
+    Column("tipo_categoria", String(1000)),
+    Column("descricao", String(1000)),
+    Column("localizacao", String(100), server_default="São Paulo, SP"),
+    Column("meta_valor", Float, nullable=False),
+    Column("valor_arrecadado", Float, server_default="0.0"),
+    Column("website", String(1000)),
+    Column("telefone", String(20)),
+    Column("data_inicio", DateTime(timezone=True), server_default=func.now()),
+    Column("data_fim", DateTime(timezone=True), nullable=True),
+    Column("ativa", Boolean, server_default="true"),
+    Column("email", String(1000), nullable=True),
+    Column("rating", Float, server_default="4.8"),
+)
+
+_doacoes_v1 = Table(
+    "doacoes",
+    _congeladas,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("campanha_id", Integer, ForeignKey("campanhas.id", ondelete="CASCADE"), nullable=False),
+    Column("user_id", Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True),
+    Column("valor", Float, nullable=False),
+    Column("doador_nome", String(200), nullable=False),
+    Column("doador_cpf", String(14), nullable=False),
+    Column("doador_email", String(100), nullable=True),
+    Column("rua", String(200), nullable=False),
+    Column("numero", String(20), nullable=False),
+    Column("complemento", String(100), nullable=True),
+    Column("bairro", String(100), nullable=False),
+    Column("cidade", String(100), nullable=False),
+    Column("uf", String(2), nullable=False),
+    Column("cep", String(8), nullable=False),
+    Column("data_doacao", DateTime(timezone=True), server_default=func.now()),
+    Column("metodo_pagamento", String(50), server_default="PIX"),
+    Column("status", String(20), server_default="pendente"),
+    Column("pix_code", String(500), nullable=True),
+    Column("pix_qr_code", String(1000), nullable=True),
+)
+
+_contadores_v3 = Table(
+    "contadores",
+    _congeladas,
+    Column("nome", String(50), primary_key=True),
+    Column("fatia", Integer, primary_key=True, autoincrement=False),
+    Column("valor", Float, nullable=False, server_default="0.0"),
+)
+
+# Mesmas colunas de `doacoes` na v8 (v1 + pix_txid), sem FKs
+_doacoes_arquivo_v8 = Table(
+    "doacoes_arquivo",
+    _congeladas,
+    *[
+        Column(coluna.name, coluna.type, primary_key=coluna.primary_key,
+               autoincrement=False, nullable=coluna.nullable)
+        for coluna in _doacoes_v1.columns
+        if coluna.name != "pix_qr_code"
+    ],
+    Column("pix_txid", String(35), nullable=True),
+    Column("pix_qr_code", String(1000), nullable=True),
+    Column("arquivada_em", DateTime(timezone=True), server_default=func.now()),
+)
+
+
+def _tabela_rollup_v9(nome: str, *chaves: Column) -> Table:
+    return Table(
+        nome,
+        _congeladas,
+        Column("campanha_id", Integer, primary_key=True, autoincrement=False),
+        *chaves,
+        Column("status", String(20), primary_key=True),
+        Column("fatia", Integer, primary_key=True, autoincrement=False),
+        Column("quantidade", Integer, nullable=False, server_default="0"),
+        Column("total", Float, nullable=False, server_default="0.0"),
+    )
+
+
+_doacoes_diarias_v9 = _tabela_rollup_v9(
+    "doacoes_diarias", Column("dia", Date, primary_key=True), Column("uf", String(2), primary_key=True)
+)
+_doacoes_cidades_v9 = _tabela_rollup_v9(
+    "doacoes_cidades", Column("uf", String(2), primary_key=True), Column("cidade", String(100), primary_key=True)
+)
+
+_idempotencia_v12 = Table(
+    "idempotencia",
+    _congeladas,
+    Column("escopo", String(50), primary_key=True),
+    Column("chave", String(255), primary_key=True),
+    Column("impressao", String(32), nullable=False),
+    Column("status", Integer, nullable=True),
+    Column("corpo", LargeBinary, nullable=True),
+    Column("headers", Text, nullable=True),
+    Column("criada_em", DateTime(timezone=True), nullable=False),
+)
+
+# Valor de `campanhas.busca` no PostgreSQL (v5); {linha} é "" ou "NEW." (no trigger)
+_BUSCA_PG_V5 = """
+    setweight(to_tsvector('portuguese', coalesce({linha}nome, '')), 'A') ||
+    setweight(to_tsvector('portuguese', coalesce({linha}tipo_categoria, '')), 'B') ||
+    setweight(to_tsvector('portuguese', coalesce({linha}localizacao, '')), 'B') ||
+    setweight(to_tsvector('portuguese', coalesce({linha}descricao, '')), 'C')
+"""
+
+_FTS_COLUNAS_V5 = "nome, tipo_categoria, localizacao, descricao"
+_FTS_NOVAS_V5 = "new.id, new.nome, new.tipo_categoria, new.localizacao, new.descricao"
+_FTS_ANTIGAS_V5 = "old.id, old.nome, old.tipo_categoria, old.localizacao, old.descricao"
+
+
+# --- Migrações (nunca altere uma já publicada; acrescente uma nova) ---
+
+async def _v1_esquema_inicial(database) -> None:
+    for tabela in (_users_v1, _campanhas_v1, _doacoes_v1):
+        await _criar_tabela(database, tabela)
+
+
+async def _v2_indices_paginacao(database) -> None:
+    await _criar_indice(database, "ix_campanhas_ativa_data_inicio", "campanhas (ativa, data_inicio, id)")
+    await _criar_indice(database, "ix_doacoes_campanha_data", "doacoes (campanha_id, data_doacao, id)")
+
+
+async def _v3_contadores(database) -> None:
+    await _criar_tabela(database, _contadores_v3)
+
+
+_FATIAS_V3 = 8
+
+
+async def _v3_carga(database) -> None:
+    # Contadores iniciais a partir das tabelas base; a fatia 0 leva o valor, as demais zero
+    if await database.fetch_val(select(func.count()).select_from(_contadores_v3)):
+        return
+    campanhas, doacoes = _campanhas_v1.c, _doacoes_v1.c
+    reais = await database.fetch_one(select(
+        select(func.count()).where(campanhas.ativa == True).scalar_subquery().label("total_campanhas_ativas"),
+        select(func.coalesce(func.sum(campanhas.valor_arrecadado), 0.0)).where(campanhas.ativa == True)
+        .scalar_subquery().label("total_arrecadado"),
+        select(func.count()).where(doacoes.status == "confirmado").scalar_subquery().label("total_doacoes"),
+        select(func.count()).select_from(_users_v1).scalar_subquery().label("total_usuarios"),
+    ))
+    await database.execute(_contadores_v3.insert().values([
+        {"nome": nome, "fatia": fatia, "valor": valor if fatia == 0 else 0}
+        for nome, valor in dict(reais).items()
+        for fatia in range(_FATIAS_V3)
+    ]))
+
+
+async def _v4_agregados_campanha(database) -> None:
+    await _adicionar_colunas(database, "campanhas", [
+        ("total_doacoes", "INTEGER NOT NULL DEFAULT 0"),
+        ("doacao_minima", "FLOAT"),
+        ("doacao_maxima", "FLOAT"),
+        ("ultima_doacao_em", "TIMESTAMP WITH TIME ZONE"),
+    ])
+
+
+async def _v4_carga(database, lote: int = 500) -> None:
+    # Agregados das doações confirmadas, por faixas de ids (um commit por faixa)
+    maior_id = await database.fetch_val("SELECT max(id) FROM campanhas") or 0
+    for inicio in range(0, maior_id, lote):
+        await database.execute(
+            "UPDATE campanhas SET "
+            + ", ".join(
+                f"{coluna} = (SELECT {agregado} FROM doacoes "
+                "WHERE doacoes.campanha_id = campanhas.id AND doacoes.status = 'confirmado')"
+                for coluna, agregado in (
+                    ("total_doacoes", "count(*)"), ("doacao_minima", "min(valor)"),
+                    ("doacao_maxima", "max(valor)"), ("ultima_doacao_em", "max(data_doacao)"),
+                )
+            )
+            + " WHERE id > :inicio AND id <= :fim",
+            {"inicio": inicio, "fim": inicio + lote}
+        )
+
+
+async def _v5_busca_campanhas(database) -> None:
+    if database.url.dialect == "postgresql":
+        # Coluna comum (sem reescrever a tabela sob lock) mantida por trigger; a carga preenche as existentes
+        await _adicionar_colunas(database, "campanhas", [("busca", "tsvector")])
+        await database.execute(
+            "CREATE OR REPLACE FUNCTION campanhas_busca_atualizar() RETURNS trigger AS $$ "
+            f"BEGIN NEW.busca := {_BUSCA_PG_V5.format(linha='NEW.')}; RETURN NEW; END "
+            "$$ LANGUAGE plpgsql"
+        )
+        await database.execute("DROP TRIGGER IF EXISTS campanhas_busca_atualizar ON campanhas")
+        await database.execute(
+            f"CREATE TRIGGER campanhas_busca_atualizar BEFORE INSERT OR UPDATE OF {_FTS_COLUNAS_V5} "
+            "ON campanhas FOR EACH ROW EXECUTE FUNCTION campanhas_busca_atualizar()"
+        )
+        return
+    await database.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS campanhas_busca USING fts5({_FTS_COLUNAS_V5}, "
+        "content='campanhas', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+    )
+    await database.execute(
+        "CREATE TRIGGER IF NOT EXISTS campanhas_busca_ai AFTER INSERT ON campanhas BEGIN "
+        f"INSERT INTO campanhas_busca(rowid, {_FTS_COLUNAS_V5}) VALUES ({_FTS_NOVAS_V5}); END"
+    )
+    await database.execute(
+        "CREATE TRIGGER IF NOT EXISTS campanhas_busca_ad AFTER DELETE ON campanhas BEGIN "
+        f"INSERT INTO campanhas_busca(campanhas_busca, rowid, {_FTS_COLUNAS_V5}) VALUES ('delete', {_FTS_ANTIGAS_V5}); END"
+    )
+    # Só as colunas indexadas: confirmar doações não mexe no índice
+    await database.execute(
+        f"CREATE TRIGGER IF NOT EXISTS campanhas_busca_au AFTER UPDATE OF {_FTS_COLUNAS_V5} ON campanhas BEGIN "
+        f"INSERT INTO campanhas_busca(campanhas_busca, rowid, {_FTS_COLUNAS_V5}) VALUES ('delete', {_FTS_ANTIGAS_V5}); "
+        f"INSERT INTO campanhas_busca(rowid, {_FTS_COLUNAS_V5}) VALUES ({_FTS_NOVAS_V5}); END"
+    )
+    await database.execute("INSERT INTO campanhas_busca(campanhas_busca) VALUES ('rebuild')")
+
+
+async def _v5_carga(database, lote: int = 1000) -> None:
+    if database.url.dialect != "postgresql":
+        return
+    while True:
+        linhas = await database.fetch_all(
+            f"UPDATE campanhas SET busca = {_BUSCA_PG_V5.format(linha='')} WHERE id IN ("
+            f"SELECT id FROM campanhas WHERE busca IS NULL ORDER BY id LIMIT {lote}) RETURNING id"
+        )
+        if len(linhas) < lote:
+            break
+    await _criar_indice(database, "ix_campanhas_busca", "campanhas USING gin (busca)")
+    try:
+        await database.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        await _criar_indice(database, "ix_campanhas_nome_trgm", "campanhas USING gin (nome gin_trgm_ops)")
+    except Exception as e:
+        # Sem permissão para criar a extensão, a busca segue só com tsvector
+        logger.warning("Índice de trigramas não criado (pg_trgm indisponível): %s", e)
+
+
+async def _v6_indice_doacoes_usuario(database) -> None:
+    await _criar_indice(database, "ix_doacoes_user_data", "doacoes (user_id, data_doacao, id)")
+
+
+async def _v7_txid_doacoes(database) -> None:
+    await _adicionar_colunas(database, "doacoes", [("pix_txid", "VARCHAR(35)")])
+
+
+async def _v8_expiracao_e_arquivo(database) -> None:
+    await _criar_tabela(database, _doacoes_arquivo_v8)
+
+
+async def _v8_carga(database) -> None:
+    await _criar_indice(database, "ix_doacoes_pendentes_data", "doacoes (data_doacao, id) WHERE status = 'pendente'")
+    await _criar_indice(database, "ix_doacoes_arquivo_campanha_data", "doacoes_arquivo (campanha_id, data_doacao, id)")
+    await _criar_indice(database, "ix_doacoes_arquivo_user_data", "doacoes_arquivo (user_id, data_doacao, id)")
+
+
+async def _v9_rollups_doacoes(database) -> None:
+    await _criar_tabela(database, _doacoes_diarias_v9)
+    await _criar_tabela(database, _doacoes_cidades_v9)
+
+
+def _dia_v9(database, coluna):
+    """Dia da doação no fuso dos rollups (ROLLUP_FUSO), calculado pelo banco"""
+    fuso = os.getenv("ROLLUP_FUSO", "America/Sao_Paulo")
+    if database.url.dialect == "postgresql":
+        return func.date(func.timezone(fuso, coluna))
+    # SQLite não tem fusos: desloca a data UTC gravada pelo offset atual do fuso
+    try:
+        offset = datetime.now(ZoneInfo(fuso)).utcoffset()
+    except ZoneInfoNotFoundError:
+        offset = timedelta(hours=-3)
+    return func.date(coluna, f"{int(offset.total_seconds() // 60):+d} minutes")
+
+
+async def _v9_carga(database, lote: int = 500) -> None:
+    # Rollups a partir das doações vivas e arquivadas, por faixas de campanhas (uma transação por faixa)
+    colunas = ("campanha_id", "data_doacao", "uf", "cidade", "status", "valor")
+    maior_id = await database.fetch_val(select(func.max(union_all(
+        select(func.max(_campanhas_v1.c.id).label("id")),
+        select(func.max(_doacoes_arquivo_v8.c.campanha_id).label("id")),
+    ).subquery().c.id))) or 0
+    for inicio in range(0, maior_id, lote):
+        origem = union_all(*[
+            select(*[tabela.c[nome] for nome in colunas])
+            .where((tabela.c.campanha_id > inicio) & (tabela.c.campanha_id <= inicio + lote))
+            for tabela in (_doacoes_v1, _doacoes_arquivo_v8)
+        ]).subquery()
+        async with database.transaction():
+            if database.url.dialect == "postgresql":
+                # Segura os incrementos concorrentes até o commit
+                await database.execute("LOCK TABLE doacoes_diarias, doacoes_cidades IN SHARE ROW EXCLUSIVE MODE")
+            for tabela, chaves in (
+                (_doacoes_diarias_v9, [origem.c.campanha_id, _dia_v9(database, origem.c.data_doacao).label("dia"),
+                                       origem.c.uf, origem.c.status]),
+                (_doacoes_cidades_v9, [origem.c.campanha_id, origem.c.uf, origem.c.cidade, origem.c.status]),
+            ):
+                await database.execute(tabela.delete().where(
+                    (tabela.c.campanha_id > inicio) & (tabela.c.campanha_id <= inicio + lote)
+                ))
+                await database.execute(tabela.insert().from_select(
+                    [chave.name for chave in chaves] + ["fatia", "quantidade", "total"],
+                    select(*chaves, literal(0), func.count(), func.sum(origem.c.valor)).group_by(*chaves)
+                ))
+
+
+async def _v10_datas_obrigatorias(database) -> None:
+    # Sem NULLs a paginação keyset compara (data, id) como tupla e usa os índices
+    for tabela, coluna in (("campanhas", "data_inicio"), ("doacoes", "data_doacao"), ("doacoes_arquivo", "data_doacao")):
+        await database.execute(f"UPDATE {tabela} SET {coluna} = CURRENT_TIMESTAMP WHERE {coluna} IS NULL")
+        # O SQLite não altera a nulidade de uma coluna existente sem recriar a tabela
+        if database.url.dialect != "postgresql":
+            continue
+        # A verificação da CHECK NOT VALID não bloqueia escritas, e o SET NOT NULL a aproveita sem varrer a tabela
+        restricao = f"{tabela}_{coluna}_not_null"
+        await database.execute(f"ALTER TABLE {tabela} DROP CONSTRAINT IF EXISTS {restricao}")
+        await database.execute(f"ALTER TABLE {tabela} ADD CONSTRAINT {restricao} CHECK ({coluna} IS NOT NULL) NOT VALID")
+        await database.execute(f"ALTER TABLE {tabela} VALIDATE CONSTRAINT {restricao}")
+        await database.execute(f"ALTER TABLE {tabela} ALTER COLUMN {coluna} SET NOT NULL")
+        await database.execute(f"ALTER TABLE {tabela} DROP CONSTRAINT {restricao}")
+
+
+async def _v11_status_alterado_em(database) -> None:
+    for tabela in ("doacoes", "doacoes_arquivo"):
+        await _adicionar_colunas(database, tabela, [("status_alterado_em", "TIMESTAMP WITH TIME ZONE")])
+
+
+async def _v11_carga(database, lote: int = 1000) -> None:
+    # Canceladas/expiradas antes da coluna existir: a carência do arquivamento começa agora
+    while True:
+        linhas = await database.fetch_all(
+            "UPDATE doacoes SET status_alterado_em = CURRENT_TIMESTAMP WHERE id IN ("
+            "SELECT id FROM doacoes WHERE status IN ('cancelado', 'expirado') AND status_alterado_em IS NULL "
+            f"ORDER BY id LIMIT {lote}) RETURNING id"
+        )
+        if len(linhas) < lote:
+            break
+
+
+async def _v12_idempotencia(database) -> None:
+    await _criar_tabela(database, _idempotencia_v12)
+
+
+async def _v12_carga(database) -> None:
+    await _criar_indice(database, "ix_idempotencia_criada_em", "idempotencia (criada_em)")
+
+
+async def _v13_txid_unico(database) -> None:
+    await _criar_indice(database, "ux_doacoes_pix_txid", "doacoes (pix_txid)", unico=True)
+
+
+Etapa = Optional[Callable[..., Awaitable[None]]]
+
+# (versão, descrição, esquema, carga)
+MIGRACOES: List[Tuple[int, str, Etapa, Etapa]] = [
+    (1, "esquema inicial", _v1_esquema_inicial, None),
+    (2, "índices da paginação keyset", None, _v2_indices_paginacao),
+    (3, "contadores da plataforma", _v3_contadores, _v3_carga),
+    (4, "agregados por campanha", _v4_agregados_campanha, _v4_carga),
+    (5, "busca textual de campanhas", _v5_busca_campanhas, _v5_carga),
+    (6, "índice do histórico de doações por usuário", None, _v6_indice_doacoes_usuario),
+    (7, "txid do PIX nas doações", _v7_txid_doacoes, None),
+    (8, "expiração de pendentes e arquivo de doações", _v8_expiracao_e_arquivo, _v8_carga),
+    (9, "rollups diários e regionais das doações", _v9_rollups_doacoes, _v9_carga),
+    (10, "datas obrigatórias na paginação keyset", None, _v10_datas_obrigatorias),
+    (11, "data da mudança de status das doações", _v11_status_alterado_em, _v11_carga),
+    (12, "chaves de idempotência compartilhadas entre os workers", _v12_idempotencia, _v12_carga),
+    (13, "txid do PIX único nas doações", None, _v13_txid_unico),
+]
+
+VERSAO_ATUAL = MIGRACOES[-1][0]
+
+
+async def versao_do_banco(database) -> int:
+    """Versão do esquema aplicada no banco (0 se nunca migrado)"""
+    try:
+        return await database.fetch_val(select(func.max(schema_versao.c.versao))) or 0
+    except Exception:
+        # Tabela de controle ainda não existe
+        return 0
+
+
+async def aplicar_migracoes(database) -> List[int]:
+    """Aplica as migrações pendentes e retorna as versões aplicadas"""
+    aplicadas = []
+    # Uma só conexão do pool: o advisory lock de sessão pertence a ela
+    async with database.connection():
+        if database.url.dialect == "postgresql":
+            await database.execute(f"SELECT pg_advisory_lock({_LOCK_MIGRACOES})")
+        try:
+            await _criar_tabela(database, schema_versao)
+            
+            # Relida sob o lock: outro processo pode ter migrado enquanto esperávamos
+            atual = await database.fetch_val(select(func.max(schema_versao.c.versao))) or 0
+            for versao, descricao, esquema, carga in MIGRACOES:
+                if versao <= atual:
+                    continue
+                if esquema:
+                    async with database.transaction():
+                        await esquema(database)
+                if carga:
+                    await carga(database)
+                await database.execute(schema_versao.insert().values(versao=versao, descricao=descricao))
+                aplicadas.append(versao)
+                logger.info("Migração %d aplicada: %s", versao, descricao)
+        finally:
+            if database.url.dialect == "postgresql":
+                await database.execute(f"SELECT pg_advisory_unlock({_LOCK_MIGRACOES})")
+    return aplicadas
+
+
+async def garantir_esquema(database) -> int:
+    """Verificação de esquema do startup: uma consulta quando já está atualizado
+
+    Com migrações pendentes, aplica-as (sob lock) ou falha, conforme
+    DB_MIGRAR_NA_INICIALIZACAO. Retorna a versão do banco.
+    """
+    versao = await versao_do_banco(database)
+    if versao >= VERSAO_ATUAL:
+        return versao
+    if not DB_MIGRAR_NA_INICIALIZACAO:
+        raise RuntimeError(
+            f"Esquema do banco na versão {versao}, código espera {VERSAO_ATUAL}: rode `python migrations.py`"
+        )
+    await aplicar_migracoes(database)
+    return VERSAO_ATUAL
+
+
+async def _main(args) -> None:
+    from db import database
+
+    await database.connect()
+    try:
+        if args.status:
+            print(f"Versão do banco: {await versao_do_banco(database)} (código: {VERSAO_ATUAL})")
+            return
+        aplicadas = await aplicar_migracoes(database)
+        if aplicadas:
+            print(f"✅ Migrações aplicadas: {aplicadas}")
+        else:
+            print("✅ Esquema já está atualizado")
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrações do esquema do banco")
+    parser.add_argument("--status", action="store_true", help="Só mostra a versão do banco")
+    asyncio.run(_main(parser.parse_args()))
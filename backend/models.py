@@ -1,7 +1,15 @@
-from sqlalchemy import Table, Column, Integer, String, Float, DateTime, Boolean, ForeignKey, func
+from sqlalchemy import Table, Column, Index, Integer, String, Float, Date, DateTime, Boolean, ForeignKey, LargeBinary, Text, func
+from sqlalchemy.dialects import sqlite
 from db import Base
 from datetime import datetime, timezone
 
+# No SQLite (banco local) as datas são gravadas sem microssegundos, no mesmo formato
+# do CURRENT_TIMESTAMP, para que comparações de data (paginação keyset) sejam coerentes
+Timestamp = DateTime(timezone=True).with_variant(
+    sqlite.DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite"
+)
+
 # Tabela de usuários
 users = Table(
     "users",
@@ -26,11 +34,18 @@ campanhas = Table(
     Column("valor_arrecadado", Float, default=0.0, server_default="0.0"),
     Column("website", String(1000)),
     Column("telefone", String(20)),
-    Column("data_inicio", DateTime(timezone=True), server_default=func.now()),
-    Column("data_fim", DateTime(timezone=True), nullable=True),
+    Column("data_inicio", Timestamp, server_default=func.now(), nullable=False),
+    Column("data_fim", Timestamp, nullable=True),
     Column("ativa", Boolean, default=True, server_default="true"),
     Column("email", String(1000), nullable=True),
     Column("rating", Float, default=4.8, server_default="4.8"),
+    # Agregados das doações confirmadas, atualizados na confirmação (a soma é valor_arrecadado)
+    Column("total_doacoes", Integer, default=0, server_default="0", nullable=False),
+    Column("doacao_minima", Float, nullable=True),
+    Column("doacao_maxima", Float, nullable=True),
+    Column("ultima_doacao_em", Timestamp, nullable=True),
+    # Paginação keyset da listagem por data de início
+    Index("ix_campanhas_ativa_data_inicio", "ativa", "data_inicio", "id"),
 )
 
 # Tabela de doações
@@ -53,9 +68,90 @@ doacoes = Table(
     Column("uf", String(2), nullable=False),
     Column("cep", String(8), nullable=False),
     
-    Column("data_doacao", DateTime(timezone=True), server_default=func.now()),
+    Column("data_doacao", Timestamp, server_default=func.now(), nullable=False),
     Column("metodo_pagamento", String(50), default="PIX", server_default="PIX"),
     Column("status", String(20), default="pendente", server_default="pendente"),
+    # Última mudança de status (confirmação, cancelamento, expiração); a carência do arquivamento conta daqui
+    Column("status_alterado_em", Timestamp, nullable=True),
     Column("pix_code", String(500), nullable=True),
+    # txid do PIX, único por doação (identifica a doação no pagamento e na ingestão em lote)
+    Column("pix_txid", String(35), nullable=True),
     Column("pix_qr_code", String(1000), nullable=True),
-)
\ No newline at end of file
+    # Paginação keyset das doações de uma campanha
+    Index("ix_doacoes_campanha_data", "campanha_id", "data_doacao", "id"),
+    # Histórico do doador (paginação keyset e resumo por usuário)
+    Index("ix_doacoes_user_data", "user_id", "data_doacao", "id"),
+    # A ingestão em lote casa as linhas do RETURNING com os requests pelo txid
+    Index("ux_doacoes_pix_txid", "pix_txid", unique=True),
+)
+# Varredura das pendentes vencidas: índice parcial, só com as linhas pendentes
+Index(
+    "ix_doacoes_pendentes_data", doacoes.c.data_doacao, doacoes.c.id,
+    postgresql_where=doacoes.c.status == "pendente",
+    sqlite_where=doacoes.c.status == "pendente",
+)
+
+# Doações canceladas/expiradas retiradas de `doacoes` (mesmas colunas, sem FKs)
+doacoes_arquivo = Table(
+    "doacoes_arquivo",
+    Base.metadata,
+    *[
+        Column(coluna.name, coluna.type, primary_key=coluna.primary_key,
+               autoincrement=False, nullable=coluna.nullable)
+        for coluna in doacoes.columns
+    ],
+    Column("arquivada_em", Timestamp, server_default=func.now()),
+    Index("ix_doacoes_arquivo_campanha_data", "campanha_id", "data_doacao", "id"),
+    Index("ix_doacoes_arquivo_user_data", "user_id", "data_doacao", "id"),
+)
+# Contadores globais da plataforma, mantidos nas mesmas transações das escritas.
+# Cada contador é dividido em fatias para que escritas concorrentes não disputem a mesma linha.
+contadores = Table(
+    "contadores",
+    Base.metadata,
+    Column("nome", String(50), primary_key=True),
+    Column("fatia", Integer, primary_key=True, autoincrement=False),
+    Column("valor", Float, nullable=False, default=0.0, server_default="0.0"),
+)
+
+# Rollups das doações (quantidade e soma por status), mantidos nas mesmas transações
+# das escritas e fatiados como os contadores. Incluem as doações já arquivadas.
+doacoes_diarias = Table(
+    "doacoes_diarias",
+    Base.metadata,
+    Column("campanha_id", Integer, primary_key=True, autoincrement=False),
+    Column("dia", Date, primary_key=True),
+    Column("uf", String(2), primary_key=True),
+    Column("status", String(20), primary_key=True),
+    Column("fatia", Integer, primary_key=True, autoincrement=False),
+    Column("quantidade", Integer, nullable=False, default=0, server_default="0"),
+    Column("total", Float, nullable=False, default=0.0, server_default="0.0"),
+)
+
+doacoes_cidades = Table(
+    "doacoes_cidades",
+    Base.metadata,
+    Column("campanha_id", Integer, primary_key=True, autoincrement=False),
+    Column("uf", String(2), primary_key=True),
+    Column("cidade", String(100), primary_key=True),
+    Column("status", String(20), primary_key=True),
+    Column("fatia", Integer, primary_key=True, autoincrement=False),
+    Column("quantidade", Integer, nullable=False, default=0, server_default="0"),
+    Column("total", Float, nullable=False, default=0.0, server_default="0.0"),
+)
+
+# Chaves de idempotência (Idempotency-Key): a reserva e a resposta do primeiro request,
+# compartilhadas por todos os workers. `status` fica NULL enquanto o request executa.
+idempotencia = Table(
+    "idempotencia",
+    Base.metadata,
+    Column("escopo", String(50), primary_key=True),
+    Column("chave", String(255), primary_key=True),
+    Column("impressao", String(32), nullable=False),
+    Column("status", Integer, nullable=True),
+    Column("corpo", LargeBinary, nullable=True),
+    Column("headers", Text, nullable=True),
+    Column("criada_em", Timestamp, nullable=False),
+    # Limpeza das chaves vencidas
+    Index("ix_idempotencia_criada_em", "criada_em"),
+)
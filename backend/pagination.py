@@ -0,0 +1,86 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Column, literal, tuple_
+
+from serializacao import dumps
+
+# Cabeçalho com o cursor da próxima página (ausente na última página)
+HEADER_PROXIMO_CURSOR = "X-Next-Cursor"
+
+LIMITE_PADRAO = 100
+LIMITE_MAXIMO = 1000
+
+# Linhas acumuladas por chunk no modo NDJSON
+LINHAS_POR_CHUNK = 200
+
+
+def empacotar_cursor(chave: list) -> str:
+    """Gera um cursor opaco a partir da chave de ordenação da última linha"""
+    bruto = json.dumps(chave)
+    return base64.urlsafe_b64encode(bruto.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def desempacotar_cursor(cursor: str) -> list:
+    """Lê a chave de um cursor gerado por empacotar_cursor"""
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+def codificar_cursor(data: datetime, id: int) -> str:
+    """Cursor da chave (data, id)"""
+    return empacotar_cursor([data.isoformat(), id])
+
+
+def decodificar_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Lê um cursor gerado por codificar_cursor"""
+    try:
+        data, id = desempacotar_cursor(cursor)
+        return datetime.fromisoformat(data), int(id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+def paginar(query, coluna_data: Column, coluna_id: Column, cursor: Optional[str]):
+    """Aplica paginação keyset decrescente em (coluna_data, coluna_id)
+
+    A coluna de data é NOT NULL: a comparação de tuplas e a ordem decrescente
+    percorrem de trás para frente os índices (..., data, id) existentes.
+    """
+    if cursor:
+        data, id = decodificar_cursor(cursor)
+        query = query.where(
+            tuple_(coluna_data, coluna_id) < tuple_(literal(data, coluna_data.type), literal(id, coluna_id.type))
+        )
+    return query.order_by(coluna_data.desc(), coluna_id.desc())
+
+
+def proximo_cursor(linhas, nome_data: str, limite: int) -> Optional[str]:
+    """Cursor da próxima página, ou None se esta foi a última"""
+    if not limite or len(linhas) < limite:
+        return None
+    ultima = linhas[-1]
+    return codificar_cursor(ultima[nome_data], ultima["id"])
+
+
+def resposta_ndjson(database, query, mapear) -> StreamingResponse:
+    """Transmite o resultado da query como NDJSON, linha a linha, conforme sai do banco"""
+    async def gerar():
+        buffer = []
+        # O cursor do asyncpg exige uma transação aberta
+        async with database.transaction():
+            async for linha in database.iterate(query):
+                buffer.append(dumps(mapear(linha)))
+                if len(buffer) >= LINHAS_POR_CHUNK:
+                    yield b"\n".join(buffer) + b"\n"
+                    buffer = []
+        if buffer:
+            yield b"\n".join(buffer) + b"\n"
+
+    return StreamingResponse(gerar(), media_type="application/x-ndjson")
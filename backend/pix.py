@@ -0,0 +1,130 @@
+"""PIX copia e cola (BR Code / EMV QRCPS-MPM) e renderização do QR Code
+
+O payload é uma sequência de campos ID + tamanho (2 dígitos) + valor, terminada
+pelo CRC16-CCITT-FALSE (campo 63). Tudo que não depende da doação (chave,
+recebedor, cidade, descrição da campanha) é montado uma vez por campanha,
+junto com o estado do CRC até ali; por doação só entram valor e txid.
+
+A imagem do QR é gerada sob demanda, fora do event loop, com a biblioteca
+`qrcode` (PNG via `pypng`), e guardada em cache pelo payload.
+"""
+import asyncio
+import os
+import re
+import unicodedata
+import uuid
+from functools import lru_cache
+from io import BytesIO
+from typing import Optional, Tuple
+
+from cache import CacheTTL
+
+try:
+    import qrcode
+    import qrcode.image.pure
+    import qrcode.image.svg
+except ImportError:  # instalação sem a qrcode: o endpoint de QR responde 501
+    qrcode = None
+
+# Chave PIX que recebe as doações; sem ela as doações são criadas sem pix_code
+PIX_CHAVE = os.getenv("PIX_CHAVE")
+PIX_NOME_RECEBEDOR = os.getenv("PIX_NOME_RECEBEDOR", "JUNTOSMAIS")
+PIX_CIDADE = os.getenv("PIX_CIDADE", "SAO PAULO")
+
+# Imagens de QR guardadas (o payload não muda depois de criado)
+PIX_QR_CACHE_TAMANHO = int(os.getenv("PIX_QR_CACHE_TAMANHO", "2048"))
+PIX_QR_CACHE_TTL = float(os.getenv("PIX_QR_CACHE_TTL", "3600"))
+
+TIPOS_IMAGEM = {"png": "image/png", "svg": "image/svg+xml"}
+
+
+def _tabela_crc() -> Tuple[int, ...]:
+    tabela = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        tabela.append(crc & 0xFFFF)
+    return tuple(tabela)
+
+
+_TABELA_CRC = _tabela_crc()
+
+
+def crc16(dados: bytes, crc: int = 0xFFFF) -> int:
+    """CRC16-CCITT-FALSE (polinômio 0x1021, inicial 0xFFFF); aceita um estado parcial"""
+    for byte in dados:
+        crc = ((crc << 8) & 0xFFFF) ^ _TABELA_CRC[((crc >> 8) ^ byte) & 0xFF]
+    return crc
+
+
+def _campo(id: str, valor: str) -> str:
+    return f"{id}{len(valor):02d}{valor}"
+
+
+def _texto(valor: str, tamanho: int) -> str:
+    """Texto sem acentos e só com caracteres aceitos pelos bancos"""
+    sem_acentos = unicodedata.normalize("NFKD", valor).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^A-Za-z0-9 .-]", "", sem_acentos).strip().upper()[:tamanho]
+
+
+@lru_cache(maxsize=4096)
+def _partes_campanha(campanha_id: int, nome: str) -> Tuple[str, int, str]:
+    """(prefixo, CRC do prefixo, sufixo) do payload de uma campanha"""
+    descricao = _texto(f"Campanha {campanha_id} {nome}", max(0, 72 - len(PIX_CHAVE)))
+    conta = _campo("00", "br.gov.bcb.pix") + _campo("01", PIX_CHAVE)
+    if descricao:
+        conta += _campo("02", descricao)
+    prefixo = (
+        _campo("00", "01")
+        + _campo("01", "12")  # uso único: cada doação tem seu valor e txid
+        + _campo("26", conta)
+        + _campo("52", "0000")
+        + _campo("53", "986")
+    )
+    sufixo = (
+        _campo("58", "BR")
+        + _campo("59", _texto(PIX_NOME_RECEBEDOR, 25))
+        + _campo("60", _texto(PIX_CIDADE, 15))
+    )
+    return prefixo, crc16(prefixo.encode("ascii")), sufixo
+
+
+def novo_txid() -> str:
+    return uuid.uuid4().hex[:25]
+
+
+def gerar_payload(campanha_id: int, nome_campanha: str, valor: float, txid: str) -> Optional[str]:
+    """PIX copia e cola de uma doação, ou None se PIX_CHAVE não estiver configurada"""
+    if not PIX_CHAVE:
+        return None
+    prefixo, crc_prefixo, sufixo = _partes_campanha(campanha_id, nome_campanha)
+    resto = _campo("54", f"{valor:.2f}") + sufixo + _campo("62", _campo("05", txid)) + "6304"
+    crc = crc16(resto.encode("ascii"), crc_prefixo)
+    return f"{prefixo}{resto}{crc:04X}"
+
+
+_imagens = CacheTTL(PIX_QR_CACHE_TAMANHO, PIX_QR_CACHE_TTL)
+
+
+def _renderizar(payload: str, formato: str) -> bytes:
+    # PNG via pypng, sem exigir Pillow
+    fabrica = qrcode.image.svg.SvgPathImage if formato == "svg" else qrcode.image.pure.PyPNGImage
+    imagem = qrcode.make(payload, image_factory=fabrica, error_correction=qrcode.constants.ERROR_CORRECT_M)
+    saida = BytesIO()
+    imagem.save(saida)
+    return saida.getvalue()
+
+
+async def imagem_qrcode(payload: str, formato: str = "png") -> bytes:
+    """Imagem do QR Code do payload (em cache; a renderização roda em uma thread)"""
+    chave = (payload, formato)
+    imagem = _imagens.get(chave)
+    if imagem is None:
+        imagem = await asyncio.to_thread(_renderizar, payload, formato)
+        _imagens.set(chave, imagem)
+    return imagem
+
+
+def estatisticas() -> dict:
+    return {"campanhas": _partes_campanha.cache_info()._asdict(), "imagens": _imagens.estatisticas()}
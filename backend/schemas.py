@@ -19,6 +19,9 @@ class UserCreate(BaseModel):
             raise ValueError('CPF deve conter 11 dígitos')
         return cpf_limpo
 
+class TokenRefresh(BaseModel):
+    refresh_token: str
+
 class UserResponse(BaseModel):
     id: int
     username: str
@@ -58,8 +61,18 @@ class CampanhaUpdate(BaseModel):
     imagem_url: Optional[str] = None
     localizacao: Optional[str] = None
 
-class CampanhaResponse(CampanhaBase):
+class CampanhaResponse(BaseModel):
+    """Modelo de saída: só declara os campos, sem os validadores de entrada"""
     id: int
+    nome: str
+    tipo_categoria: Optional[str] = None
+    descricao: Optional[str] = None
+    localizacao: Optional[str] = None
+    meta_valor: float
+    website: Optional[str] = None
+    telefone: Optional[str] = None
+    email: Optional[str] = None
+    data_fim: Optional[datetime] = None
     valor_arrecadado: float
     data_inicio: datetime
     ativa: bool
@@ -101,14 +114,27 @@ class DoacaoBase(BaseModel):
 class DoacaoCreate(DoacaoBase):
     user_id: Optional[int] = None
 
-class DoacaoResponse(DoacaoBase):
+class DoacaoResponse(BaseModel):
+    """Modelo de saída: só declara os campos, sem os validadores de entrada"""
     id: int
+    campanha_id: int
+    user_id: Optional[int] = None
+    valor: float
+    doador_nome: str
+    doador_cpf: str
+    doador_email: Optional[str] = None
+    rua: str
+    numero: str
+    complemento: Optional[str] = None
+    bairro: str
+    cidade: str
+    uf: str
+    cep: str
     data_doacao: datetime
     metodo_pagamento: str
     status: str
     pix_code: Optional[str] = None
     pix_qr_code: Optional[str] = None
-    user_id: Optional[int] = None
     
     class Config:
         from_attributes = True
@@ -0,0 +1,71 @@
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+import bcrypt
+
+# Custo do bcrypt (log2 das iterações). 12 é o padrão da biblioteca.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Tamanho do pool que executa hash/verificação fora do event loop
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# "thread" (padrão, o bcrypt libera o GIL) ou "process"
+BCRYPT_EXECUTOR = os.getenv("BCRYPT_EXECUTOR", "thread")
+
+_executor: Optional[Executor] = None
+
+
+def _gerar_hash(password: str, rounds: int) -> str:
+    """Gera hash bcrypt da senha (trunca em 72 bytes se necessário)"""
+    # Limitar a 72 bytes (limite do bcrypt)
+    password_bytes = password.encode('utf-8')[:72]
+    salt = bcrypt.gensalt(rounds=rounds)
+    hashed = bcrypt.hashpw(password_bytes, salt)
+    return hashed.decode('utf-8')
+
+
+def _verificar(plain_password: str, hashed_password: str) -> bool:
+    """Verifica se a senha corresponde ao hash"""
+    # Limitar a 72 bytes (limite do bcrypt)
+    password_bytes = plain_password.encode('utf-8')[:72]
+    hashed_bytes = hashed_password.encode('utf-8')
+    return bcrypt.checkpw(password_bytes, hashed_bytes)
+
+
+def iniciar_pool() -> None:
+    """Cria o pool de workers do bcrypt (chamado no startup)"""
+    global _executor
+    if _executor is not None:
+        return
+    if BCRYPT_EXECUTOR == "process":
+        _executor = ProcessPoolExecutor(max_workers=BCRYPT_WORKERS)
+    else:
+        _executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+
+
+def encerrar_pool() -> None:
+    """Encerra o pool de workers do bcrypt (chamado no shutdown)"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+def _pool() -> Executor:
+    if _executor is None:
+        iniciar_pool()
+    return _executor
+
+
+async def hash_password(password: str) -> str:
+    """Gera o hash da senha no pool, sem bloquear o event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pool(), _gerar_hash, password, BCRYPT_ROUNDS)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verifica a senha no pool, sem bloquear o event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pool(), _verificar, plain_password, hashed_password)
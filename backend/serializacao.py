@@ -0,0 +1,63 @@
+"""Caminho rápido de saída: linhas do banco viram dicts e vão direto para JSON
+
+Os handlers devolvem `JSONRapido` já com os dicts prontos, então o FastAPI não
+revalida cada linha pelo response_model (que continua valendo para a documentação).
+"""
+import json
+from datetime import date, datetime
+from typing import Any
+
+from fastapi import Response
+
+from schemas import CampanhaResponse, DoacaoResponse
+
+try:
+    import orjson
+except ImportError:  # orjson é opcional
+    orjson = None
+
+CAMPOS_CAMPANHA = tuple(
+    campo for campo in CampanhaResponse.model_fields
+    if campo not in ("percentual_atingido", "rating")
+)
+CAMPOS_DOACAO = tuple(DoacaoResponse.model_fields)
+
+
+def _padrao(valor: Any) -> Any:
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    raise TypeError(f"Tipo não serializável: {type(valor).__name__}")
+
+
+def dumps(conteudo: Any) -> bytes:
+    """Serializa para JSON, com orjson quando instalado"""
+    if orjson is not None:
+        return orjson.dumps(conteudo)
+    return json.dumps(
+        conteudo, default=_padrao, ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class JSONRapido(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def campanha_para_dict(linha) -> dict:
+    """Mapeia uma linha de `campanhas` para o payload de resposta"""
+    dados = {campo: linha[campo] for campo in CAMPOS_CAMPANHA}
+    meta = dados["meta_valor"]
+    dados["percentual_atingido"] = (dados["valor_arrecadado"] / meta) * 100 if meta > 0 else 0
+    dados["rating"] = linha["rating"] if linha["rating"] is not None else 4.8
+    return dados
+
+
+def doacao_para_dict(linha) -> dict:
+    """Mapeia uma linha de `doacoes` para o payload de resposta"""
+    dados = {campo: linha[campo] for campo in CAMPOS_DOACAO}
+    if dados["pix_code"] and not dados["pix_qr_code"]:
+        # A imagem é gerada sob demanda pelo endpoint de QR Code
+        dados["pix_qr_code"] = f"/doacoes/{dados['id']}/qrcode"
+    return dados
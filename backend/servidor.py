@@ -0,0 +1,123 @@
+"""Ponto de entrada de produção: uvicorn com vários workers
+
+    python servidor.py
+
+- Workers: SERVIDOR_WORKERS (ou WEB_CONCURRENCY), 1 por padrão. Com `auto`, um
+  por CPU disponível, respeitando a afinidade e a cota de CPU do container
+  (cgroup). Mais de um worker é opção do operador: veja o estado por processo
+  logo abaixo.
+- uvloop e httptools quando instalados; senão o loop padrão do asyncio e o h11.
+- Keep-alive (SERVIDOR_KEEP_ALIVE) acima do idle timeout típico dos balanceadores,
+  para que o balanceador, e não o servidor, feche as conexões ociosas.
+- Cada worker é reciclado após SERVIDOR_MAX_REQUESTS requests, mais um sorteio
+  de até SERVIDOR_MAX_REQUESTS_JITTER feito em cada worker, para que workers com
+  carga igual não reiniciem todos ao mesmo tempo; o supervisor do uvicorn sobe
+  outro no lugar. Com um único worker não há supervisor, então a reciclagem
+  fica desligada.
+- No SIGTERM (redeploy) o uvicorn para de aceitar conexões, espera os requests
+  em andamento por até SERVIDOR_ENCERRAMENTO segundos e só então roda o shutdown
+  da aplicação (que desconecta do banco).
+
+Cada worker tem o seu pool de conexões (até DB_POOL_MAX) e o seu estado em
+memória: caches (até CACHE_CAMPANHAS_TTL de atraso entre workers), limites de
+admissão (multiplicados pelo número de workers) e os inscritos de SSE, que só
+recebem os eventos das confirmações feitas no mesmo worker. As chaves de
+idempotência ficam no banco e valem para todos. Com mais de um
+worker o JWT_SECRET é obrigatório: sem ele cada worker sortearia a sua chave e
+um token emitido num worker seria recusado pelos outros.
+"""
+import math
+import os
+import random
+
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+SERVIDOR_HOST = os.getenv("SERVIDOR_HOST", "0.0.0.0")
+SERVIDOR_PORTA = int(os.getenv("PORT", "8000"))
+SERVIDOR_BACKLOG = int(os.getenv("SERVIDOR_BACKLOG", "2048"))
+SERVIDOR_KEEP_ALIVE = int(os.getenv("SERVIDOR_KEEP_ALIVE", "75"))
+SERVIDOR_MAX_REQUESTS = int(os.getenv("SERVIDOR_MAX_REQUESTS", "50000"))
+SERVIDOR_MAX_REQUESTS_JITTER = int(os.getenv("SERVIDOR_MAX_REQUESTS_JITTER", str(SERVIDOR_MAX_REQUESTS // 10)))
+SERVIDOR_ENCERRAMENTO = int(os.getenv("SERVIDOR_ENCERRAMENTO", "30"))
+# IPs dos proxies confiáveis para X-Forwarded-For (o IP real alimenta o controle de admissão)
+SERVIDOR_PROXIES = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+
+def cpus_disponiveis() -> int:
+    """CPUs que o processo pode usar: afinidade limitada pela cota do cgroup v2"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as arquivo:
+            cota, periodo = arquivo.read().split()
+        if cota != "max":
+            cpus = min(cpus, max(1, math.ceil(int(cota) / int(periodo))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def _disponivel(modulo: str) -> bool:
+    try:
+        __import__(modulo)
+    except ImportError:
+        return False
+    return True
+
+
+def configuracao() -> dict:
+    """Argumentos de `uvicorn.Config` para produção"""
+    workers = os.getenv("SERVIDOR_WORKERS") or os.getenv("WEB_CONCURRENCY") or "1"
+    workers = cpus_disponiveis() if workers == "auto" else int(workers)
+    return {
+        "host": SERVIDOR_HOST,
+        "port": SERVIDOR_PORTA,
+        "workers": workers,
+        "loop": "uvloop" if _disponivel("uvloop") else "asyncio",
+        "http": "httptools" if _disponivel("httptools") else "h11",
+        "backlog": SERVIDOR_BACKLOG,
+        "timeout_keep_alive": SERVIDOR_KEEP_ALIVE,
+        "limit_max_requests": SERVIDOR_MAX_REQUESTS if workers > 1 and SERVIDOR_MAX_REQUESTS > 0 else None,
+        "timeout_graceful_shutdown": SERVIDOR_ENCERRAMENTO,
+        "proxy_headers": True,
+        "forwarded_allow_ips": SERVIDOR_PROXIES,
+        "access_log": os.getenv("SERVIDOR_ACCESS_LOG", "false").lower() in ("1", "true", "sim"),
+    }
+
+
+class Servidor(uvicorn.Server):
+    """Server do uvicorn que sorteia o limite de requests no processo de cada worker"""
+
+    def run(self, sockets=None) -> None:
+        if self.config.limit_max_requests:
+            self.config.limit_max_requests += random.randint(0, SERVIDOR_MAX_REQUESTS_JITTER)
+        super().run(sockets)
+
+
+def main() -> None:
+    config = configuracao()
+    if config["workers"] > 1 and not os.getenv("JWT_SECRET"):
+        raise SystemExit(
+            f"❌ JWT_SECRET não configurado: os {config['workers']} workers precisam da mesma chave de tokens"
+        )
+    print(
+        f"🚀 {config['workers']} worker(s) em {config['host']}:{config['port']} "
+        f"(loop={config['loop']}, http={config['http']})"
+    )
+    # O que uvicorn.run faz, mas com o Servidor acima em cada worker
+    config = uvicorn.Config("main:app", **config)
+    servidor = Servidor(config)
+    try:
+        if config.workers > 1:
+            Multiprocess(config, target=servidor.run, sockets=[config.bind_socket()]).run()
+        else:
+            servidor.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
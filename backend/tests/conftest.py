@@ -0,0 +1,82 @@
+"""Fixtures dos testes: a aplicação sobre um SQLite temporário
+
+A aplicação ASGI é chamada diretamente, sem servidor. Cada teste roda num event
+loop próprio, com startup e shutdown da aplicação e um banco recém-migrado.
+
+    cd backend && python -m pytest
+"""
+import asyncio
+import os
+import tempfile
+
+_DIRETORIO = tempfile.mkdtemp(prefix="juntosmais-testes-")
+BANCO = os.path.join(_DIRETORIO, "testes.db")
+
+# Antes de importar a aplicação: as configurações são lidas no import
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{BANCO}"
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("ADMISSAO_ATIVA", "false")
+os.environ.setdefault("JWT_SECRET", "chave-dos-testes")
+os.environ.setdefault("EXPORTACAO_LOTE", "500")
+
+import pytest  # noqa: E402
+
+import main  # noqa: E402
+from cliente_asgi import ClienteASGI  # noqa: E402
+
+
+_cliente = ClienteASGI(main.app, servidor="testes")
+
+
+@pytest.fixture
+def chamar():
+    """`await chamar(metodo, caminho, corpo=None, headers=None, guardar_corpo=True)` -> Resposta"""
+    return _cliente.request
+
+
+@pytest.fixture
+def rodar():
+    """Roda uma corrotina com a aplicação iniciada sobre um banco novo"""
+    def _rodar(cenario):
+        async def com_aplicacao():
+            for handler in main.app.router.on_startup:
+                await handler()
+            try:
+                return await cenario()
+            finally:
+                for handler in main.app.router.on_shutdown:
+                    await handler()
+
+        if os.path.exists(BANCO):
+            os.remove(BANCO)
+        return asyncio.run(com_aplicacao())
+
+    return _rodar
+
+
+@pytest.fixture
+def criar_campanha(chamar):
+    """`await criar_campanha(**campos)` -> id da campanha criada pela API"""
+    async def _criar(**campos) -> int:
+        corpo = {"nome": "Campanha de teste", "tipo_categoria": "Saúde", "meta_valor": 1000.0, **campos}
+        resposta = await chamar("POST", "/campanhas", corpo)
+        assert resposta.status == 201, resposta.corpo
+        return resposta.json()["id"]
+
+    return _criar
+
+
+@pytest.fixture
+def criar_doacao(chamar):
+    """`await criar_doacao(campanha_id, valor, **campos)` -> doação pendente criada pela API"""
+    async def _criar(campanha_id: int, valor: float = 10.0, **campos) -> dict:
+        corpo = {
+            "campanha_id": campanha_id, "valor": valor, "doador_nome": "Doador de Teste",
+            "doador_cpf": "12345678901", "rua": "Rua das Flores", "numero": "10", "bairro": "Centro",
+            "cidade": "São Paulo", "uf": "SP", "cep": "01001000", **campos,
+        }
+        resposta = await chamar("POST", "/doacoes/", corpo)
+        assert resposta.status == 201, resposta.corpo
+        return resposta.json()
+
+    return _criar
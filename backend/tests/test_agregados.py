@@ -0,0 +1,33 @@
+import agregados
+from db import database
+from models import campanhas
+
+
+def test_backfill_recalcula_valor_e_ajusta_o_contador(rodar, chamar, criar_campanha, criar_doacao):
+    async def cenario():
+        ativa = await criar_campanha()
+        inativa = await criar_campanha()
+        for campanha_id, valor in ((ativa, 30.0), (ativa, 12.5), (inativa, 40.0)):
+            doacao = await criar_doacao(campanha_id, valor)
+            assert (await chamar("PATCH", f"/doacoes/{doacao['id']}/confirmar")).status == 200
+        await database.execute(campanhas.update().where(campanhas.c.id == inativa).values(ativa=False))
+
+        # Valores divergentes das doações, com os contadores coerentes com eles
+        await database.execute(campanhas.update().values(valor_arrecadado=7.0))
+        await agregados.reconciliar(database)
+
+        processadas = await agregados.backfill_campanhas(database, recalcular_valor=True, lote=1)
+        contadores = await agregados.ler_contadores(database)
+        divergencias = await agregados.reconciliar(database, corrigir=False)
+        valores = {
+            linha["id"]: linha["valor_arrecadado"]
+            for linha in await database.fetch_all(campanhas.select())
+        }
+        return processadas, contadores, divergencias, valores[ativa], valores[inativa]
+
+    processadas, contadores, divergencias, valor_ativa, valor_inativa = rodar(cenario)
+
+    assert processadas == 2
+    assert (valor_ativa, valor_inativa) == (42.5, 40.0)
+    assert contadores[agregados.TOTAL_ARRECADADO] == 42.5
+    assert all(linha["divergencia"] == 0 for linha in divergencias.values())
@@ -0,0 +1,75 @@
+import asyncio
+import sqlite3
+
+from asyncpg.exceptions import UniqueViolationError
+from sqlalchemy import func, select
+
+import agregados
+from db import coluna_duplicada, database
+from main import MENSAGENS_DUPLICIDADE_USUARIO
+from models import users
+
+POR_GRUPO = 6
+
+
+def _cadastro(username: str, email: str, cpf: str) -> dict:
+    return {"username": username, "email": email, "cpf": cpf, "password": "senha-forte"}
+
+
+def test_cadastros_simultaneos_com_dados_repetidos(rodar, chamar):
+    # Cada grupo disputa um único campo; os demais são únicos entre todos os requests.
+    # O email contém "_cpf_" de propósito: a coluna repetida não pode ser deduzida do valor.
+    grupos = {
+        "username": [_cadastro("disputado", f"u{i}@exemplo.com", f"100000000{i:02d}") for i in range(POR_GRUPO)],
+        "email": [_cadastro(f"email{i}", "a_cpf_b@exemplo.com", f"200000000{i:02d}") for i in range(POR_GRUPO)],
+        "cpf": [_cadastro(f"cpf{i}", f"c{i}@exemplo.com", "30000000000") for i in range(POR_GRUPO)],
+    }
+
+    async def cenario():
+        respostas = await asyncio.gather(*[
+            asyncio.gather(*[chamar("POST", "/register", corpo) for corpo in corpos])
+            for corpos in grupos.values()
+        ])
+        usuarios = await database.fetch_val(select(func.count()).select_from(users))
+        contadores = await agregados.ler_contadores(database)
+        return dict(zip(grupos, respostas)), usuarios, contadores
+
+    respostas, usuarios, contadores = rodar(cenario)
+
+    for coluna, grupo in respostas.items():
+        criados = [r for r in grupo if r.status == 201]
+        recusados = [r for r in grupo if r.status != 201]
+        assert len(criados) == 1, coluna
+        assert [r.status for r in recusados] == [400] * (POR_GRUPO - 1)
+        assert {r.json()["detail"] for r in recusados} == {MENSAGENS_DUPLICIDADE_USUARIO[coluna]}
+    assert usuarios == len(grupos)
+    assert contadores[agregados.TOTAL_USUARIOS] == len(grupos)
+
+
+def test_cadastro_repetido_informa_o_campo(rodar, chamar):
+    async def cenario():
+        primeiro = await chamar("POST", "/register", _cadastro("maria", "maria@exemplo.com", "12345678901"))
+        mesmo_email = await chamar("POST", "/register", _cadastro("maria2", "maria@exemplo.com", "12345678902"))
+        mesmo_cpf = await chamar("POST", "/register", _cadastro("maria3", "maria3@exemplo.com", "123.456.789-01"))
+        return primeiro, mesmo_email, mesmo_cpf
+
+    primeiro, mesmo_email, mesmo_cpf = rodar(cenario)
+
+    assert primeiro.status == 201
+    assert (mesmo_email.status, mesmo_email.json()["detail"]) == (400, MENSAGENS_DUPLICIDADE_USUARIO["email"])
+    assert (mesmo_cpf.status, mesmo_cpf.json()["detail"]) == (400, MENSAGENS_DUPLICIDADE_USUARIO["cpf"])
+
+
+def test_coluna_duplicada_ignora_os_valores():
+    violacao = UniqueViolationError("duplicate key value violates unique constraint")
+    violacao.constraint_name = "users_email_key"
+    violacao.detail = "Key (email)=(a_cpf_b@exemplo.com) already exists."
+    assert coluna_duplicada(violacao, MENSAGENS_DUPLICIDADE_USUARIO) == "email"
+
+    violacao.constraint_name = "users_cpf_key"
+    violacao.detail = "Key (cpf)=(1_username_1) already exists."
+    assert coluna_duplicada(violacao, MENSAGENS_DUPLICIDADE_USUARIO) == "cpf"
+
+    erro = sqlite3.IntegrityError("UNIQUE constraint failed: users.username")
+    assert coluna_duplicada(erro, MENSAGENS_DUPLICIDADE_USUARIO) == "username"
+    assert coluna_duplicada(sqlite3.IntegrityError("NOT NULL constraint failed: users.email"), ["email"]) is None
@@ -0,0 +1,37 @@
+from db import database, roteador
+from models import campanhas
+
+
+class _ReplicaAtrasada:
+    """Réplica parada no estado de `linha`: não viu nenhuma escrita posterior"""
+
+    def __init__(self, linha):
+        self.linha = linha
+
+    async def fetch_one(self, query, values=None):
+        return self.linha
+
+    async def fetch_all(self, query, values=None):
+        return [self.linha]
+
+
+def test_cache_de_campanhas_nao_e_preenchido_por_replica_atrasada(rodar, chamar, criar_campanha, monkeypatch):
+    async def cenario():
+        campanha_id = await criar_campanha()
+        replica = _ReplicaAtrasada(await database.fetch_one(campanhas.select().where(campanhas.c.id == campanha_id)))
+        monkeypatch.setattr(roteador, "leitura", lambda: replica)
+        monkeypatch.setattr(roteador, "fetch_one", replica.fetch_one)
+
+        assert (await chamar("GET", f"/campanhas/{campanha_id}")).json()["ativa"] is True
+        assert [c["id"] for c in (await chamar("GET", "/campanhas")).json()] == [campanha_id]
+        # A desativação invalida os caches; a próxima leitura não pode trazer a versão anterior de volta
+        assert (await chamar("DELETE", f"/campanhas/{campanha_id}")).status == 200
+        return (
+            (await chamar("GET", f"/campanhas/{campanha_id}")).json(),
+            (await chamar("GET", "/campanhas")).json(),
+        )
+
+    detalhe, ativas = rodar(cenario)
+
+    assert detalhe["ativa"] is False
+    assert ativas == []
@@ -0,0 +1,45 @@
+import asyncio
+
+from sqlalchemy import func, select
+
+import agregados
+from db import database
+from models import campanhas, doacoes_diarias
+
+N = 40
+
+
+def test_confirmacoes_paralelas_somam_exatamente(rodar, chamar, criar_campanha, criar_doacao):
+    # Múltiplos de 0,25 são exatos em ponto flutuante: a soma não depende da ordem
+    valores = [1 + i * 0.25 for i in range(N)]
+
+    async def cenario():
+        campanha_id = await criar_campanha()
+        ids = [(await criar_doacao(campanha_id, valor))["id"] for valor in valores]
+        # Cada doação confirmada duas vezes ao mesmo tempo: só uma das duas pode valer
+        respostas = await asyncio.gather(*[
+            chamar("PATCH", f"/doacoes/{id}/confirmar") for id in ids for _ in range(2)
+        ])
+        campanha = await database.fetch_one(campanhas.select().where(campanhas.c.id == campanha_id))
+        contadores = await agregados.ler_contadores(database)
+        divergencias = await agregados.reconciliar(database, corrigir=False)
+        rollup = await database.fetch_one(
+            select(func.sum(doacoes_diarias.c.quantidade), func.sum(doacoes_diarias.c.total))
+            .where((doacoes_diarias.c.campanha_id == campanha_id) & (doacoes_diarias.c.status == "confirmado"))
+        )
+        return respostas, campanha, contadores, divergencias, (rollup[0], rollup[1])
+
+    respostas, campanha, contadores, divergencias, rollup = rodar(cenario)
+
+    status = sorted(r.status for r in respostas)
+    assert status == [200] * N + [400] * N
+    assert {r.json()["detail"] for r in respostas if r.status == 400} == {"Doação já confirmada"}
+
+    assert campanha["valor_arrecadado"] == sum(valores)
+    assert campanha["total_doacoes"] == N
+    assert (campanha["doacao_minima"], campanha["doacao_maxima"]) == (min(valores), max(valores))
+
+    assert contadores[agregados.TOTAL_DOACOES] == N
+    assert contadores[agregados.TOTAL_ARRECADADO] == sum(valores)
+    assert all(linha["divergencia"] == 0 for linha in divergencias.values())
+    assert rollup == (N, sum(valores))
@@ -0,0 +1,46 @@
+import json
+
+import main
+from db import database
+
+
+def _evento(mensagem: bytes) -> dict:
+    evento, dados = mensagem.decode().strip().split("\n")
+    assert evento == "event: progresso"
+    return json.loads(dados.removeprefix("data: "))
+
+
+def test_confirmacao_durante_o_snapshot_chega_ao_espectador(rodar, chamar, criar_campanha, criar_doacao,
+                                                            monkeypatch):
+    async def cenario():
+        campanha_id = await criar_campanha()
+        doacao = await criar_doacao(campanha_id, 25.0)
+
+        # A confirmação é feita e publicada logo antes da leitura do snapshot
+        fetch_one = database.fetch_one
+        pendente = [True]
+
+        async def fetch_one_com_confirmacao(query, values=None):
+            if pendente:
+                pendente.clear()
+                resposta = await chamar("PATCH", f"/doacoes/{doacao['id']}/confirmar")
+                assert resposta.status == 200
+            return await fetch_one(query, values)
+
+        monkeypatch.setattr(database, "fetch_one", fetch_one_com_confirmacao)
+        resposta = await main.eventos_campanha(campanha_id)
+        monkeypatch.undo()
+
+        corpo = resposta.body_iterator
+        try:
+            mensagens = [await anext(corpo), await anext(corpo)]
+        finally:
+            await corpo.aclose()
+        return mensagens
+
+    snapshot, atualizacao = map(_evento, rodar(cenario))
+
+    assert snapshot["valor_arrecadado"] == 25.0
+    assert atualizacao["valor_arrecadado"] == 25.0
+    assert atualizacao["total_doacoes"] == 1
+    assert main.eventos.broadcaster.total_inscritos == 0
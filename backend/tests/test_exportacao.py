@@ -0,0 +1,82 @@
+import csv
+import io
+import os
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import manutencao
+from db import database
+from models import doacoes, doacoes_arquivo
+
+# A memória depende do bloco (EXPORTACAO_LOTE), não do total: 30 mil linhas já são
+# 60 blocos. Para o volume de produção, rode com EXPORTACAO_TESTE_LINHAS=1000000.
+TOTAL = int(os.getenv("EXPORTACAO_TESTE_LINHAS", "30000"))
+# Pico de memória Python permitido durante a exportação inteira; materializar as
+# 30 mil linhas de uma vez passaria de dezenas de MB
+TETO_BYTES = 3 * 1024 * 1024
+
+
+def _doacao(campanha_id: int, i: int, inicio: datetime) -> dict:
+    return {
+        "id": i + 1, "campanha_id": campanha_id, "valor": 10.0 + i % 90, "doador_nome": f"Doador {i}",
+        "doador_cpf": f"{i:011d}", "doador_email": f"doador{i}@exemplo.com",
+        "rua": "Rua das Flores", "numero": str(i), "bairro": "Centro", "cidade": "São Paulo",
+        "uf": "SP", "cep": "01001000", "data_doacao": inicio + timedelta(minutes=i),
+        "metodo_pagamento": "PIX", "status": "cancelado" if i % 4 == 0 else "confirmado",
+    }
+
+
+async def _inserir_doacoes(campanha_id: int, total: int, lote: int = 500) -> None:
+    """Doações da campanha; as canceladas (uma em quatro) já arquivadas"""
+    inicio = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for primeira in range(0, total, lote):
+        linhas = [_doacao(campanha_id, i, inicio) for i in range(primeira, min(primeira + lote, total))]
+        for tabela in (doacoes, doacoes_arquivo):
+            valores = [linha for linha in linhas if (linha["status"] == "cancelado") == (tabela is doacoes_arquivo)]
+            await database.execute(tabela.insert().values(valores))
+
+
+@pytest.mark.parametrize("formato", ["csv", "parquet"])
+def test_exportacao_grande_com_memoria_limitada(formato, rodar, chamar, criar_campanha):
+    if formato == "parquet":
+        pytest.importorskip("pyarrow")
+
+    async def cenario():
+        campanha_id = await criar_campanha()
+        await _inserir_doacoes(campanha_id, TOTAL)
+        tracemalloc.start()
+        try:
+            resposta = await chamar(
+                "GET", f"/doacoes/campanha/{campanha_id}/export?formato={formato}", guardar_corpo=False
+            )
+            _, pico = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return resposta, pico
+
+    resposta, pico = rodar(cenario)
+
+    assert resposta.status == 200
+    if formato == "csv":
+        assert resposta.tamanho > TETO_BYTES
+    assert pico < TETO_BYTES
+
+
+def test_exportacao_inclui_as_doacoes_arquivadas(rodar, chamar, criar_campanha, criar_doacao):
+    async def cenario():
+        campanha_id = await criar_campanha()
+        ids = [(await criar_doacao(campanha_id, valor))["id"] for valor in (10.0, 20.0, 30.0)]
+        assert (await chamar("PATCH", f"/doacoes/{ids[1]}/cancelar")).status == 200
+        arquivadas = await manutencao.arquivar(database, apos_dias=-1)
+        resposta = await chamar("GET", f"/doacoes/campanha/{campanha_id}/export?formato=csv")
+        return ids, arquivadas, resposta
+
+    ids, arquivadas, resposta = rodar(cenario)
+
+    assert arquivadas == 1
+    linhas = list(csv.DictReader(io.StringIO(resposta.corpo.decode("utf-8-sig"))))
+    # Mais recentes primeiro, a arquivada no seu lugar
+    assert [int(linha["id"]) for linha in linhas] == ids[::-1]
+    assert [linha["status"] for linha in linhas] == ["pendente", "cancelado", "pendente"]
@@ -0,0 +1,93 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from fastapi import HTTPException
+from sqlalchemy import func, select
+
+import idempotencia
+import main
+from db import database
+from idempotencia import HEADER_REPETIDA, Idempotencia
+from models import doacoes, idempotencia as tabela
+
+
+def _worker() -> Idempotencia:
+    """Outra instância do armazenamento, como a de outro worker ou de um worker reciclado"""
+    return Idempotencia(database, ttl=3600, reserva_ttl=60, espera=5)
+
+
+def test_repeticao_em_outro_worker_nao_duplica_a_doacao(rodar, chamar, criar_campanha, monkeypatch):
+    async def cenario():
+        campanha_id = await criar_campanha()
+        corpo = {
+            "campanha_id": campanha_id, "valor": 15.0, "doador_nome": "Doador de Teste",
+            "doador_cpf": "12345678901", "rua": "Rua das Flores", "numero": "10", "bairro": "Centro",
+            "cidade": "São Paulo", "uf": "SP", "cep": "01001000",
+        }
+        chave = {"Idempotency-Key": "doacao-1"}
+        primeira = await chamar("POST", "/doacoes/", corpo, chave)
+        # A repetição cai num worker que não atendeu o primeiro request
+        monkeypatch.setattr(main, "idempotencia", _worker())
+        repetida = await chamar("POST", "/doacoes/", corpo, chave)
+        conflito = await chamar("POST", "/doacoes/", {**corpo, "valor": 20.0}, chave)
+        total = await database.fetch_val(select(func.count()).select_from(doacoes))
+        return primeira, repetida, conflito, total
+
+    primeira, repetida, conflito, total = rodar(cenario)
+
+    assert primeira.status == 201
+    assert repetida.status == 201
+    assert repetida.corpo == primeira.corpo
+    assert repetida.headers[HEADER_REPETIDA.lower()] == "true"
+    assert conflito.status == 422
+    assert total == 1
+
+
+def test_request_simultaneo_em_outro_worker_espera_o_original(rodar):
+    execucoes = []
+
+    async def handler():
+        execucoes.append(1)
+        await asyncio.sleep(0.2)
+        return {"ok": True}
+
+    async def cenario():
+        return await asyncio.gather(
+            _worker().executar("operacao", "chave", {"a": 1}, handler),
+            _worker().executar("operacao", "chave", {"a": 1}, handler),
+        )
+
+    respostas = rodar(cenario)
+
+    assert len(execucoes) == 1
+    assert [r.body for r in respostas] == [b'{"ok":true}'] * 2
+    assert sorted(HEADER_REPETIDA in r.headers for r in respostas) == [False, True]
+
+
+def test_erro_temporario_e_reserva_abandonada_liberam_a_chave(rodar):
+    async def indisponivel():
+        raise HTTPException(status_code=503, detail="Indisponível")
+
+    async def cenario():
+        try:
+            await _worker().executar("operacao", "temporaria", {}, indisponivel)
+        except HTTPException as e:
+            assert e.status_code == 503
+        depois_do_erro = await _worker().executar("operacao", "temporaria", {}, lambda: asyncio.sleep(0, {"ok": 1}))
+
+        # Reserva de um processo que caiu no meio do request
+        await database.execute(tabela.insert().values(
+            escopo="operacao", chave="abandonada", impressao="x",
+            criada_em=datetime.now(timezone.utc) - timedelta(minutes=5)
+        ))
+        abandonada = await _worker().executar("operacao", "abandonada", {}, lambda: asyncio.sleep(0, {"ok": 2}))
+
+        apagadas = await idempotencia.limpar_vencidas(database, ttl=-1)
+        restantes = await database.fetch_val(select(func.count()).select_from(tabela))
+        return depois_do_erro, abandonada, apagadas, restantes
+
+    depois_do_erro, abandonada, apagadas, restantes = rodar(cenario)
+
+    assert (depois_do_erro.status_code, depois_do_erro.body) == (200, b'{"ok":1}')
+    assert (abandonada.status_code, abandonada.body) == (200, b'{"ok":2}')
+    assert (apagadas, restantes) == (2, 0)
@@ -0,0 +1,34 @@
+import asyncio
+from datetime import datetime, timezone
+
+import ingestao
+from db import database
+
+
+def _valores(campanha_id: int, nome: str, txid: str) -> dict:
+    return {
+        "campanha_id": campanha_id, "valor": 10.0, "doador_nome": nome, "doador_cpf": "12345678901",
+        "rua": "Rua das Flores", "numero": "10", "bairro": "Centro", "cidade": "São Paulo", "uf": "SP",
+        "cep": "01001000", "status": "pendente", "metodo_pagamento": "PIX",
+        "data_doacao": datetime.now(timezone.utc), "pix_txid": txid,
+    }
+
+
+def test_txid_repetido_no_lote_nao_entrega_a_linha_de_outro_doador(rodar, criar_campanha):
+    async def cenario():
+        campanha_id = await criar_campanha()
+        ingestor = ingestao.IngestorDoacoes(lote_max=10, espera=0.05, fila_max=10)
+        ingestor.iniciar(database)
+        try:
+            return await asyncio.gather(*[
+                ingestor.inserir(_valores(campanha_id, nome, txid))
+                for nome, txid in (("Ana", "txid-repetido"), ("Bruno", "txid-repetido"), ("Carla", "txid-unico"))
+            ], return_exceptions=True)
+        finally:
+            await ingestor.encerrar()
+
+    ana, bruno, carla = rodar(cenario)
+
+    assert ana["doador_nome"] == "Ana"
+    assert isinstance(bruno, Exception)
+    assert carla["doador_nome"] == "Carla"
@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, select
+
+import manutencao
+from db import database
+from models import doacoes, doacoes_arquivo
+
+
+def test_carencia_do_arquivamento_conta_da_mudanca_de_status(rodar, chamar, criar_campanha, criar_doacao):
+    async def cenario():
+        campanha_id = await criar_campanha()
+        doacao = await criar_doacao(campanha_id)
+        # Criada há 8 dias e cancelada agora: ainda dentro da carência de 7 dias
+        oito_dias = datetime.now(timezone.utc) - timedelta(days=8)
+        await database.execute(doacoes.update().where(doacoes.c.id == doacao["id"]).values(data_doacao=oito_dias))
+        cancelamento = await chamar("PATCH", f"/doacoes/{doacao['id']}/cancelar")
+        arquivadas_agora = await manutencao.arquivar(database, apos_dias=7)
+
+        await database.execute(
+            doacoes.update().where(doacoes.c.id == doacao["id"]).values(status_alterado_em=oito_dias)
+        )
+        arquivadas_depois = await manutencao.arquivar(database, apos_dias=7)
+        no_arquivo = await database.fetch_val(select(func.count()).select_from(doacoes_arquivo))
+        return cancelamento.status, arquivadas_agora, arquivadas_depois, no_arquivo
+
+    assert rodar(cenario) == (200, 0, 1, 1)
+
+
+def test_expiracao_conta_so_as_doacoes_expiradas(rodar, chamar, criar_campanha, criar_doacao):
+    async def cenario():
+        campanha_id = await criar_campanha()
+        ids = [(await criar_doacao(campanha_id))["id"] for _ in range(3)]
+        dois_dias = datetime.now(timezone.utc) - timedelta(days=2)
+        await database.execute(doacoes.update().where(doacoes.c.id.in_(ids)).values(data_doacao=dois_dias))
+        await chamar("PATCH", f"/doacoes/{ids[0]}/confirmar")
+
+        expiradas = await manutencao.expirar_pendentes(database, ttl_horas=24)
+        status = await database.fetch_all(select(doacoes.c.status, doacoes.c.status_alterado_em).order_by(doacoes.c.id))
+        return expiradas, [linha["status"] for linha in status], all(linha["status_alterado_em"] for linha in status)
+
+    assert rodar(cenario) == (2, ["confirmado", "expirado", "expirado"], True)
@@ -0,0 +1,131 @@
+"""Tokens de sessão assinados (JWT HS256), emitidos no login
+
+O token de acesso é curto (TOKEN_ACESSO_TTL) e carrega os dados do usuário
+nas claims: quem o apresenta não precisa de bcrypt nem de banco para provar
+quem é. O refresh (TOKEN_REFRESH_TTL) só serve para obter um novo par em
+POST /token/refresh. A verificação é um HMAC-SHA256; tokens já verificados
+ficam num cache pequeno, e a expiração é conferida a cada uso.
+
+Os tokens não têm estado no servidor, então não há revogação antes de
+expirarem. Sem JWT_SECRET, uma chave aleatória é gerada por processo: os
+tokens não sobrevivem a um restart, e por isso servidor.py se recusa a subir
+mais de um worker sem ela.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+from typing import Optional
+
+from fastapi import HTTPException
+
+from cache import CacheTTL
+from serializacao import dumps
+
+logger = logging.getLogger("uvicorn.error")
+
+JWT_SECRET = os.getenv("JWT_SECRET")
+TOKEN_ACESSO_TTL = int(os.getenv("TOKEN_ACESSO_TTL", "900"))
+TOKEN_REFRESH_TTL = int(os.getenv("TOKEN_REFRESH_TTL", str(7 * 24 * 3600)))
+TOKEN_CACHE_TAMANHO = int(os.getenv("TOKEN_CACHE_TAMANHO", "10000"))
+
+if not JWT_SECRET:
+    logger.warning("JWT_SECRET não configurado: usando uma chave aleatória deste processo")
+_CHAVE = JWT_SECRET.encode() if JWT_SECRET else secrets.token_bytes(32)
+
+ACESSO = "access"
+REFRESH = "refresh"
+
+
+def _b64(dados: bytes) -> bytes:
+    return base64.urlsafe_b64encode(dados).rstrip(b"=")
+
+
+def _de_b64(dados: str) -> bytes:
+    return base64.urlsafe_b64decode(dados + "=" * (-len(dados) % 4))
+
+
+_CABECALHO = _b64(dumps({"alg": "HS256", "typ": "JWT"}))
+
+
+def _assinar(conteudo: bytes) -> bytes:
+    return _b64(hmac.new(_CHAVE, conteudo, hashlib.sha256).digest())
+
+
+def _codificar(claims: dict) -> str:
+    conteudo = _CABECALHO + b"." + _b64(dumps(claims))
+    return (conteudo + b"." + _assinar(conteudo)).decode("ascii")
+
+
+def _claims_usuario(usuario) -> dict:
+    return {"sub": str(usuario["id"]), "username": usuario["username"], "email": usuario["email"], "cpf": usuario["cpf"]}
+
+
+def emitir(usuario) -> dict:
+    """Par de tokens (acesso e refresh) para o usuário"""
+    agora = int(time.time())
+    acesso = {**_claims_usuario(usuario), "typ": ACESSO, "iat": agora, "exp": agora + TOKEN_ACESSO_TTL}
+    refresh = {"sub": str(usuario["id"]), "typ": REFRESH, "iat": agora, "exp": agora + TOKEN_REFRESH_TTL}
+    return {
+        "token": _codificar(acesso),
+        "refresh_token": _codificar(refresh),
+        "token_type": "bearer",
+        "expires_in": TOKEN_ACESSO_TTL,
+    }
+
+
+_verificados = CacheTTL(TOKEN_CACHE_TAMANHO, TOKEN_ACESSO_TTL)
+invalidos = 0
+
+
+def _invalido(detalhe: str = "Token inválido") -> HTTPException:
+    global invalidos
+    invalidos += 1
+    return HTTPException(status_code=401, detail=detalhe, headers={"WWW-Authenticate": "Bearer"})
+
+
+def verificar(token: str, tipo: str = ACESSO) -> dict:
+    """Claims do token se a assinatura, o tipo e a validade conferem; senão 401"""
+    claims = _verificados.get(token)
+    if claims is None:
+        try:
+            conteudo, _, assinatura = token.encode("ascii").rpartition(b".")
+            cabecalho, _, corpo = conteudo.partition(b".")
+        except UnicodeEncodeError:
+            raise _invalido()
+        if cabecalho != _CABECALHO or not hmac.compare_digest(assinatura, _assinar(conteudo)):
+            raise _invalido()
+        try:
+            claims = json.loads(_de_b64(corpo.decode("ascii")))
+        except ValueError:
+            raise _invalido()
+        _verificados.set(token, claims)
+
+    if claims.get("typ") != tipo:
+        raise _invalido()
+    if claims.get("exp", 0) <= time.time():
+        raise _invalido("Token expirado")
+    return claims
+
+
+def do_cabecalho(authorization: Optional[str]) -> Optional[dict]:
+    """Claims do `Authorization: Bearer <token>`; None sem o cabeçalho, 401 se inválido"""
+    if not authorization:
+        return None
+    esquema, _, token = authorization.partition(" ")
+    if esquema.lower() != "bearer" or not token:
+        raise _invalido()
+    return verificar(token.strip())
+
+
+def usuario(claims: dict) -> dict:
+    """Perfil do usuário a partir das claims do token de acesso"""
+    return {"id": int(claims["sub"]), "username": claims["username"], "email": claims["email"], "cpf": claims["cpf"]}
+
+
+def estatisticas() -> dict:
+    return {**_verificados.estatisticas(), "invalidos": invalidos}